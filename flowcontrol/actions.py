@@ -1,4 +1,5 @@
 import logging
+from collections import ChainMap
 
 from django.conf import settings
 from django.core.mail import send_mail
@@ -232,7 +233,8 @@ class SendAlertAction(BaseAction):
     def run(self, *, run, obj, config: EmailAlert) -> FlowDirective:
         if config.templated:
             template = Template(config.body, engine=get_engine())
-            body = template.render(Context(self.get_context()))
+            # Tags like {% now ... as var %} assign to the top context layer
+            body = template.render(Context(ChainMap({}, self.get_context())))
         else:
             body = config.body
         if config.recipient:
@@ -21,8 +21,9 @@ from treebeard.forms import movenodeform_factory
 from flowcontrol.widgets import ConditionExpressionWidget
 
 from .engine import execute_flowrun
-from .models import Flow, FlowAction, FlowRun, Trigger
+from .models import Flow, FlowAction, FlowRun, FlowRunArchive, FlowRunEvent, Trigger
 from .registry import action_registry
+from .triggers import invalidate_trigger_cache
 from .utils import ForeignKeyFilter, duplicate_action
 
 
@@ -87,6 +88,7 @@ class FlowAdmin(admin.ModelAdmin):
         This sets the active_at field to the current time.
         """
         queryset.update(active_at=timezone.now())
+        invalidate_trigger_cache()
 
     @admin.action(description=_("Deactivate selected flows"))
     def deactivate_flows(self, request, queryset):
@@ -95,6 +97,7 @@ class FlowAdmin(admin.ModelAdmin):
         This sets the active_at field to the current time.
         """
         queryset.update(active_at=None)
+        invalidate_trigger_cache()
 
     def get_urls(self):
         urls = super().get_urls()
@@ -142,9 +145,11 @@ class FlowAdmin(admin.ModelAdmin):
             new_flow = Flow.objects.create(
                 name=f"{flow.name} (copy)",
                 description=flow.description,
+                priority=flow.priority,
                 max_concurrent=flow.max_concurrent,
                 max_per_object=flow.max_per_object,
                 max_concurrent_per_object=flow.max_concurrent_per_object,
+                retention_days=flow.retention_days,
                 content_type=flow.content_type,
                 condition=flow.condition,
             )
@@ -440,6 +445,20 @@ class FlowActionSubAdmin(TreeAdmin):
             return redirect("admin:flowcontrol-flow-list_actions", self.flow.id)
 
 
+class FlowRunEventInline(admin.TabularInline):
+    model = FlowRunEvent
+    fields = ("timestamp", "level", "action", "message", "data")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("action")
+
+
 @admin.register(FlowRun)
 class FlowRunAdmin(admin.ModelAdmin):
     add_form = modelform_factory(
@@ -451,6 +470,7 @@ class FlowRunAdmin(admin.ModelAdmin):
         "content_object",
         "status",
         "outcome",
+        "priority",
         "created_at",
         "action",
         "continue_after",
@@ -469,6 +489,8 @@ class FlowRunAdmin(admin.ModelAdmin):
         "parent_run",
         "trigger",
         "repeat_action",
+        "lease_owner",
+        "lease_expires_at",
     )
     raw_id_fields = (
         "flow",
@@ -480,12 +502,11 @@ class FlowRunAdmin(admin.ModelAdmin):
     )
 
     actions = ["execute_flowrun"]
+    inlines = [FlowRunEventInline]
 
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
-        return queryset.select_related("flow").prefetch_related(
-            "content_type", "action"
-        )
+        return queryset.with_flow().select_related("content_type", "action")
 
     @admin.display(description=_("Content Object"))
     def content_object(self, obj):
@@ -524,6 +545,47 @@ class FlowRunAdmin(admin.ModelAdmin):
         for run in queryset:
             execute_flowrun(run)
 
+    def change_view(self, request, object_id, form_url="", extra_context=None):
+        # Links to runs that were archived since lead to the archived run
+        if (
+            object_id.isdigit()
+            and not FlowRun.objects.filter(id=object_id).exists()
+            and FlowRunArchive.objects.filter(id=object_id).exists()
+        ):
+            return redirect("admin:flowcontrol_flowrunarchive_change", object_id)
+        return super().change_view(request, object_id, form_url, extra_context)
+
+
+@admin.register(FlowRunArchive)
+class FlowRunArchiveAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "flow",
+        "content_object",
+        "outcome",
+        "created_at",
+        "done_at",
+        "archived_at",
+    )
+    list_filter = (
+        "outcome",
+        ("flow", ForeignKeyFilter),
+    )
+    search_fields = ("flow__name",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("flow", "content_type")
+
+    @admin.display(description=_("Content Object"))
+    def content_object(self, obj):
+        return obj.content_object
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 class TriggerAdminForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
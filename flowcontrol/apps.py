@@ -7,4 +7,4 @@ class FlowcontrolConfig(AppConfig):
 
     def ready(self):
         # Import the action registry to ensure it's initialized
-        from . import actions  # noqa: F401
+        from . import actions, plan, triggers  # noqa: F401
@@ -0,0 +1,140 @@
+import logging
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Optional, Union
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+
+from . import conf
+from .models import Flow, FlowRun, FlowRunArchive, FlowRunEvent
+from .retention import EVENT_EXPORT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+def archive_flowrun(run: FlowRun) -> bool:
+    """
+    Move a finished flow run with its events to the archive table.
+
+    Args:
+        run (FlowRun): The finished flow run.
+
+    Returns:
+        True if the run was archived, False if it is not done.
+    """
+    return _archive_chunk([run.id]) > 0
+
+
+def archive_finished_flowrun(run: FlowRun):
+    """
+    Archive a flow run that was just finished if `FLOWCONTROL_ARCHIVE` is
+    "immediate".
+    """
+    if conf.get_archive_mode() != "immediate":
+        return
+    archive_flowrun(run)
+
+
+def archive_flowruns(
+    queryset: Optional[models.QuerySet[FlowRun]] = None,
+    chunk_size: int = 1000,
+    before: Optional[datetime] = None,
+) -> int:
+    """
+    Move finished flow runs with their events to the archive table in chunks.
+
+    Runs are paged through by id, each chunk is copied and deleted in its
+    own transaction so the table is never locked for long.
+
+    Args:
+        queryset (Optional[QuerySet]): Runs to archive. Defaults to all finished runs.
+        chunk_size (int): Number of runs to archive per transaction.
+        before (Optional[datetime]): Only archive runs finished before this time.
+
+    Returns:
+        The number of archived flow runs.
+    """
+    if queryset is None:
+        queryset = FlowRun.objects.all()
+    queryset = queryset.filter(status=FlowRun.Status.DONE)
+    if before is not None:
+        queryset = queryset.filter(done_at__lt=before)
+
+    count = 0
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+        count += _archive_chunk(ids)
+        logger.debug("Archived %d flow runs up to id %d", count, last_id)
+    return count
+
+
+def _archive_chunk(ids: list[int]) -> int:
+    with transaction.atomic():
+        # Runs restarted in the meantime are no longer done
+        runs = list(
+            FlowRun.objects.select_for_update()
+            .filter(id__in=ids, status=FlowRun.Status.DONE)
+            .order_by("id")
+        )
+        if not runs:
+            return 0
+        run_ids = [run.id for run in runs]
+        events = defaultdict(list)
+        for event in (
+            FlowRunEvent.objects.filter(run_id__in=run_ids)
+            .order_by("id")
+            .values("run_id", *EVENT_EXPORT_FIELDS)
+        ):
+            events[event.pop("run_id")].append(event)
+        FlowRunArchive.objects.bulk_create(
+            [FlowRunArchive.from_flowrun(run, events[run.id]) for run in runs]
+        )
+        # Events are deleted by cascade, child runs lose their parent link
+        FlowRun.objects.filter(id__in=run_ids).delete()
+    return len(runs)
+
+
+def get_archived_flowruns_for_object(
+    obj: models.Model,
+) -> models.QuerySet[FlowRunArchive]:
+    ct = ContentType.objects.get_for_model(obj)
+    return FlowRunArchive.objects.filter(content_type=ct, object_id=obj.pk)
+
+
+def merge_flowruns(
+    runs: Iterable[FlowRun], archived_runs: Iterable[FlowRunArchive]
+) -> list[Union[FlowRun, FlowRunArchive]]:
+    """
+    Returns live and archived flow runs as one list, newest first.
+    """
+    return sorted(
+        [*runs, *archived_runs], key=lambda run: (run.created_at, run.id), reverse=True
+    )
+
+
+def count_archived_flowruns(
+    flow: Flow, content_type_id: int, object_ids: Iterable
+) -> Counter:
+    """
+    Returns the number of archived runs of the flow per
+    `(content_type_id, object_id)`.
+    """
+    rows = (
+        FlowRunArchive.objects.filter(
+            flow=flow, content_type_id=content_type_id, object_id__in=object_ids
+        )
+        .order_by()
+        .values("object_id")
+        .annotate(count=models.Count("id"))
+    )
+    return Counter({(content_type_id, row["object_id"]): row["count"] for row in rows})
@@ -1,9 +1,12 @@
+from collections.abc import Iterator, Mapping
 from enum import IntEnum
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 from django.db.models import Model
 from django.utils.translation import gettext_lazy as _
 
+from asgiref.sync import sync_to_async
+
 if TYPE_CHECKING:
     from .models.core import FlowRun
 
@@ -18,6 +21,54 @@ class FlowDirective(IntEnum):
     SUSPEND_AND_REPEAT = 6
 
 
+class ActionContext(Mapping):
+    """
+    Read-only context of actions and conditions.
+
+    Variables provided by the engine, like `object`, take precedence over
+    the state. With a run, its state is looked up on every access, so the
+    context sees changes to `run.state` without copying the state.
+    """
+
+    __slots__ = ("_run", "_state", "variables")
+
+    def __init__(
+        self,
+        state: Optional[Mapping] = None,
+        run: Optional["FlowRun"] = None,
+        **variables: Any,
+    ):
+        self._run = run
+        self._state = {} if state is None else state
+        self.variables = variables
+
+    @property
+    def state(self) -> Mapping:
+        if self._run is not None:
+            return self._run.state
+        return self._state
+
+    def __getitem__(self, key):
+        if key in self.variables:
+            return self.variables[key]
+        return self.state[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.variables or key in self.state
+
+    def __iter__(self) -> Iterator:
+        yield from self.variables
+        yield from (key for key in self.state if key not in self.variables)
+
+    def __len__(self) -> int:
+        return len(self.variables) + sum(
+            1 for key in self.state if key not in self.variables
+        )
+
+    def copy(self) -> dict:
+        return dict(self)
+
+
 class BaseAction:
     verbose_name = _("Base Action")
     model: Optional[Model] = None
@@ -46,7 +97,7 @@ class BaseAction:
         This method can be overridden in subclasses to provide additional context.
 
         Returns:
-            The context dictionary for the flow run.
+            The read-only context of the flow run, its state and `object`.
         """
         return self.context
 
@@ -94,3 +145,50 @@ class BaseAction:
         if not self.has_children:
             return
         raise NotImplementedError("Subclasses must implement this method.")
+
+    async def arun(
+        self,
+        *,
+        run: "FlowRun",
+        obj: Optional[Model] = None,
+        config: Optional[Model] = None,
+    ) -> Optional[FlowDirective]:
+        """
+        Async version of `run` used by the async engine.
+        Override this in actions that wait on I/O. By default it calls `run`
+        in a thread with `sync_to_async`.
+
+        Args:
+            run (FlowRun): The FlowRun instance to execute.
+            obj (Optional[Model]): The model instance associated with the action.
+            config (Optional[Model]): The configuration model instance for the action.
+
+        Returns:
+            Optional[FlowDirective]: The flow directive indicating the next action to take.
+                                     FlowDirective.CONTINUE is used if None.
+        """
+        return await sync_to_async(self.run)(run=run, obj=obj, config=config)
+
+    async def areturn_from_children(
+        self,
+        *,
+        run: "FlowRun",
+        obj: Optional[Model] = None,
+        config: Optional[Model] = None,
+    ) -> Optional[FlowDirective]:
+        """
+        Async version of `return_from_children` used by the async engine.
+        By default it calls `return_from_children` in a thread with `sync_to_async`.
+
+        Args:
+            run (FlowRun): The FlowRun instance to execute.
+            obj (Optional[Model]): The model instance associated with the action.
+            config (Optional[Model]): The configuration model instance for the action.
+
+        Returns:
+            Optional[FlowDirective]: The flow directive indicating the next action to take.
+                                     FlowDirective.CONTINUE is used if None.
+        """
+        return await sync_to_async(self.return_from_children)(
+            run=run, obj=obj, config=config
+        )
@@ -0,0 +1,340 @@
+import platform
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable
+from typing import NamedTuple, Optional
+
+import django
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .actions import ForLoopAction, IfAction, UpdateStateAction, WhileLoopAction
+from .engine import continue_flowruns, create_flowrun, execute_flowrun, trigger_flows
+from .instrumentation import (
+    ActionTiming,
+    Collector,
+    QueryCounter,
+    flush_collectors,
+    get_collector,
+)
+from .models import Flow, FlowRun, Trigger
+from .plan import invalidate_flow_plan
+from .triggers import invalidate_trigger_cache
+from .utils import ActionNode, make_action_tree
+
+# Metrics that regress when they go down or up respectively
+HIGHER_IS_BETTER = ("runs_per_second", "steps_per_second")
+LOWER_IS_BETTER = ("queries_per_step", "peak_memory_kb")
+
+
+class Scenario(NamedTuple):
+    name: str
+    description: str
+    # Creates the flow and runs for the given scale and returns a callable
+    # that executes them and returns the number of executed runs.
+    setup: Callable[[float], Callable[[], int]]
+
+
+class Regression(NamedTuple):
+    scenario: str
+    metric: str
+    baseline: float
+    current: float
+
+    def __str__(self):
+        return (
+            f"{self.scenario}: {self.metric} {self.current:.2f} "
+            f"(baseline {self.baseline:.2f})"
+        )
+
+
+def scaled(value: int, scale: float) -> int:
+    return max(int(round(value * scale)), 1)
+
+
+def make_flow(name: str, nodes: list[ActionNode]) -> Flow:
+    flow = Flow.objects.create(name=f"Benchmark: {name}", active_at=timezone.now())
+    make_action_tree(flow, nodes)
+    return flow
+
+
+def execute_each(runs: list[FlowRun], max_hot_loop: Optional[int] = None):
+    def execute() -> int:
+        for run in runs:
+            if max_hot_loop is None:
+                execute_flowrun(run)
+            else:
+                execute_flowrun(run, max_hot_loop=max_hot_loop)
+        return len(runs)
+
+    return execute
+
+
+def setup_deep_nesting(scale: float):
+    depth = 30
+    node = ActionNode(UpdateStateAction, {"state": {"done": True}})
+    for _ in range(depth):
+        node = ActionNode(IfAction, {"condition": "1 == 1"}, [node])
+    flow = make_flow("deep nesting", [node])
+    return execute_each([create_flowrun(flow) for _ in range(scaled(50, scale))])
+
+
+def setup_wide_branches(scale: float):
+    width = 200
+    flow = make_flow(
+        "wide branches",
+        [
+            ActionNode(UpdateStateAction, {"state": {f"key{index}": index}})
+            for index in range(width)
+        ],
+    )
+    return execute_each([create_flowrun(flow) for _ in range(scaled(20, scale))])
+
+
+def setup_for_loop(scale: float):
+    iterations = scaled(1000, scale)
+    flow = make_flow(
+        "for loop",
+        [
+            ActionNode(
+                ForLoopAction,
+                {"var_name": "i", "start": 0, "end": iterations, "step": 1},
+                [
+                    ActionNode(
+                        UpdateStateAction, {"state": {"last": "i"}, "evaluate": True}
+                    )
+                ],
+            )
+        ],
+    )
+    return execute_each(
+        [create_flowrun(flow) for _ in range(2)], max_hot_loop=iterations + 1
+    )
+
+
+def setup_while_loop(scale: float):
+    iterations = scaled(1000, scale)
+    flow = make_flow(
+        "while loop",
+        [
+            ActionNode(
+                WhileLoopAction,
+                {"condition": f"counter < {iterations}"},
+                [
+                    ActionNode(
+                        UpdateStateAction,
+                        {"state": {"counter": "counter|add:1"}, "evaluate": True},
+                    )
+                ],
+            )
+        ],
+    )
+    runs = [create_flowrun(flow, state={"counter": 0}) for _ in range(2)]
+    return execute_each(runs, max_hot_loop=iterations + 1)
+
+
+def setup_many_runs(scale: float):
+    flow = make_flow(
+        "many runs",
+        [
+            ActionNode(UpdateStateAction, {"state": {"step": 1}}),
+            ActionNode(IfAction, {"condition": "step == 1"}),
+            ActionNode(UpdateStateAction, {"state": {"step": 2}}),
+        ],
+    )
+    for _ in range(scaled(1000, scale)):
+        create_flowrun(flow)
+    queryset = FlowRun.objects.filter(flow=flow)
+
+    def execute() -> int:
+        # Continue only the benchmark runs, not real runs in the database
+        return continue_flowruns(batch_size=100, workers=1, queryset=queryset)
+
+    return execute
+
+
+def setup_trigger_flows(scale: float):
+    flow = make_flow(
+        "trigger flows", [ActionNode(UpdateStateAction, {"state": {"done": True}})]
+    )
+    flow.max_per_object = 1
+    flow.save()
+    trigger_name = f"flowcontrol_benchmark_{flow.id}"
+    Trigger.objects.create(flow=flow, trigger=trigger_name, active_at=timezone.now())
+    # Flows serve as trigger objects, so no other app is required
+    objects = [
+        Flow.objects.create(name=f"Benchmark object {index}")
+        for index in range(scaled(200, scale))
+    ]
+
+    def execute() -> int:
+        count = 0
+        for obj in objects:
+            count += len(trigger_flows(trigger_name, obj, immediate=True))
+            # Rejected by the per object limit
+            count += len(trigger_flows(trigger_name, obj, immediate=True))
+        return count
+
+    return execute
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("deep_nesting", "30 nested if conditions", setup_deep_nesting),
+        Scenario("wide_branches", "200 sibling actions", setup_wide_branches),
+        Scenario("for_loop", "1000-iteration for loop", setup_for_loop),
+        Scenario("while_loop", "1000-iteration while loop", setup_while_loop),
+        Scenario("many_runs", "1000 short runs continued in batches", setup_many_runs),
+        Scenario(
+            "trigger_flows",
+            "200 objects triggered twice with a per object limit",
+            setup_trigger_flows,
+        ),
+    ]
+}
+
+
+class StepCounter(Collector):
+    """
+    Counts executed action steps in this process, never written anywhere.
+    """
+
+    def __init__(self):
+        self.steps = 0
+
+    def record(self, timing: ActionTiming):
+        self.steps += 1
+
+
+def count_steps() -> int:
+    return get_collector(StepCounter).steps
+
+
+def measure_scenario(scenario: Scenario, scale: float, memory: bool) -> dict:
+    """
+    Execute the scenario in a transaction that is rolled back afterwards.
+    """
+    invalidate_flow_plan()
+    invalidate_trigger_cache()
+    try:
+        with transaction.atomic():
+            execute = scenario.setup(scale)
+            steps_before = count_steps()
+            query_counter = QueryCounter()
+            if memory:
+                tracemalloc.start()
+            try:
+                with connection.execute_wrapper(query_counter):
+                    start = time.perf_counter()
+                    runs = execute()
+                    seconds = time.perf_counter() - start
+                peak_memory = tracemalloc.get_traced_memory()[1] if memory else None
+            finally:
+                if memory:
+                    tracemalloc.stop()
+            steps = count_steps() - steps_before
+            transaction.set_rollback(True)
+    finally:
+        invalidate_flow_plan()
+        invalidate_trigger_cache()
+    return {
+        "runs": runs,
+        "steps": steps,
+        "queries": query_counter.count,
+        "seconds": seconds,
+        "runs_per_second": runs / seconds if seconds else 0.0,
+        "steps_per_second": steps / seconds if seconds else 0.0,
+        "queries_per_step": query_counter.count / steps if steps else None,
+        "peak_memory_kb": peak_memory / 1024 if peak_memory is not None else None,
+    }
+
+
+def run_benchmarks(
+    names: Optional[Iterable[str]] = None,
+    scale: float = 1.0,
+    memory: bool = True,
+) -> dict:
+    """
+    Run benchmark scenarios against the configured database.
+
+    Every scenario builds a synthetic flow with `make_action_tree`, creates
+    its runs and measures only their execution. All data is created in a
+    transaction that is rolled back, so the database is left unchanged.
+    Tracing memory allocations slows execution down, so peak memory is
+    measured in a second pass when `memory` is given.
+
+    Args:
+        names (Optional[Iterable[str]]): Scenarios to run. Defaults to all scenarios.
+        scale (float): Factor for the number of runs and loop iterations.
+        memory (bool): Measure peak memory of the flow run execution.
+
+    Returns:
+        A JSON serializable dict with the environment and the results per scenario.
+    """
+    if names is None:
+        names = SCENARIOS.keys()
+    results = {}
+    # Count action steps with a collector of this process only. Metrics and
+    # the configured collectors are turned off, so the benchmark does not
+    # show up in the metrics and timings of a live deployment.
+    flush_collectors()
+    with override_settings(
+        FLOWCONTROL_METRICS=False,
+        FLOWCONTROL_COLLECTORS=["flowcontrol.benchmark.StepCounter"],
+    ):
+        for name in names:
+            scenario = SCENARIOS[name]
+            result = measure_scenario(scenario, scale, memory=False)
+            if memory:
+                result["peak_memory_kb"] = measure_scenario(
+                    scenario, scale, memory=True
+                )["peak_memory_kb"]
+            results[name] = result
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "scale": scale,
+        },
+        "scenarios": results,
+    }
+
+
+def compare_results(
+    results: dict, baseline: dict, tolerance: float = 0.2
+) -> list[Regression]:
+    """
+    Compare benchmark results against a stored baseline.
+
+    A metric regresses when it is worse than the baseline by more than
+    `tolerance` (a fraction of the baseline value). Scenarios and metrics
+    missing from either side are ignored.
+
+    Args:
+        results (dict): Results returned by `run_benchmarks`.
+        baseline (dict): Previously stored results.
+        tolerance (float): Allowed relative deviation.
+
+    Returns:
+        A list of regressions, empty if the results are within tolerance.
+    """
+    regressions = []
+    baseline_scenarios = baseline.get("scenarios", {})
+    for name, result in results["scenarios"].items():
+        expected = baseline_scenarios.get(name)
+        if expected is None:
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            current, reference = result.get(metric), expected.get(metric)
+            if current is None or reference is None:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                regressed = current < reference * (1 - tolerance)
+            else:
+                regressed = current > reference * (1 + tolerance)
+            if regressed:
+                regressions.append(Regression(name, metric, reference, current))
+    return regressions
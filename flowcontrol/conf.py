@@ -1,6 +1,15 @@
+from datetime import timedelta
+
 from django.conf import settings
 
 FLOWCONTROL_DEFAULT_FILTERS = ["flowcontrol.filters"]
+FLOWCONTROL_DEFAULT_EXPRESSION_CACHE_SIZE = 1024
+
+FILTER_SETTINGS = (
+    "FLOWCONTROL_TEMPLATE_FILTERS",
+    "FLOWCONTROL_DISABLE_DEFAULT_FILTERS",
+)
+COLLECTOR_SETTINGS = ("FLOWCONTROL_COLLECTORS",)
 
 
 def get_flowcontrol_filters():
@@ -10,3 +19,117 @@ def get_flowcontrol_filters():
     return ([] if disable_filters else FLOWCONTROL_DEFAULT_FILTERS) + getattr(
         settings, "FLOWCONTROL_TEMPLATE_FILTERS", []
     )
+
+
+def get_expression_cache_size():
+    return int(
+        getattr(
+            settings,
+            "FLOWCONTROL_EXPRESSION_CACHE_SIZE",
+            FLOWCONTROL_DEFAULT_EXPRESSION_CACHE_SIZE,
+        )
+    )
+
+
+def get_worker_count():
+    return int(getattr(settings, "FLOWCONTROL_WORKERS", 1))
+
+
+def get_worker_pool():
+    return getattr(settings, "FLOWCONTROL_WORKER_POOL", "thread")
+
+
+def get_claim_batch_size():
+    return int(getattr(settings, "FLOWCONTROL_CLAIM_BATCH_SIZE", 100))
+
+
+def get_lease_duration():
+    return timedelta(seconds=int(getattr(settings, "FLOWCONTROL_LEASE_SECONDS", 300)))
+
+
+def get_step_budget():
+    budget = getattr(settings, "FLOWCONTROL_STEP_BUDGET", None)
+    return None if budget is None else int(budget)
+
+
+def get_time_budget():
+    budget = getattr(settings, "FLOWCONTROL_TIME_BUDGET", None)
+    return None if budget is None else float(budget)
+
+
+def get_priority_aging():
+    seconds = getattr(settings, "FLOWCONTROL_PRIORITY_AGING_SECONDS", 3600)
+    if not seconds:
+        return None
+    return timedelta(seconds=int(seconds))
+
+
+def get_retention_days():
+    days = getattr(settings, "FLOWCONTROL_RETENTION_DAYS", None)
+    return None if days is None else int(days)
+
+
+def get_retention_days_by_outcome():
+    return {
+        outcome: None if days is None else int(days)
+        for outcome, days in getattr(
+            settings, "FLOWCONTROL_RETENTION_DAYS_BY_OUTCOME", {}
+        ).items()
+    }
+
+
+def get_archive_mode():
+    mode = getattr(settings, "FLOWCONTROL_ARCHIVE", None)
+    if mode not in (None, "immediate", "sweep"):
+        raise ValueError(f"Unknown FLOWCONTROL_ARCHIVE mode: {mode}")
+    return mode
+
+
+def get_trigger_cache_timeout():
+    return float(getattr(settings, "FLOWCONTROL_TRIGGER_CACHE_TIMEOUT", 60))
+
+
+def get_task_chunk_size():
+    return int(getattr(settings, "FLOWCONTROL_TASK_CHUNK_SIZE", get_claim_batch_size()))
+
+
+def get_task_queue():
+    return getattr(settings, "FLOWCONTROL_TASK_QUEUE", None)
+
+
+def get_task_lease_duration():
+    return timedelta(
+        seconds=int(getattr(settings, "FLOWCONTROL_TASK_LEASE_SECONDS", 3600))
+    )
+
+
+def get_worker_max_sleep():
+    return float(getattr(settings, "FLOWCONTROL_WORKER_MAX_SLEEP", 60))
+
+
+def get_worker_wakeup_cache():
+    return getattr(settings, "FLOWCONTROL_WORKER_WAKEUP_CACHE", None)
+
+
+def get_run_event_limit():
+    return int(getattr(settings, "FLOWCONTROL_RUN_EVENT_LIMIT", 100))
+
+
+def get_collector_paths():
+    return list(getattr(settings, "FLOWCONTROL_COLLECTORS", []))
+
+
+def get_collector_cache():
+    return getattr(settings, "FLOWCONTROL_COLLECTOR_CACHE", "default")
+
+
+def get_metrics_enabled():
+    return bool(getattr(settings, "FLOWCONTROL_METRICS", False))
+
+
+def get_metrics_cache():
+    return getattr(settings, "FLOWCONTROL_METRICS_CACHE", "default")
+
+
+def get_metrics_token():
+    return getattr(settings, "FLOWCONTROL_METRICS_TOKEN", None)
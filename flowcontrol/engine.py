@@ -1,19 +1,52 @@
+import asyncio
 import logging
-from collections import Counter
-from typing import Optional
+import os
+import socket
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import islice
+from typing import Callable, Optional, Union
 
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import connection, connections, models, transaction
 from django.utils import timezone
 
+from asgiref.sync import sync_to_async
+
 from flowcontrol.utils import evaluate_if
 
-from .base import FlowDirective
-from .models import Flow, FlowAction, FlowRun, Trigger
+from . import conf, metrics
+from .archive import (
+    archive_finished_flowrun,
+    archive_flowruns,
+    count_archived_flowruns,
+    get_archived_flowruns_for_object,
+    merge_flowruns,
+)
+from .base import ActionContext, BaseAction, FlowDirective
+from .instrumentation import ActionTimer, get_collectors
+from .models import Flow, FlowAction, FlowRun, FlowRunArchive, Trigger
+from .models.core import get_due_at
+from .plan import ActionConfigMap, FlowPlan, get_flow_plan
+from .triggers import aget_active_triggers, get_active_triggers
+from .wakeup import notify_worker
 
 logger = logging.getLogger(__name__)
 
 MAX_HOT_LOOPS = 1000
+WORKER_POOLS = ("thread", "process")
+
+
+def get_lease_owner() -> str:
+    """
+    Returns an identifier of the current worker thread for execution leases.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
 
 
 def trigger_flows(
@@ -21,6 +54,7 @@ def trigger_flows(
     obj: Optional[models.Model] = None,
     state: Optional[dict] = None,
     immediate: bool = False,
+    priority: Optional[int] = None,
 ) -> list[FlowRun]:
     """Triggers flows based on the given trigger name.
 
@@ -29,18 +63,22 @@ def trigger_flows(
         obj (Optional[models.Model], optional): object associated with the flow run. Defaults to None.
         state (Optional[dict], optional): Default state of the flow run. Defaults to None.
         immediate (bool, optional): Execute immediately if True. Defaults to False.
+        priority (Optional[int], optional): Priority of created flow runs. Defaults to the flow's priority.
 
     Returns:
         A list of FlowRun instances that were created as a result of the trigger.
     """
-    active_triggers = Trigger.objects.get_active_for_trigger_name(trigger_name)
+    metrics.trigger_calls.inc(trigger_name)
+    active_triggers = get_active_triggers(trigger_name)
     runs = []
     for trigger in active_triggers:
         if not check_condition(trigger.condition, obj, state):
             continue
         if trigger.create_flow:
             flow = trigger.flow
-            run = create_flowrun(flow, obj, state=state, trigger=trigger)
+            run = create_flowrun(
+                flow, obj, state=state, trigger=trigger, priority=priority
+            )
             if run is None:
                 logger.warning(
                     f"Flow run for flow {flow.id} and object {obj} was not triggered due to limits."
@@ -59,6 +97,8 @@ def trigger_flows(
                     run.waiting_trigger = None
                     run.continue_after = now
                     run.save()
+                if waiting_runs:
+                    notify_worker(now)
 
     if immediate:
         for run in runs:
@@ -71,11 +111,15 @@ def get_flowruns_waiting_on_trigger(
     obj: Optional[models.Model] = None,
     immediate: bool = False,
 ) -> list[FlowRun]:
-    suspended_runs = FlowRun.objects.filter(
-        status=FlowRun.Status.WAITING,
-        waiting_trigger=trigger,
-    ).filter(
-        models.Q(continue_after=None) | models.Q(continue_after__lte=timezone.now())
+    suspended_runs = (
+        FlowRun.objects.with_flow()
+        .filter(
+            status=FlowRun.Status.WAITING,
+            waiting_trigger=trigger,
+        )
+        .filter(
+            models.Q(continue_after=None) | models.Q(continue_after__lte=timezone.now())
+        )
     )
     if obj is not None:
         content_type = ContentType.objects.get_for_model(obj)
@@ -90,12 +134,137 @@ def get_flowruns_waiting_on_trigger(
     return suspended_runs
 
 
+def trigger_flows_bulk(
+    trigger_name: str,
+    objects: Iterable[models.Model],
+    state: Optional[dict] = None,
+    chunk_size: int = 1000,
+    priority: Optional[int] = None,
+) -> list[tuple[models.Model, list[FlowRun]]]:
+    """Triggers flows for many objects at once.
+
+    Flow limits are checked with one grouped query per chunk of objects and
+    the permitted flow runs are created with `bulk_create`. Runs waiting on
+    the trigger are resumed with one update per chunk. The created runs are
+    not executed, use `continue_flowruns` to execute them.
+
+    Args:
+        trigger_name (str): trigger name to look up in the database.
+        objects (Iterable[models.Model]): objects or a queryset of objects to trigger flows for.
+        state (Optional[dict], optional): Default state of the flow runs. Defaults to None.
+        chunk_size (int, optional): Number of objects to process at once. Defaults to 1000.
+        priority (Optional[int], optional): Priority of created flow runs. Defaults to the flow's priority.
+
+    Returns:
+        A list of tuples of each object and the FlowRun instances created or resumed for it.
+    """
+    metrics.trigger_calls.inc(trigger_name)
+    active_triggers = get_active_triggers(trigger_name)
+    if isinstance(objects, models.QuerySet):
+        objects = objects.iterator(chunk_size=chunk_size)
+
+    results = []
+    for chunk in _chunked(objects, chunk_size):
+        runs_by_index = {index: [] for index in range(len(chunk))}
+        for trigger in active_triggers:
+            matching = [
+                (index, obj)
+                for index, obj in enumerate(chunk)
+                if check_condition(trigger.condition, obj, state)
+            ]
+            if not matching:
+                continue
+            if trigger.create_flow and trigger.reset_to_action:
+                # Resetting runs is not set-based, fall back to single objects
+                for index, obj in matching:
+                    run = create_flowrun(
+                        trigger.flow,
+                        obj,
+                        state=state,
+                        trigger=trigger,
+                        priority=priority,
+                    )
+                    if run is not None:
+                        runs_by_index[index].append(run)
+            elif trigger.create_flow:
+                created = create_flowruns_bulk(
+                    trigger.flow,
+                    [obj for _index, obj in matching],
+                    state=state,
+                    trigger=trigger,
+                    priority=priority,
+                )
+                for (index, _obj), run in zip(matching, created, strict=True):
+                    if run is None:
+                        continue
+                    runs_by_index[index].append(run)
+            else:
+                resumed = _resume_flowruns_waiting_on_trigger_bulk(trigger, matching)
+                for index, runs in resumed.items():
+                    runs_by_index[index].extend(runs)
+
+        results.extend((obj, runs_by_index[index]) for index, obj in enumerate(chunk))
+    return results
+
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _resume_flowruns_waiting_on_trigger_bulk(
+    trigger: Trigger, matching: list[tuple[int, models.Model]]
+) -> dict[int, list[FlowRun]]:
+    index_by_key = {}
+    object_condition = models.Q()
+    ids_by_content_type = defaultdict(list)
+    for index, obj in matching:
+        content_type = ContentType.objects.get_for_model(obj)
+        index_by_key.setdefault((content_type.id, obj.pk), index)
+        ids_by_content_type[content_type.id].append(obj.pk)
+    for content_type_id, object_ids in ids_by_content_type.items():
+        object_condition |= models.Q(
+            content_type_id=content_type_id, object_id__in=object_ids
+        )
+
+    waiting_runs = list(
+        FlowRun.objects.with_flow()
+        .filter(
+            status=FlowRun.Status.WAITING,
+            waiting_trigger=trigger,
+        )
+        .filter(
+            models.Q(continue_after=None) | models.Q(continue_after__lte=timezone.now())
+        )
+        .filter(object_condition | models.Q(waiting_trigger_match_object=False))
+    )
+    if not waiting_runs:
+        return {}
+
+    now = timezone.now()
+    FlowRun.objects.filter(id__in=[run.id for run in waiting_runs]).update(
+        waiting_trigger=None, continue_after=now
+    )
+    notify_worker(now)
+    first_index = matching[0][0]
+    resumed = defaultdict(list)
+    for run in waiting_runs:
+        run.waiting_trigger = None
+        run.continue_after = now
+        # Runs that don't require an object match are resumed only once
+        index = index_by_key.get((run.content_type_id, run.object_id), first_index)
+        resumed[index].append(run)
+    return resumed
+
+
 def create_flowrun(
     flow: Flow,
     obj: Optional[models.Model] = None,
     state: Optional[dict] = None,
     parent_run: Optional[FlowRun] = None,
     trigger: Optional[Trigger] = None,
+    priority: Optional[int] = None,
 ) -> Optional[FlowRun]:
     """
     Creates a new flow run from flow when limits allow it.
@@ -106,6 +275,7 @@ def create_flowrun(
         state (Optional[dict]): Optional initial state for the flow run.
         parent_run (Optional[FlowRun]): Optional parent FlowRun instance if this run is a child of another.
         trigger (Optional[Trigger]): The trigger that initiated this flow run.
+        priority (Optional[int]): Priority of the flow run. Defaults to the flow's priority.
 
     Returns:
         The created FlowRun instance, or None if the run was not created.
@@ -114,6 +284,49 @@ def create_flowrun(
     if not flow.is_active():
         raise ValueError("Cannot start a flow run for an inactive flow")
 
+    checks = _get_flowrun_checks(flow, obj)
+    if checks is None:
+        return
+    same_active_flows, check_aggs = checks
+
+    if trigger and trigger.reset_to_action:
+        # Find flow to restart
+        active_run = same_active_flows.first()
+        if active_run:
+            return _reset_flowrun_for_trigger(active_run, trigger, state)
+        else:
+            # Don't create a flow if none to restart
+            return
+
+    if check_aggs:
+        run_counts = FlowRun.objects.filter(flow=flow).aggregate(**check_aggs)
+        _add_archived_object_count(flow, obj, run_counts)
+        if _flowrun_limits_reached(flow, run_counts):
+            return
+
+    run = FlowRun.objects.create(
+        flow=flow,
+        content_object=obj,
+        status=FlowRun.Status.PENDING,
+        parent_run=parent_run,
+        state=state or {},
+        trigger=trigger,
+        priority=flow.priority if priority is None else priority,
+    )
+    notify_worker()
+    metrics.runs_created.inc(flow.id)
+
+    return run
+
+
+def _get_flowrun_checks(
+    flow: Flow, obj: Optional[models.Model]
+) -> Optional[tuple[models.QuerySet[FlowRun], dict]]:
+    """
+    Returns the active runs of the flow for the object and the aggregates
+    needed to check the flow's limits or None if the object does not match
+    the flow's content type.
+    """
     same_active_flows = FlowRun.objects.filter(flow=flow).exclude(
         status=FlowRun.Status.DONE
     )
@@ -126,7 +339,7 @@ def create_flowrun(
 
     if obj is not None:
         content_type = ContentType.objects.get_for_model(obj)
-        if flow.content_type and flow.content_type != content_type:
+        if flow.content_type_id and flow.content_type_id != content_type.id:
             return
         object_id = obj.pk
 
@@ -144,40 +357,160 @@ def create_flowrun(
                 filter=models.Q(content_type=content_type, object_id=object_id)
                 & ~models.Q(status=FlowRun.Status.DONE),
             )
+    return same_active_flows, check_aggs
 
-    if trigger and trigger.reset_to_action:
-        # Find flow to restart
-        active_run = same_active_flows.first()
-        if active_run:
-            return reset_flowrun(
-                active_run, action=trigger.reset_to_action, trigger=trigger, state=state
+
+def _reset_flowrun_for_trigger(
+    run: FlowRun, trigger: Trigger, state: Optional[dict]
+) -> FlowRun:
+    return reset_flowrun(
+        run, action=trigger.reset_to_action, trigger=trigger, state=state
+    )
+
+
+def _add_archived_object_count(
+    flow: Flow, obj: Optional[models.Model], run_counts: dict
+):
+    # Archived runs still count towards the flow's maximum runs per object
+    if "object_count" not in run_counts:
+        return
+    content_type = ContentType.objects.get_for_model(obj)
+    archived_counts = count_archived_flowruns(flow, content_type.id, [obj.pk])
+    run_counts["object_count"] += archived_counts[(content_type.id, obj.pk)]
+
+
+def _flowrun_limits_reached(flow: Flow, run_counts: dict) -> bool:
+    count = run_counts.get("concurrent_count")
+    if count and count >= flow.max_concurrent:
+        return True
+    count = run_counts.get("object_count")
+    if count and count >= flow.max_per_object:
+        return True
+    count = run_counts.get("concurrent_object_count")
+    if count and count >= flow.max_concurrent_per_object:
+        return True
+    return False
+
+
+def create_flowruns_bulk(
+    flow: Flow,
+    objects: list[models.Model],
+    state: Optional[dict] = None,
+    trigger: Optional[Trigger] = None,
+    priority: Optional[int] = None,
+) -> list[Optional[FlowRun]]:
+    """
+    Creates flow runs for many objects, checking flow limits set-based.
+
+    The limits of the flow are evaluated with one grouped aggregate query
+    and all permitted runs are inserted with one `bulk_create`.
+
+    Args:
+        flow (Flow): The Flow instance to start.
+        objects (list[models.Model]): The objects to create flow runs for.
+        state (Optional[dict]): Optional initial state for the flow runs.
+        trigger (Optional[Trigger]): The trigger that initiated these flow runs.
+        priority (Optional[int]): Priority of the flow runs. Defaults to the flow's priority.
+
+    Returns:
+        A list with the created FlowRun or None for each object.
+    """
+
+    if not flow.is_active():
+        raise ValueError("Cannot start a flow run for an inactive flow")
+    if priority is None:
+        priority = flow.priority
+
+    content_types = {}
+    ids_by_content_type = defaultdict(list)
+    for obj in objects:
+        content_type = ContentType.objects.get_for_model(obj)
+        content_types[id(obj)] = content_type
+        if flow.content_type_id and flow.content_type_id != content_type.id:
+            continue
+        ids_by_content_type[content_type.id].append(obj.pk)
+
+    concurrent_count = 0
+    if flow.max_concurrent > 0:
+        concurrent_count = (
+            FlowRun.objects.filter(flow=flow)
+            .exclude(status=FlowRun.Status.DONE)
+            .count()
+        )
+
+    object_counts = Counter()
+    concurrent_object_counts = Counter()
+    if ids_by_content_type and (
+        flow.max_per_object > 0 or flow.max_concurrent_per_object > 0
+    ):
+        object_condition = models.Q()
+        for content_type_id, object_ids in ids_by_content_type.items():
+            object_condition |= models.Q(
+                content_type_id=content_type_id, object_id__in=object_ids
+            )
+        grouped_counts = (
+            FlowRun.objects.filter(flow=flow)
+            .filter(object_condition)
+            .order_by()
+            .values("content_type_id", "object_id")
+            .annotate(
+                object_count=models.Count("id"),
+                concurrent_object_count=models.Count(
+                    "id", filter=~models.Q(status=FlowRun.Status.DONE)
+                ),
+            )
+        )
+        for row in grouped_counts:
+            key = (row["content_type_id"], row["object_id"])
+            object_counts[key] = row["object_count"]
+            concurrent_object_counts[key] = row["concurrent_object_count"]
+    if ids_by_content_type and flow.max_per_object > 0:
+        for content_type_id, object_ids in ids_by_content_type.items():
+            object_counts.update(
+                count_archived_flowruns(flow, content_type_id, object_ids)
             )
-        else:
-            # Don't create a flow if none to restart
-            return
 
-    if check_aggs:
-        run_counts = FlowRun.objects.filter(flow=flow).aggregate(**check_aggs)
-        count = run_counts.get("concurrent_count")
-        if count and count >= flow.max_concurrent:
-            return
-        count = run_counts.get("object_count")
-        if count and count >= flow.max_per_object:
-            return
-        count = run_counts.get("concurrent_object_count")
-        if count and count >= flow.max_concurrent_per_object:
-            return
+    results = []
+    new_runs = []
+    for obj in objects:
+        content_type = content_types[id(obj)]
+        if flow.content_type_id and flow.content_type_id != content_type.id:
+            results.append(None)
+            continue
+        key = (content_type.id, obj.pk)
+        if flow.max_concurrent > 0 and concurrent_count >= flow.max_concurrent:
+            results.append(None)
+            continue
+        if flow.max_per_object > 0 and object_counts[key] >= flow.max_per_object:
+            results.append(None)
+            continue
+        if (
+            flow.max_concurrent_per_object > 0
+            and concurrent_object_counts[key] >= flow.max_concurrent_per_object
+        ):
+            results.append(None)
+            continue
 
-    run = FlowRun.objects.create(
-        flow=flow,
-        content_object=obj,
-        status=FlowRun.Status.PENDING,
-        parent_run=parent_run,
-        state=state or {},
-        trigger=trigger,
-    )
+        concurrent_count += 1
+        object_counts[key] += 1
+        concurrent_object_counts[key] += 1
+        run = FlowRun(
+            flow=flow,
+            content_type=content_type,
+            object_id=obj.pk,
+            status=FlowRun.Status.PENDING,
+            state=dict(state) if state else {},
+            trigger=trigger,
+            priority=priority,
+        )
+        new_runs.append(run)
+        results.append(run)
 
-    return run
+    FlowRun.objects.bulk_create(new_runs)
+    if new_runs:
+        notify_worker()
+        metrics.runs_created.inc(flow.id, amount=len(new_runs))
+    return results
 
 
 def reset_flowrun(
@@ -186,8 +519,8 @@ def reset_flowrun(
     trigger: Optional[Trigger] = None,
     state: Optional[dict] = None,
 ) -> FlowRun:
-    # FIXME: What to do with runningn flowruns?
-    if flowrun.status == FlowRun.Status.RUNNING:
+    # FIXME: What to do with running flowruns?
+    if flowrun.status == FlowRun.Status.RUNNING and not lease_expired(flowrun):
         raise NotImplementedError("Cannot restart flowrun that is currently executing")
 
     if action:
@@ -199,12 +532,16 @@ def reset_flowrun(
         flowrun.continue_after = None
         flowrun.repeat_action = False
     flowrun.action = action
+    flowrun.returning = False
+    flowrun.loop_counters = {}
     flowrun.trigger = trigger
     flowrun.outcome = ""
     flowrun.done_at = None
+    flowrun.release_lease()
     if state is not None:
         flowrun.state = state
     flowrun.save()
+    notify_worker(flowrun.continue_after)
     return flowrun
 
 
@@ -248,15 +585,33 @@ def cancel_flowrun(run: FlowRun):
     run.status = FlowRun.Status.DONE
     run.outcome = FlowRun.Outcome.CANCELED
     run.done_at = timezone.now()
+    run.release_lease()
     run.save()
+    metrics.runs_finished.inc(run.outcome)
+    archive_finished_flowrun(run)
+
+
+def get_flowruns_for_object(
+    obj: models.Model, include_archived: bool = False
+) -> Union[models.QuerySet[FlowRun], list[Union[FlowRun, FlowRunArchive]]]:
+    """
+    Returns the flow runs of the given object.
 
+    Args:
+        obj (Model): find flowruns with this object.
+        include_archived (bool): Also return archived runs, as a list sorted newest first.
 
-def get_flowruns_for_object(obj: models.Model) -> models.QuerySet[FlowRun]:
+    Returns:
+        A queryset of flow runs or a list of flow runs and archived runs.
+    """
     ct = ContentType.objects.get_for_model(obj)
-    return FlowRun.objects.filter(
+    runs = FlowRun.objects.filter(
         content_type=ct,
         object_id=obj.pk,
     )
+    if not include_archived:
+        return runs
+    return merge_flowruns(runs, get_archived_flowruns_for_object(obj))
 
 
 def cancel_flowruns_for_object(obj: models.Model):
@@ -266,76 +621,627 @@ def cancel_flowruns_for_object(obj: models.Model):
     Args:
         obj (Model): find flowruns with this object and cancel them.
     """
-    get_flowruns_for_object(obj).filter(
-        status__in=(FlowRun.Status.PENDING, FlowRun.Status.WAITING),
-    ).update(
-        status=FlowRun.Status.DONE,
-        outcome=FlowRun.Outcome.CANCELED,
-        done_at=timezone.now(),
+    count = (
+        get_flowruns_for_object(obj)
+        .filter(
+            status__in=(FlowRun.Status.PENDING, FlowRun.Status.WAITING),
+        )
+        .update(
+            status=FlowRun.Status.DONE,
+            outcome=FlowRun.Outcome.CANCELED,
+            done_at=timezone.now(),
+        )
     )
+    metrics.runs_finished.inc(FlowRun.Outcome.CANCELED, amount=count)
+    if count and conf.get_archive_mode() == "immediate":
+        archive_flowruns(get_flowruns_for_object(obj))
 
 
 def discard_flowrun(run: FlowRun, message: str = ""):
     run.status = FlowRun.Status.DONE
     run.outcome = FlowRun.Outcome.OBSOLETE
     run.done_at = timezone.now()
+    run.release_lease()
     run.append_log(message, save=False)
     run.save()
+    metrics.runs_finished.inc(run.outcome)
+    archive_finished_flowrun(run)
+
+
+def discard_flowruns(runs: list[FlowRun]):
+    """
+    Discard several flow runs with one update.
+
+    Args:
+        runs (list[FlowRun]): flowruns to discard.
+    """
+    done_at = timezone.now()
+    FlowRun.objects.filter(id__in=[run.id for run in runs]).update(
+        status=FlowRun.Status.DONE,
+        outcome=FlowRun.Outcome.OBSOLETE,
+        done_at=done_at,
+        lease_owner="",
+        lease_expires_at=None,
+    )
+    for run in runs:
+        run.status = FlowRun.Status.DONE
+        run.outcome = FlowRun.Outcome.OBSOLETE
+        run.done_at = done_at
+        run.release_lease()
+    metrics.runs_finished.inc(FlowRun.Outcome.OBSOLETE, amount=len(runs))
+    if conf.get_archive_mode() == "immediate":
+        archive_flowruns(FlowRun.objects.filter(id__in=[run.id for run in runs]))
+
+
+def load_flowrun_objects(runs: list[FlowRun]) -> list[FlowRun]:
+    """
+    Load the objects of flow runs with one query per content type.
+
+    The objects are attached to the runs, so executing them does not query
+    each object on its own. Runs whose object no longer exists are
+    discarded with one update.
+
+    Args:
+        runs (list[FlowRun]): Flow runs claimed with `claim_flowruns`.
+
+    Returns:
+        The runs that still have their object or have none, in the given order.
+    """
+    ids_by_content_type = defaultdict(set)
+    for run in runs:
+        if run.content_type_id and run.object_id:
+            ids_by_content_type[run.content_type_id].add(run.object_id)
+    if not ids_by_content_type:
+        return runs
+
+    objects = {}
+    for content_type_id, object_ids in ids_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            # Model was removed, its runs are discarded
+            continue
+        for pk, obj in model._base_manager.in_bulk(object_ids).items():
+            objects[(content_type_id, pk)] = obj
+
+    content_object = FlowRun._meta.get_field("content_object")
+    loaded = []
+    missing = []
+    for run in runs:
+        if not (run.content_type_id and run.object_id):
+            loaded.append(run)
+            continue
+        obj = objects.get((run.content_type_id, run.object_id))
+        if obj is None:
+            missing.append(run)
+            continue
+        content_object.set_cached_value(run, obj)
+        loaded.append(run)
+
+    if missing:
+        logger.warning(
+            "Discarding %d flow runs that reference objects that do not exist: %s",
+            len(missing),
+            [run.id for run in missing],
+        )
+        discard_flowruns(missing)
+    return loaded
 
 
 def abort_flowrun(run: FlowRun):
     run.status = FlowRun.Status.DONE
     run.outcome = FlowRun.Outcome.ABORTED
     run.done_at = timezone.now()
+    run.release_lease()
     run.save()
+    metrics.runs_finished.inc(run.outcome)
+    archive_finished_flowrun(run)
 
 
 def error_flowrun(run: FlowRun, message: str = ""):
     run.status = FlowRun.Status.DONE
     run.outcome = FlowRun.Outcome.ERRORED
     run.done_at = timezone.now()
-    run.append_log(message, save=False)
+    run.release_lease()
+    run.append_log(message, save=False, level=logging.ERROR)
     run.save()
+    metrics.runs_finished.inc(run.outcome)
+    archive_finished_flowrun(run)
 
 
 def suspend_flowrun(run: FlowRun):
     if not run.continue_after and not run.waiting_trigger:
         run.continue_after = timezone.now()
     run.status = FlowRun.Status.WAITING
+    run.release_lease()
     run.save()
+    if run.continue_after:
+        notify_worker(run.continue_after)
+
+
+def checkpoint_flowrun(run: FlowRun, execution: "FlowExecution"):
+    """
+    Pause a flow run whose step or time budget is exhausted and requeue it
+    as due now.
+
+    The current action, whether it returns from its children and the loop
+    counters are stored, so the next execution continues where this one
+    stopped.
+    """
+    run.action = execution.action
+    run.returning = execution.returning
+    run.repeat_action = not execution.skip_execution
+    run.loop_counters = {
+        str(action_id): count for action_id, count in execution.loop_counter.items()
+    }
+    run.continue_after = timezone.now()
+    run.status = FlowRun.Status.WAITING
+    run.release_lease()
+    run.save()
+    logger.debug(
+        "Flow run %s paused after %d steps at %s", run.id, execution.steps, run.action
+    )
+    notify_worker(run.continue_after)
 
 
 def complete_flowrun(run: FlowRun):
     run.status = FlowRun.Status.DONE
     run.outcome = FlowRun.Outcome.COMPLETE
     run.done_at = timezone.now()
+    run.release_lease()
     run.save()
+    metrics.runs_finished.inc(run.outcome)
+    archive_finished_flowrun(run)
 
 
-def continue_flowruns():
+def continue_flowruns(
+    batch_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    pool: Optional[str] = None,
+    queryset: Optional[models.QuerySet[FlowRun]] = None,
+) -> int:
     """
     Execute all flowruns that can be continued.
+
+    Runnable flow runs are claimed in batches so that several workers can
+    continue flow runs at the same time without executing a run twice.
+    Runs that become runnable again during this call are left for the next one.
+
+    Args:
+        batch_size (Optional[int]): Number of runs to claim at once. Defaults to `FLOWCONTROL_CLAIM_BATCH_SIZE`.
+        workers (Optional[int]): Number of parallel workers. Defaults to `FLOWCONTROL_WORKERS`.
+        pool (Optional[str]): "thread" or "process" pool for parallel workers. Defaults to `FLOWCONTROL_WORKER_POOL`.
+        queryset (Optional[QuerySet]): Only continue these flow runs. Defaults to all flow runs.
+
+    Returns:
+        The number of flow runs that were executed.
+    """
+    if batch_size is None:
+        batch_size = conf.get_claim_batch_size()
+    if pool is None:
+        pool = conf.get_worker_pool()
+    if pool not in WORKER_POOLS:
+        raise ValueError(f"Unknown worker pool: {pool}")
+    recover_flowruns()
+    now = timezone.now()
+    count = 0
+    while True:
+        runs = claim_flowruns(batch_size, now=now, queryset=queryset)
+        if not runs:
+            break
+        execute_flowruns(runs, workers=workers, pool=pool)
+        count += len(runs)
+    return count
+
+
+def claim_flowruns(
+    limit: int,
+    now: Optional[datetime] = None,
+    queryset: Optional[models.QuerySet[FlowRun]] = None,
+    after_id: Optional[int] = None,
+    lease_duration: Optional[timedelta] = None,
+) -> list[FlowRun]:
     """
-    runnable = FlowRun.objects.get_runnable()
+    Atomically claim up to `limit` runnable flow runs.
 
-    for runnable_run in runnable:
-        execute_flowrun(runnable_run)
+    Claimed runs are marked as running in the database so no other worker
+    picks them up. The returned instances keep their previous status and
+    should be executed with `execute_claimed_flowrun` or `execute_flowruns`.
 
+    Runs are claimed by descending priority, then by the time they became
+    due. Runs that have been due for longer than
+    `FLOWCONTROL_PRIORITY_AGING_SECONDS` are claimed first regardless of
+    their priority, so low priority runs are not starved.
 
-def execute_flowrun(
+    Rows are locked with `SELECT ... FOR UPDATE SKIP LOCKED` where the
+    database supports it. Otherwise each candidate is claimed with a
+    compare-and-set update on its status.
+
+    Args:
+        limit (int): Maximum number of runs to claim.
+        now (Optional[datetime]): Only claim runs due at this time. Defaults to now.
+        queryset (Optional[QuerySet]): Restrict claiming to runs in this queryset.
+        after_id (Optional[int]): Only claim runs with a greater id to page through runnable runs.
+        lease_duration (Optional[timedelta]): Duration of the claim. Defaults to `FLOWCONTROL_LEASE_SECONDS`.
+
+    Returns:
+        A list of claimed FlowRun instances in claim order.
+    """
+    if now is None:
+        now = timezone.now()
+    runnable = FlowRun.objects.get_runnable(now=now)
+    if queryset is not None:
+        runnable = runnable.filter(id__in=queryset.values("id"))
+    if after_id is not None:
+        runnable = runnable.filter(id__gt=after_id)
+    candidate_querysets = _get_claim_querysets(runnable, now)
+
+    if lease_duration is None:
+        lease_duration = conf.get_lease_duration()
+    lease = {
+        "status": FlowRun.Status.RUNNING,
+        "lease_owner": get_lease_owner(),
+        "lease_expires_at": timezone.now() + lease_duration,
+    }
+
+    features = connection.features
+    if features.has_select_for_update_skip_locked:
+        of = ("self",) if features.has_select_for_update_of else ()
+        with transaction.atomic():
+            claimed = []
+            for candidates in candidate_querysets:
+                if len(claimed) >= limit:
+                    break
+                candidates = candidates.exclude(id__in=[run.id for run in claimed])
+                claimed.extend(
+                    candidates.select_for_update(skip_locked=True, of=of)[
+                        : limit - len(claimed)
+                    ]
+                )
+            FlowRun.objects.filter(id__in=[run.id for run in claimed]).update(**lease)
+    else:
+        claimed = []
+        for candidates in candidate_querysets:
+            if len(claimed) >= limit:
+                break
+            candidates = candidates.exclude(id__in=[run.id for run in claimed])
+            for run in candidates[: limit - len(claimed)]:
+                updated = FlowRun.objects.filter(
+                    id=run.id,
+                    status=run.status,
+                    action_id=run.action_id,
+                    continue_after=run.continue_after,
+                ).update(**lease)
+                if updated:
+                    claimed.append(run)
+
+    for run in claimed:
+        run.lease_owner = lease["lease_owner"]
+        run.lease_expires_at = lease["lease_expires_at"]
+    return claimed
+
+
+def _get_claim_querysets(
+    runnable: models.QuerySet[FlowRun], now: datetime
+) -> list[models.QuerySet[FlowRun]]:
+    """
+    Returns the querysets to claim runnable runs from in order: runs that
+    have been due for longer than the aging period, then all runs by
+    priority. Runs of the same priority are claimed by the time they became
+    due, pending runs count as due when they were created.
+    """
+    querysets = []
+    aging = conf.get_priority_aging()
+    if aging is not None:
+        cutoff = now - aging
+        starving = runnable.filter(
+            models.Q(
+                status=FlowRun.Status.PENDING,
+                continue_after__isnull=True,
+                created_at__lte=cutoff,
+            )
+            | models.Q(status=FlowRun.Status.WAITING, continue_after__lte=cutoff)
+        )
+        querysets.append(starving.order_by(get_due_at(), "id"))
+    querysets.append(runnable.order_by("-priority", get_due_at(), "id"))
+    return querysets
+
+
+def take_over_flowruns(
+    lease_owner: str, claims: Iterable[tuple[int, str]]
+) -> list[FlowRun]:
+    """
+    Take over flow runs claimed by another worker, e.g. by the Celery
+    dispatcher task, so they can be executed with `execute_flowruns`.
+
+    The lease is only taken over if it is still held by `lease_owner`, so
+    runs that were recovered or taken over in the meantime are left out.
+
+    Args:
+        lease_owner (str): The lease owner that claimed the runs.
+        claims (Iterable[tuple[int, str]]): Pairs of flow run id and its status before it was claimed.
+
+    Returns:
+        A list of FlowRun instances now leased by this worker.
+    """
+    statuses = dict(claims)
+    lease = {
+        "lease_owner": get_lease_owner(),
+        "lease_expires_at": timezone.now() + conf.get_lease_duration(),
+    }
+    runs = []
+    candidates = FlowRun.objects.with_flow().filter(
+        id__in=statuses.keys(),
+        status=FlowRun.Status.RUNNING,
+        lease_owner=lease_owner,
+    )
+    for run in candidates.order_by("id"):
+        updated = FlowRun.objects.filter(
+            id=run.id, status=FlowRun.Status.RUNNING, lease_owner=lease_owner
+        ).update(**lease)
+        if not updated:
+            continue
+        run.status = statuses[run.id]
+        run.lease_owner = lease["lease_owner"]
+        run.lease_expires_at = lease["lease_expires_at"]
+        runs.append(run)
+    return runs
+
+
+def execute_claimed_flowrun(
     run: FlowRun, max_hot_loop: int = MAX_HOT_LOOPS
+) -> Optional[FlowRun]:
+    """
+    Executes a flow run claimed by `claim_flowruns`.
+
+    If the run is not executed, its claim is released again. A run that
+    cannot be executed, e.g. a waiting run whose action was deleted, is
+    finished with `error_flowrun`, so it is not claimed over and over.
+
+    Args:
+        run (FlowRun): The claimed FlowRun instance.
+        max_hot_loop (int): Maximum number of times an action can be executed in a loop before aborting.
+
+    Returns:
+        The updated FlowRun instance or None if the run was not executed.
+    """
+    status = run.status
+    try:
+        return execute_flowrun(run, max_hot_loop=max_hot_loop)
+    except Exception as exception:
+        logger.exception("Error executing flow run %s", run.id)
+        error_flowrun(run, repr(exception))
+        return run
+    finally:
+        if run.status == status:
+            release_claimed_flowrun(run)
+
+
+def release_claimed_flowrun(run: FlowRun):
+    """
+    Return a flow run claimed by `claim_flowruns` that was not executed to
+    its previous status.
+    """
+    FlowRun.objects.filter(
+        id=run.id, status=FlowRun.Status.RUNNING, lease_owner=run.lease_owner
+    ).update(status=run.status, lease_owner="", lease_expires_at=None)
+    run.release_lease()
+
+
+def execute_flowruns(
+    runs: list[FlowRun], workers: Optional[int] = None, pool: Optional[str] = None
+):
+    """
+    Execute claimed flow runs, optionally in a thread or process pool.
+
+    Args:
+        runs (list[FlowRun]): Flow runs claimed with `claim_flowruns`.
+        workers (Optional[int]): Number of parallel workers. Defaults to `FLOWCONTROL_WORKERS`.
+        pool (Optional[str]): "thread" or "process". Defaults to `FLOWCONTROL_WORKER_POOL`.
+    """
+    if workers is None:
+        workers = conf.get_worker_count()
+    if pool is None:
+        pool = conf.get_worker_pool()
+    runs = load_flowrun_objects(runs)
+
+    if workers <= 1 or len(runs) <= 1:
+        for run in runs:
+            execute_claimed_flowrun(run)
+        return
+
+    if pool == "process":
+        # Forked or spawned processes must open their own connections
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker_process
+        ) as executor:
+            run_ids = [run.id for run in runs]
+            statuses = [run.status for run in runs]
+            list(executor.map(_execute_claimed_flowrun_by_id, run_ids, statuses))
+    elif pool == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_execute_claimed_flowrun_in_thread, runs))
+    else:
+        raise ValueError(f"Unknown worker pool: {pool}")
+
+
+def _execute_claimed_flowrun_in_thread(run: FlowRun):
+    try:
+        execute_claimed_flowrun(run)
+    except Exception:
+        logger.exception("Error executing flow run %s", run.id)
+    finally:
+        connections.close_all()
+
+
+def _init_worker_process():
+    import django
+
+    django.setup()
+    connections.close_all()
+
+
+def _execute_claimed_flowrun_by_id(run_id: int, status: str):
+    run = FlowRun.objects.with_flow().get(id=run_id)
+    run.status = status
+    try:
+        execute_claimed_flowrun(run)
+    except Exception:
+        logger.exception("Error executing flow run %s", run_id)
+
+
+def lease_expired(run: FlowRun, now: Optional[datetime] = None) -> bool:
+    if run.lease_expires_at is None:
+        return False
+    return run.lease_expires_at < (now or timezone.now())
+
+
+def renew_lease(run: FlowRun) -> bool:
+    """
+    Extend the execution lease of a running flow run.
+
+    Returns:
+        False if the lease was lost, e.g. because the run was recovered by
+        `recover_flowruns` in the meantime.
+    """
+    lease_expires_at = timezone.now() + conf.get_lease_duration()
+    updated = FlowRun.objects.filter(
+        id=run.id, status=FlowRun.Status.RUNNING, lease_owner=run.lease_owner
+    ).update(lease_expires_at=lease_expires_at)
+    if updated:
+        run.lease_expires_at = lease_expires_at
+    return bool(updated)
+
+
+def recover_flowruns(now: Optional[datetime] = None) -> int:
+    """
+    Return running flow runs with an expired lease to the queue.
+
+    Runs that were executing an action are set to waiting and repeat that
+    action when continued, runs without an action start again. Runs that
+    were claimed but never started still have their `continue_after` time
+    and are returned as they were, so an action they already finished,
+    e.g. waiting for a trigger, is not repeated.
+
+    Args:
+        now (Optional[datetime]): Recover leases that expired before this time. Defaults to now.
+
+    Returns:
+        The number of recovered flow runs.
+    """
+    if now is None:
+        now = timezone.now()
+    expired = FlowRun.objects.filter(
+        status=FlowRun.Status.RUNNING, lease_expires_at__lt=now
+    )
+    released = {"lease_owner": "", "lease_expires_at": None}
+    # Starting an execution clears continue_after, so these were not started
+    count = expired.filter(action__isnull=False, continue_after__isnull=False).update(
+        status=FlowRun.Status.WAITING, **released
+    )
+    count += expired.filter(action__isnull=False).update(
+        status=FlowRun.Status.WAITING,
+        continue_after=now,
+        repeat_action=True,
+        waiting_trigger=None,
+        **released,
+    )
+    count += expired.filter(action__isnull=True).update(
+        status=FlowRun.Status.PENDING,
+        repeat_action=False,
+        waiting_trigger=None,
+        **released,
+    )
+    if count:
+        logger.warning("Recovered %d flow runs with expired leases.", count)
+    return count
+
+
+def execute_flowrun(
+    run: FlowRun,
+    max_hot_loop: int = MAX_HOT_LOOPS,
+    step_budget: Optional[int] = None,
+    time_budget: Optional[float] = None,
 ) -> Optional[FlowRun]:
     """
     Executes the flow run, processing its actions.
 
+    When the step or time budget is exhausted, the run is paused with
+    `checkpoint_flowrun` and continues in a later execution, so that long
+    runs do not block a worker.
+
     Args:
         run (FlowRun): The FlowRun instance to execute.
         max_hot_loop (int): Maximum number of times an action can be executed in a loop before aborting.
+        step_budget (Optional[int]): Maximum number of actions to execute. Defaults to `FLOWCONTROL_STEP_BUDGET`.
+        time_budget (Optional[float]): Maximum number of seconds to execute. Defaults to `FLOWCONTROL_TIME_BUDGET`.
 
     Returns:
         The updated FlowRun instance or None if the run was not executed due to its status.
     """
 
+    execution = start_execution(
+        run,
+        max_hot_loop=max_hot_loop,
+        step_budget=step_budget,
+        time_budget=time_budget,
+    )
+    if execution is None:
+        return
+
+    while True:
+        if execution.action is None:
+            # No action to execute, complete the flow run
+            complete_flowrun(run)
+            return
+
+        if execution.budget_exhausted():
+            checkpoint_flowrun(run, execution)
+            return
+
+        if execution.lease_renewal_due() and not execution.renew_lease():
+            return
+
+        if execution.skip_execution:
+            execution.skip_execution = False
+            directive = FlowDirective.CONTINUE
+        else:
+            run.action = execution.action
+            try:
+                directive = execute_action(
+                    run,
+                    execution.action,
+                    execution.obj,
+                    returning=execution.returning,
+                    configs=execution.configs,
+                    context=execution.context,
+                )
+            except Exception as exception:
+                logger.exception("Error executing action %s", execution.action)
+                error_flowrun(run, repr(exception))
+                return
+            execution.steps += 1
+
+        finish = execution.advance(directive)
+        if finish is not None:
+            finish()
+            return
+
+
+def start_execution(
+    run: FlowRun,
+    max_hot_loop: int = MAX_HOT_LOOPS,
+    step_budget: Optional[int] = None,
+    time_budget: Optional[float] = None,
+) -> Optional["FlowExecution"]:
+    """
+    Checks that the flow run can be executed and marks it as running.
+
+    Returns:
+        A FlowExecution positioned at the action to execute or None if the
+        run is not executed.
+    """
+
     if run.status not in (FlowRun.Status.PENDING, FlowRun.Status.WAITING):
         logger.warning(
             f"Flow run {run.id} is not in a valid state to execute: {run.status}"
@@ -364,11 +1270,11 @@ def execute_flowrun(
 
     skip_execution = False
     if run.status == FlowRun.Status.WAITING:
-        if run.continue_after is None and run.waiting_trigger is None:
+        if run.continue_after is None and run.waiting_trigger_id is None:
             raise ValueError(
                 "Flow run is waiting but has neither trigger nor continue after time set"
             )
-        if run.action is None:
+        if run.action_id is None:
             raise ValueError("Flow run is waiting but has no action set")
         if run.continue_after and timezone.now() < run.continue_after:
             # Still waiting, do not execute yet
@@ -377,82 +1283,163 @@ def execute_flowrun(
         run.repeat_action = False
         run.continue_after = None
         run.waiting_trigger = None
-    else:
-        if not run.action:
-            run.action = run.flow.actions.first()
 
+    # Claimed runs are loaded with their flow, other runs may come with a
+    # flow instance that was cached before its actions changed
+    plan = get_flow_plan(run.flow, check_stamp=not run.lease_owner)
+    if run.action_id is None:
+        run.action = plan.first_action
+    else:
+        if run.action_id not in plan:
+            plan = get_flow_plan(run.flow, refresh=True)
+        action = plan.get_action(run.action_id)
+        if action is None:
+            raise ValueError("Flow run action does not belong to the flow")
+        run.action = action
+
+    execution = FlowExecution(
+        run,
+        obj,
+        plan,
+        skip_execution=skip_execution,
+        max_hot_loop=max_hot_loop,
+        step_budget=step_budget,
+        time_budget=time_budget,
+    )
+    if not run.lease_owner:
+        run.lease_owner = get_lease_owner()
+    run.lease_expires_at = timezone.now() + execution.lease_duration
     run.status = FlowRun.Status.RUNNING
     run.save()
+    metrics.run_executions.inc()
+    return execution
 
-    loop_counter = Counter()
-    action = run.action
-    returning = False
 
-    while True:
-        if action is None:
-            # No action to execute, complete the flow run
-            complete_flowrun(run)
-            return
+class FlowExecution:
+    """
+    Position of a flow run in its flow plan during one execution.
 
-        if not skip_execution:
-            run.action = action
-            try:
-                directive = execute_action(run, action, obj, returning=returning)
-            except Exception as exception:
-                logger.exception("Error executing action %s", action)
-                error_flowrun(run, repr(exception))
-                return
-        else:
-            skip_execution = False
-            directive = FlowDirective.CONTINUE
+    The sync and async engine share this to move through the plan, the
+    drivers only differ in how they run actions and save the run.
+    """
+
+    def __init__(
+        self,
+        run: FlowRun,
+        obj: Optional[models.Model],
+        plan: FlowPlan,
+        skip_execution: bool = False,
+        max_hot_loop: int = MAX_HOT_LOOPS,
+        step_budget: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ):
+        self.run = run
+        self.obj = obj
+        self.plan = plan
+        self.configs = ActionConfigMap(plan)
+        self.context = get_action_context(run, obj)
+        # Continue from a checkpoint, the run stores it until the next one
+        self.loop_counter = Counter(
+            {int(action_id): count for action_id, count in run.loop_counters.items()}
+        )
+        self.action: Optional[FlowAction] = run.action
+        self.returning = run.returning
+        run.returning = False
+        run.loop_counters = {}
+        self.skip_execution = skip_execution
+        self.max_hot_loop = max_hot_loop
+        self.lease_duration = conf.get_lease_duration()
+        self._schedule_lease_renewal()
+        self.steps = 0
+        self.step_budget = (
+            conf.get_step_budget() if step_budget is None else step_budget
+        )
+        if time_budget is None:
+            time_budget = conf.get_time_budget()
+        self.deadline = None
+        if time_budget is not None:
+            self.deadline = time.monotonic() + time_budget
+
+    def _schedule_lease_renewal(self):
+        self.renew_at = time.monotonic() + self.lease_duration.total_seconds() / 2
+
+    def budget_exhausted(self) -> bool:
+        """
+        Whether the step or time budget of this execution is used up.
+        At least one action is executed per execution.
+        """
+        if not self.steps:
+            return False
+        if self.step_budget is not None and self.steps >= self.step_budget:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def lease_renewal_due(self) -> bool:
+        return time.monotonic() >= self.renew_at
+
+    def renew_lease(self) -> bool:
+        if not renew_lease(self.run):
+            logger.warning(f"Lost lease on flow run {self.run.id}, stopping execution.")
+            return False
+        self._schedule_lease_renewal()
+        return True
+
+    def advance(self, directive: FlowDirective) -> Optional[Callable[[], None]]:
+        """
+        Moves to the next action according to the directive.
+
+        Returns:
+            A function that ends the execution or None to continue with the
+            next action.
+        """
+        run = self.run
+        plan = self.plan
+        action = self.action
 
         if directive == FlowDirective.CONTINUE:
-            sibling = action.get_next_sibling()
+            sibling = plan.get_next_sibling(action)
             if sibling is None:
                 # No more actions to execute in this branch
-                action = action.get_parent()
-                returning = True
+                self.action = plan.get_parent(action)
+                self.returning = True
             else:
-                action = sibling
-                returning = False
+                self.action = sibling
+                self.returning = False
         elif directive == FlowDirective.ENTER:
-            loop_counter[action.id] += 1
-            if loop_counter[action.id] > max_hot_loop:
+            self.loop_counter[action.id] += 1
+            if self.loop_counter[action.id] > self.max_hot_loop:
                 logger.warning(
-                    f"Action {action} ({action.id}) entered more than {max_hot_loop} times in flow run {run.id}. Aborting."
+                    f"Action {action} ({action.id}) entered more than {self.max_hot_loop} times in flow run {run.id}. Aborting."
                 )
-                error_flowrun(
+                return partial(
+                    error_flowrun,
                     run,
-                    message=f"Loop times {max_hot_loop} exceeded in flow run at {action} ({action.id}).",
+                    message=f"Loop times {self.max_hot_loop} exceeded in flow run at {action} ({action.id}).",
                 )
-                return
-            child = action.get_first_child()
+            child = plan.get_first_child(action)
             if child is None:
                 logger.warning(
                     "Action %s has no children but is issuing ENTER directive.", action
                 )
-                action = action
-                returning = True
+                self.returning = True
             else:
-                action = child
-                returning = False
+                self.action = child
+                self.returning = False
         elif directive == FlowDirective.LEAVE:
-            action = action.get_parent()
-            returning = True
+            self.action = plan.get_parent(action)
+            self.returning = True
         elif directive == FlowDirective.BREAK:
-            action = action.get_parent()
-            skip_execution = True
-            returning = False
+            self.action = plan.get_parent(action)
+            self.skip_execution = True
+            self.returning = False
         elif directive == FlowDirective.ABORT:
-            abort_flowrun(run)
-            return
+            return partial(abort_flowrun, run)
         elif directive == FlowDirective.SUSPEND:
-            suspend_flowrun(run)
-            return
+            return partial(suspend_flowrun, run)
         elif directive == FlowDirective.SUSPEND_AND_REPEAT:
             run.repeat_action = True
-            suspend_flowrun(run)
-            return
+            return partial(suspend_flowrun, run)
+        return None
 
 
 class ActionMissingError(Exception):
@@ -462,32 +1449,65 @@ class ActionMissingError(Exception):
 
 
 def execute_action(
-    run: FlowRun, action: FlowAction, obj: models.Model, returning: bool = False
+    run: FlowRun,
+    action: FlowAction,
+    obj: models.Model,
+    returning: bool = False,
+    configs: Optional[Mapping[int, Optional[models.Model]]] = None,
+    context: Optional[ActionContext] = None,
 ) -> FlowDirective:
+    concrete_action = _get_concrete_action(action)
+
+    if configs is None:
+        config = action.get_config()
+    else:
+        config = configs[action.id]
+    _set_action_context(concrete_action, run, obj, context)
+
+    method = concrete_action.run
+    if returning:
+        method = concrete_action.return_from_children
+
+    metrics.actions_executed.inc(concrete_action.get_name())
+    collectors = get_collectors()
+    if not collectors:
+        return _check_directive(action, method(obj=obj, run=run, config=config))
+
+    with ActionTimer(collectors, run, action, concrete_action) as timer:
+        timer.directive = _check_directive(
+            action, method(obj=obj, run=run, config=config)
+        )
+    return timer.directive
+
+
+def _get_concrete_action(action: FlowAction) -> BaseAction:
     concrete_action = action.get_concrete_action()
     if concrete_action is None:
         raise ActionMissingError(f"Action {action} is missing or not found.")
+    return concrete_action
 
-    config = action.get_config()
-    context = run.state.copy()
-    context.update(
-        {
-            "object": obj,
-            "obj": obj,
-        }
-    )
+
+def _set_action_context(
+    concrete_action: BaseAction,
+    run: FlowRun,
+    obj: Optional[models.Model],
+    context: Optional[ActionContext] = None,
+):
+    if context is None:
+        context = get_action_context(run, obj)
     concrete_action._set_context(context)
 
-    method = concrete_action.run
-    if returning:
-        method = concrete_action.return_from_children
 
-    directive = method(
-        obj=obj,
-        run=run,
-        config=config,
-    )
+def get_action_context(run: FlowRun, obj: Optional[models.Model]) -> ActionContext:
+    """
+    Returns the context of the run's actions without copying its state.
+    """
+    return ActionContext(run=run, object=obj, obj=obj)
+
 
+def _check_directive(
+    action: FlowAction, directive: Optional[FlowDirective]
+) -> FlowDirective:
     if directive is None:
         return FlowDirective.CONTINUE
     if not isinstance(directive, FlowDirective):
@@ -514,15 +1534,303 @@ def check_condition(
     """
     if not condition:
         return True
-    if state is None:
-        context = {}
-    else:
-        context = state.copy()
-    context.update(
-        {
-            "object": obj,
-            "obj": obj,
-        }
+    return evaluate_if(condition, ActionContext(state, object=obj, obj=obj))
+
+
+# Async engine
+#
+# The async functions mirror their sync counterparts. Database access goes
+# through Django's async ORM interface or `sync_to_async`, actions are run
+# with `BaseAction.arun` and `BaseAction.areturn_from_children`.
+
+
+async def atrigger_flows(
+    trigger_name: str,
+    obj: Optional[models.Model] = None,
+    state: Optional[dict] = None,
+    immediate: bool = False,
+    priority: Optional[int] = None,
+) -> list[FlowRun]:
+    """Async version of `trigger_flows`.
+
+    Args:
+        trigger_name (str): trigger name to look up in the database.
+        obj (Optional[models.Model], optional): object associated with the flow run. Defaults to None.
+        state (Optional[dict], optional): Default state of the flow run. Defaults to None.
+        immediate (bool, optional): Execute immediately if True. Defaults to False.
+        priority (Optional[int], optional): Priority of created flow runs. Defaults to the flow's priority.
+
+    Returns:
+        A list of FlowRun instances that were created as a result of the trigger.
+    """
+    metrics.trigger_calls.inc(trigger_name)
+    active_triggers = await aget_active_triggers(trigger_name)
+    runs = []
+    for trigger in active_triggers:
+        if trigger.condition and not await sync_to_async(check_condition)(
+            trigger.condition, obj, state
+        ):
+            continue
+        if trigger.create_flow:
+            flow = trigger.flow
+            run = await acreate_flowrun(
+                flow, obj, state=state, trigger=trigger, priority=priority
+            )
+            if run is None:
+                logger.warning(
+                    f"Flow run for flow {flow.id} and object {obj} was not triggered due to limits."
+                )
+                continue
+            runs.append(run)
+        else:
+            waiting_runs = await sync_to_async(get_flowruns_waiting_on_trigger)(
+                trigger, obj=obj, immediate=immediate
+            )
+            waiting_runs = [run async for run in waiting_runs]
+            runs.extend(waiting_runs)
+            if not immediate:
+                # Schedule to continue next time continue_flowruns is called
+                now = timezone.now()
+                for run in waiting_runs:
+                    run.waiting_trigger = None
+                    run.continue_after = now
+                    await run.asave()
+                if waiting_runs:
+                    notify_worker(now)
+
+    if immediate:
+        for run in runs:
+            await aexecute_flowrun(run)
+    return runs
+
+
+async def acreate_flowrun(
+    flow: Flow,
+    obj: Optional[models.Model] = None,
+    state: Optional[dict] = None,
+    parent_run: Optional[FlowRun] = None,
+    trigger: Optional[Trigger] = None,
+    priority: Optional[int] = None,
+) -> Optional[FlowRun]:
+    """
+    Async version of `create_flowrun`.
+
+    Args:
+        flow (Flow): The Flow instance to start.
+        obj (Optional[models.Model]): The object related to the flow run.
+        state (Optional[dict]): Optional initial state for the flow run.
+        parent_run (Optional[FlowRun]): Optional parent FlowRun instance if this run is a child of another.
+        trigger (Optional[Trigger]): The trigger that initiated this flow run.
+        priority (Optional[int]): Priority of the flow run. Defaults to the flow's priority.
+
+    Returns:
+        The created FlowRun instance, or None if the run was not created.
+    """
+
+    if not flow.is_active():
+        raise ValueError("Cannot start a flow run for an inactive flow")
+
+    # Content types may need to be loaded on first use
+    checks = await sync_to_async(_get_flowrun_checks)(flow, obj)
+    if checks is None:
+        return
+    same_active_flows, check_aggs = checks
+
+    if trigger and trigger.reset_to_action_id:
+        # Find flow to restart
+        active_run = await same_active_flows.afirst()
+        if active_run:
+            return await sync_to_async(_reset_flowrun_for_trigger)(
+                active_run, trigger, state
+            )
+        else:
+            # Don't create a flow if none to restart
+            return
+
+    if check_aggs:
+        run_counts = await FlowRun.objects.filter(flow=flow).aaggregate(**check_aggs)
+        await sync_to_async(_add_archived_object_count)(flow, obj, run_counts)
+        if _flowrun_limits_reached(flow, run_counts):
+            return
+
+    run = await FlowRun.objects.acreate(
+        flow=flow,
+        content_object=obj,
+        status=FlowRun.Status.PENDING,
+        parent_run=parent_run,
+        state=state or {},
+        trigger=trigger,
+        priority=flow.priority if priority is None else priority,
+    )
+    notify_worker()
+    metrics.runs_created.inc(flow.id)
+
+    return run
+
+
+async def acontinue_flowruns(batch_size: Optional[int] = None) -> int:
+    """
+    Async version of `continue_flowruns`.
+
+    Each claimed batch of flow runs is executed concurrently on the event
+    loop, so actions awaiting I/O do not block each other.
+
+    Args:
+        batch_size (Optional[int]): Number of runs to claim at once. Defaults to `FLOWCONTROL_CLAIM_BATCH_SIZE`.
+
+    Returns:
+        The number of flow runs that were executed.
+    """
+    if batch_size is None:
+        batch_size = conf.get_claim_batch_size()
+    await sync_to_async(recover_flowruns)()
+    now = timezone.now()
+    count = 0
+    while True:
+        runs = await sync_to_async(claim_flowruns)(batch_size, now=now)
+        if not runs:
+            break
+        loaded = await sync_to_async(load_flowrun_objects)(runs)
+        results = await asyncio.gather(
+            *(aexecute_claimed_flowrun(run) for run in loaded), return_exceptions=True
+        )
+        for run, result in zip(loaded, results, strict=True):
+            if isinstance(result, Exception):
+                logger.error("Error executing flow run %s", run.id, exc_info=result)
+        count += len(runs)
+    return count
+
+
+async def aexecute_claimed_flowrun(
+    run: FlowRun, max_hot_loop: int = MAX_HOT_LOOPS
+) -> Optional[FlowRun]:
+    """
+    Async version of `execute_claimed_flowrun`.
+
+    Args:
+        run (FlowRun): The claimed FlowRun instance.
+        max_hot_loop (int): Maximum number of times an action can be executed in a loop before aborting.
+
+    Returns:
+        The updated FlowRun instance or None if the run was not executed.
+    """
+    status = run.status
+    try:
+        return await aexecute_flowrun(run, max_hot_loop=max_hot_loop)
+    except Exception as exception:
+        logger.exception("Error executing flow run %s", run.id)
+        await sync_to_async(error_flowrun)(run, repr(exception))
+        return run
+    finally:
+        if run.status == status:
+            await sync_to_async(release_claimed_flowrun)(run)
+
+
+async def aexecute_flowrun(
+    run: FlowRun,
+    max_hot_loop: int = MAX_HOT_LOOPS,
+    step_budget: Optional[int] = None,
+    time_budget: Optional[float] = None,
+) -> Optional[FlowRun]:
+    """
+    Async version of `execute_flowrun`.
+
+    Actions are executed with `BaseAction.arun` and
+    `BaseAction.areturn_from_children`.
+
+    Args:
+        run (FlowRun): The FlowRun instance to execute.
+        max_hot_loop (int): Maximum number of times an action can be executed in a loop before aborting.
+        step_budget (Optional[int]): Maximum number of actions to execute. Defaults to `FLOWCONTROL_STEP_BUDGET`.
+        time_budget (Optional[float]): Maximum number of seconds to execute. Defaults to `FLOWCONTROL_TIME_BUDGET`.
+
+    Returns:
+        The updated FlowRun instance or None if the run was not executed due to its status.
+    """
+
+    execution = await sync_to_async(start_execution)(
+        run,
+        max_hot_loop=max_hot_loop,
+        step_budget=step_budget,
+        time_budget=time_budget,
     )
+    if execution is None:
+        return
+
+    while True:
+        if execution.action is None:
+            # No action to execute, complete the flow run
+            await sync_to_async(complete_flowrun)(run)
+            return
+
+        if execution.budget_exhausted():
+            await sync_to_async(checkpoint_flowrun)(run, execution)
+            return
+
+        if (
+            execution.lease_renewal_due()
+            and not await sync_to_async(execution.renew_lease)()
+        ):
+            return
+
+        if execution.skip_execution:
+            execution.skip_execution = False
+            directive = FlowDirective.CONTINUE
+        else:
+            run.action = execution.action
+            try:
+                directive = await aexecute_action(
+                    run,
+                    execution.action,
+                    execution.obj,
+                    returning=execution.returning,
+                    configs=execution.configs,
+                    context=execution.context,
+                )
+            except Exception as exception:
+                logger.exception("Error executing action %s", execution.action)
+                await sync_to_async(error_flowrun)(run, repr(exception))
+                return
+            execution.steps += 1
+
+        finish = execution.advance(directive)
+        if finish is not None:
+            await sync_to_async(finish)()
+            return
 
-    return evaluate_if(condition, context)
+
+async def aexecute_action(
+    run: FlowRun,
+    action: FlowAction,
+    obj: models.Model,
+    returning: bool = False,
+    configs: Optional[Mapping[int, Optional[models.Model]]] = None,
+    context: Optional[ActionContext] = None,
+) -> FlowDirective:
+    concrete_action = _get_concrete_action(action)
+
+    if configs is None:
+        config = await sync_to_async(action.get_config)()
+    elif isinstance(configs, ActionConfigMap) and configs.is_loaded(action.id):
+        config = configs[action.id]
+    else:
+        config = await sync_to_async(configs.__getitem__)(action.id)
+    _set_action_context(concrete_action, run, obj, context)
+
+    method = concrete_action.arun
+    if returning:
+        method = concrete_action.areturn_from_children
+
+    metrics.actions_executed.inc(concrete_action.get_name())
+    collectors = get_collectors()
+    if not collectors:
+        return _check_directive(action, await method(obj=obj, run=run, config=config))
+
+    # Queries of sync actions run in another thread and are not counted
+    with ActionTimer(
+        collectors, run, action, concrete_action, count_queries=False
+    ) as timer:
+        timer.directive = _check_directive(
+            action, await method(obj=obj, run=run, config=config)
+        )
+    return timer.directive
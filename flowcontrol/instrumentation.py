@@ -0,0 +1,441 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from math import ceil
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import conf
+
+if TYPE_CHECKING:
+    from .base import BaseAction, FlowDirective
+    from .models import FlowAction, FlowRun
+
+logger = logging.getLogger(__name__)
+
+
+class ActionTiming(NamedTuple):
+    flow_id: int
+    action_id: int
+    action_class: str
+    duration: float
+    queries: Optional[int]
+    directive: Optional[str]
+    error: bool = False
+
+    @property
+    def key(self) -> tuple[int, int, str]:
+        return (self.flow_id, self.action_id, self.action_class)
+
+
+class ActionStats(NamedTuple):
+    key: tuple
+    count: int
+    errors: int
+    total: float
+    p50: float
+    p95: float
+    queries: Optional[float]
+    directives: dict[str, int]
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class Collector:
+    """
+    Base class for collectors of action timings.
+
+    Collectors are configured with `FLOWCONTROL_COLLECTORS` and receive an
+    `ActionTiming` for every executed action step.
+    """
+
+    def record(self, timing: ActionTiming):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def flush(self):
+        """
+        Write buffered timings, called by long-running commands.
+        """
+        pass
+
+
+class InMemoryCollector(Collector):
+    """
+    Aggregates timings per flow, action and action class in this process.
+
+    The latest `max_samples` durations of each action are kept to compute
+    percentiles.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+            self.counts = Counter()
+            self.errors = Counter()
+            self.totals = Counter()
+            self.queries = Counter()
+            self.query_counts = Counter()
+            self.directives = defaultdict(Counter)
+
+    def record(self, timing: ActionTiming):
+        key = timing.key
+        with self._lock:
+            self.samples[key].append(timing.duration)
+            self.counts[key] += 1
+            self.totals[key] += timing.duration
+            if timing.error:
+                self.errors[key] += 1
+            if timing.queries is not None:
+                self.queries[key] += timing.queries
+                self.query_counts[key] += 1
+            if timing.directive:
+                self.directives[key][timing.directive] += 1
+
+    def stats(self, by_class: bool = False) -> list[ActionStats]:
+        """
+        Returns statistics per (flow id, action id, action class) or per
+        action class, slowest p95 first.
+        """
+        groups = defaultdict(list)
+        with self._lock:
+            for key in self.counts:
+                groups[key[2] if by_class else key].append(key)
+            result = []
+            for group, keys in groups.items():
+                durations = sorted(
+                    duration for key in keys for duration in self.samples[key]
+                )
+                query_count = sum(self.query_counts[key] for key in keys)
+                directives = Counter()
+                for key in keys:
+                    directives.update(self.directives[key])
+                result.append(
+                    ActionStats(
+                        key=(group,) if by_class else group,
+                        count=sum(self.counts[key] for key in keys),
+                        errors=sum(self.errors[key] for key in keys),
+                        total=sum(self.totals[key] for key in keys),
+                        p50=percentile(durations, 0.5),
+                        p95=percentile(durations, 0.95),
+                        queries=(
+                            sum(self.queries[key] for key in keys) / query_count
+                            if query_count
+                            else None
+                        ),
+                        directives=dict(directives),
+                    )
+                )
+        result.sort(key=lambda stats: stats.p95, reverse=True)
+        return result
+
+
+class LoggingCollector(Collector):
+    """
+    Logs every action step to the `flowcontrol.instrumentation` logger.
+    """
+
+    level = logging.DEBUG
+
+    def record(self, timing: ActionTiming):
+        logger.log(
+            self.level,
+            "Action %s (%s) of flow %s took %.2fms with %s queries: %s",
+            timing.action_class,
+            timing.action_id,
+            timing.flow_id,
+            timing.duration * 1000,
+            timing.queries,
+            "error" if timing.error else timing.directive,
+        )
+
+
+# Upper bounds in seconds of the histogram buckets used by CacheCollector
+HISTOGRAM_BUCKETS = (
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1,
+    2,
+    5,
+    10,
+    30,
+    60,
+    float("inf"),
+)
+
+
+def histogram_percentile(buckets: list[int], fraction: float) -> float:
+    """
+    Estimate a percentile as the upper bound of the histogram bucket that
+    contains it.
+    """
+    total = sum(buckets)
+    if not total:
+        return 0.0
+    rank = max(ceil(fraction * total), 1)
+    seen = 0
+    for bound, count in zip(HISTOGRAM_BUCKETS, buckets, strict=True):
+        seen += count
+        if seen >= rank:
+            return bound
+    return HISTOGRAM_BUCKETS[-1]
+
+
+class CacheCollector(Collector):
+    """
+    Rolls up timings of all processes in a Django cache.
+
+    Timings are buffered per process and added to counters and latency
+    histograms in the cache every `flush_interval` seconds. Percentiles are
+    estimated from the histogram buckets.
+    """
+
+    prefix = "flowcontrol:timings"
+
+    def __init__(self, flush_interval: float = 10.0, timeout: Optional[int] = None):
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._buffer = Counter()
+        self._keys = set()
+        self._flushed_at = time.monotonic()
+
+    @property
+    def cache(self):
+        return caches[conf.get_collector_cache()]
+
+    def _key(self, key: tuple, field: str) -> str:
+        return "{}:{}:{}:{}:{}".format(self.prefix, *key, field)
+
+    def record(self, timing: ActionTiming):
+        key = timing.key
+        bucket = bisect_left(HISTOGRAM_BUCKETS, timing.duration)
+        with self._lock:
+            self._keys.add(key)
+            self._buffer[(key, "count")] += 1
+            self._buffer[(key, f"bucket{bucket}")] += 1
+            # Cache counters are integers, store microseconds
+            self._buffer[(key, "total_us")] += int(timing.duration * 1_000_000)
+            if timing.error:
+                self._buffer[(key, "errors")] += 1
+            if timing.queries is not None:
+                self._buffer[(key, "queries")] += timing.queries
+                self._buffer[(key, "query_steps")] += 1
+            flush = time.monotonic() - self._flushed_at >= self.flush_interval
+        if flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            buffer, self._buffer = self._buffer, Counter()
+            keys = set(self._keys)
+            self._flushed_at = time.monotonic()
+        if not buffer:
+            return
+        cache = self.cache
+        for (key, field), value in buffer.items():
+            cache_key = self._key(key, field)
+            cache.add(cache_key, 0, timeout=self.timeout)
+            try:
+                cache.incr(cache_key, value)
+            except ValueError:
+                # Expired between add and incr
+                cache.set(cache_key, value, timeout=self.timeout)
+        index_key = f"{self.prefix}:keys"
+        known_keys = cache.get(index_key) or set()
+        if not keys <= known_keys:
+            cache.set(index_key, known_keys | keys, timeout=self.timeout)
+
+    def clear(self):
+        cache = self.cache
+        index_key = f"{self.prefix}:keys"
+        keys = cache.get(index_key) or set()
+        cache.delete_many(
+            [self._key(key, field) for key in keys for field in self._fields()]
+            + [index_key]
+        )
+
+    def _fields(self) -> list[str]:
+        return ["count", "total_us", "errors", "queries", "query_steps"] + [
+            f"bucket{index}" for index in range(len(HISTOGRAM_BUCKETS))
+        ]
+
+    def stats(self, by_class: bool = False) -> list[ActionStats]:
+        """
+        Returns the statistics rolled up in the cache per (flow id, action id,
+        action class) or per action class, slowest p95 first.
+        """
+        cache = self.cache
+        keys = cache.get(f"{self.prefix}:keys") or set()
+        fields = self._fields()
+        values = cache.get_many(
+            [self._key(key, field) for key in keys for field in fields]
+        )
+        groups = defaultdict(lambda: {"fields": Counter()})
+        for key in keys:
+            group = groups[(key[2],) if by_class else key]
+            for field in fields:
+                group["fields"][field] += values.get(self._key(key, field), 0)
+        result = []
+        for group_key, group in groups.items():
+            counts = group["fields"]
+            if not counts["count"]:
+                continue
+            buckets = [counts[f"bucket{i}"] for i in range(len(HISTOGRAM_BUCKETS))]
+            result.append(
+                ActionStats(
+                    key=group_key,
+                    count=counts["count"],
+                    errors=counts["errors"],
+                    total=counts["total_us"] / 1_000_000,
+                    p50=histogram_percentile(buckets, 0.5),
+                    p95=histogram_percentile(buckets, 0.95),
+                    queries=(
+                        counts["queries"] / counts["query_steps"]
+                        if counts["query_steps"]
+                        else None
+                    ),
+                    directives={},
+                )
+            )
+        result.sort(key=lambda stats: stats.p95, reverse=True)
+        return result
+
+
+_collectors: Optional[tuple[Collector, ...]] = None
+_collectors_lock = threading.Lock()
+
+
+def get_collectors() -> tuple[Collector, ...]:
+    """
+    Returns the collectors configured in `FLOWCONTROL_COLLECTORS`, created
+    once per process.
+    """
+    global _collectors
+    if _collectors is None:
+        with _collectors_lock:
+            if _collectors is None:
+                _collectors = tuple(
+                    import_string(path)() for path in conf.get_collector_paths()
+                )
+    return _collectors
+
+
+def get_collector(collector_class: type[Collector]) -> Optional[Collector]:
+    """
+    Returns the configured collector of the given class if there is one.
+    """
+    for collector in get_collectors():
+        if isinstance(collector, collector_class):
+            return collector
+    return None
+
+
+def reset_collectors():
+    global _collectors
+    with _collectors_lock:
+        _collectors = None
+
+
+def flush_collectors():
+    for collector in get_collectors():
+        collector.flush()
+
+
+@receiver(setting_changed)
+def collector_setting_changed(*, setting, **kwargs):
+    if setting in conf.COLLECTOR_SETTINGS:
+        reset_collectors()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ActionTimer:
+    """
+    Measures one action step and hands the timing to the collectors.
+
+    Database queries are counted on the default connection of the current
+    thread. Pass `count_queries=False` where the action runs its queries
+    elsewhere, e.g. in the async engine.
+    """
+
+    def __init__(
+        self,
+        collectors: tuple[Collector, ...],
+        run: "FlowRun",
+        action: "FlowAction",
+        concrete_action: "BaseAction",
+        count_queries: bool = True,
+    ):
+        self.collectors = collectors
+        self.run = run
+        self.action = action
+        self.concrete_action = concrete_action
+        self.query_counter = QueryCounter() if count_queries else None
+        self.directive: Optional["FlowDirective"] = None
+
+    def __enter__(self):
+        if self.query_counter is not None:
+            self._wrapper = connection.execute_wrapper(self.query_counter)
+            self._wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        queries = None
+        if self.query_counter is not None:
+            self._wrapper.__exit__(exc_type, exc_value, traceback)
+            queries = self.query_counter.count
+        timing = ActionTiming(
+            flow_id=self.run.flow_id,
+            action_id=self.action.id,
+            action_class=self.concrete_action.get_name(),
+            duration=duration,
+            queries=queries,
+            directive=self.directive.name if self.directive is not None else None,
+            error=exc_type is not None,
+        )
+        for collector in self.collectors:
+            try:
+                collector.record(timing)
+            except Exception:
+                logger.exception("Collector %s failed", collector)
+        return False
@@ -0,0 +1,253 @@
+import random
+import time
+from datetime import timedelta
+from itertools import chain
+from typing import NamedTuple, Optional
+
+from django.utils import timezone
+
+from .actions import ForLoopAction, IfAction, UpdateStateAction
+from .engine import continue_flowruns, trigger_flows
+from .instrumentation import percentile
+from .models import Flow, FlowRun, FlowRunArchive, Trigger
+from .registry import trigger_registry
+from .utils import ActionNode, make_action_tree
+from .worker import FlowRunWorker
+
+LOADGEN_PREFIX = "Loadgen"
+LOADGEN_TRIGGER = "flowcontrol_loadgen"
+SHAPES = ("linear", "nested", "loop")
+DRIVERS = ("run", "worker")
+
+
+def build_action_nodes(shape: str, size: int) -> list[ActionNode]:
+    """
+    Returns the action tree of a synthetic flow.
+
+    Args:
+        shape (str): "linear" for `size` sibling actions, "nested" for `size`
+            nested conditions or "loop" for a loop with `size` iterations.
+        size (int): Number of actions, nesting depth or iterations.
+    """
+    if shape == "linear":
+        return [
+            ActionNode(UpdateStateAction, {"state": {f"step{index}": index}})
+            for index in range(size)
+        ]
+    if shape == "nested":
+        node = ActionNode(UpdateStateAction, {"state": {"done": True}})
+        for _ in range(size):
+            node = ActionNode(IfAction, {"condition": "1 == 1"}, [node])
+        return [node]
+    if shape == "loop":
+        return [
+            ActionNode(
+                ForLoopAction,
+                {"var_name": "i", "start": 0, "end": size, "step": 1},
+                [
+                    ActionNode(
+                        UpdateStateAction, {"state": {"last": "i"}, "evaluate": True}
+                    )
+                ],
+            )
+        ]
+    raise ValueError(f"Unknown flow shape: {shape}")
+
+
+def get_trigger_name(index: int) -> str:
+    return f"{LOADGEN_TRIGGER}_{index}"
+
+
+class LoadReport(NamedTuple):
+    triggered: int
+    waiting: int
+    executed: int
+    remaining: int
+    seconds: float
+    latency_p50: float
+    latency_p95: float
+    latency_p99: float
+
+    @property
+    def throughput(self) -> float:
+        return self.executed / self.seconds if self.seconds else 0.0
+
+
+class LoadGenerator:
+    """
+    Creates synthetic flows and flow runs and executes them to measure
+    throughput and latency.
+
+    Every flow gets its own trigger, which is fired round-robin at `rate`
+    triggers per second for `duration` seconds. Additionally `waiting` flow
+    runs are created up front with a `continue_after` that is mostly due
+    soon, with a long tail and some runs already overdue. Firing triggers
+    and executing due flow runs alternate in one thread, so this works on
+    SQLite as well.
+
+    The driver executes all due flow runs in the database, not only the
+    generated ones. Only use the load generator on a development database.
+    """
+
+    def __init__(
+        self,
+        flows: int = 10,
+        shape: Optional[str] = None,
+        size: int = 5,
+        rate: float = 50.0,
+        duration: float = 10.0,
+        waiting: int = 100,
+        spread: float = 60.0,
+        driver: str = "run",
+        batch_size: Optional[int] = None,
+        workers: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        if shape is not None and shape not in SHAPES:
+            raise ValueError(f"Unknown flow shape: {shape}")
+        if driver not in DRIVERS:
+            raise ValueError(f"Unknown driver: {driver}")
+        self.flow_count = flows
+        self.shape = shape
+        self.size = size
+        self.rate = rate
+        self.duration = duration
+        self.waiting = waiting
+        self.spread = spread
+        self.driver = driver
+        self.batch_size = batch_size
+        self.workers = workers
+        self.random = random.Random(seed)
+        self.flows: list[Flow] = []
+
+    def setup(self) -> list[Flow]:
+        """
+        Create the flows and register and create their triggers.
+
+        Without a shape the flows cycle through all shapes.
+        """
+        now = timezone.now()
+        for index in range(self.flow_count):
+            shape = self.shape or SHAPES[index % len(SHAPES)]
+            flow = Flow.objects.create(
+                name=f"{LOADGEN_PREFIX} {index} ({shape})", active_at=now
+            )
+            make_action_tree(flow, build_action_nodes(shape, self.size))
+            trigger_name = get_trigger_name(index)
+            if trigger_registry.get_trigger(trigger_name) is None:
+                trigger_registry.register(
+                    trigger_name, None, label=f"Load generator {index}"
+                )
+            Trigger.objects.create(flow=flow, trigger=trigger_name, active_at=now)
+            self.flows.append(flow)
+        return self.flows
+
+    def get_due_offset(self) -> float:
+        # Exponentially distributed with a tenth of the spread overdue
+        return self.random.expovariate(3 / self.spread) - self.spread / 10
+
+    def create_waiting_runs(self) -> int:
+        """
+        Create flow runs that wait at the first action of their flow as if
+        they had been suspended there.
+        """
+        now = timezone.now()
+        first_actions = [flow.get_root_actions().first() for flow in self.flows]
+        runs = []
+        for index in range(self.waiting):
+            continue_after = now + timedelta(seconds=self.get_due_offset())
+            runs.append(
+                FlowRun(
+                    flow=self.flows[index % len(self.flows)],
+                    status=FlowRun.Status.WAITING,
+                    action=first_actions[index % len(self.flows)],
+                    repeat_action=True,
+                    continue_after=continue_after,
+                    # Execution clears continue_after, keep it for latency
+                    state={"loadgen_due": continue_after.timestamp()},
+                )
+            )
+        FlowRun.objects.bulk_create(runs)
+        return len(runs)
+
+    def execute_due(self, worker: FlowRunWorker) -> int:
+        if self.driver == "worker":
+            return worker.run_once()
+        return continue_flowruns(batch_size=self.batch_size, workers=self.workers)
+
+    def drive(self) -> LoadReport:
+        """
+        Fire triggers at the target rate and execute due flow runs until
+        `duration` has passed.
+        """
+        if not self.flows:
+            self.setup()
+        waiting = self.create_waiting_runs()
+        worker = FlowRunWorker(batch_size=self.batch_size)
+        started_at = timezone.now()
+        start = time.monotonic()
+        triggered = executed = 0
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= self.duration:
+                break
+            due_triggers = int(elapsed * self.rate) - triggered
+            for _ in range(due_triggers):
+                trigger_flows(get_trigger_name(triggered % len(self.flows)))
+                triggered += 1
+            count = self.execute_due(worker)
+            executed += count
+            if not count and not due_triggers:
+                time.sleep(min(1 / self.rate if self.rate else 0.1, 0.1))
+        seconds = time.monotonic() - start
+        latencies = self.get_latencies(started_at)
+        return LoadReport(
+            triggered=triggered,
+            waiting=waiting,
+            executed=executed,
+            remaining=FlowRun.objects.filter(flow__in=self.flows)
+            .exclude(status=FlowRun.Status.DONE)
+            .count(),
+            seconds=seconds,
+            latency_p50=percentile(latencies, 0.5),
+            latency_p95=percentile(latencies, 0.95),
+            latency_p99=percentile(latencies, 0.99),
+        )
+
+    def get_latencies(self, started_at) -> list[float]:
+        """
+        Returns the sorted seconds between a flow run becoming due and
+        being done. Runs that were due before the load started count from
+        the start.
+        """
+        start = started_at.timestamp()
+        latencies = []
+        fields = ("created_at", "done_at", "state")
+        # Runs are moved to the archive on completion with
+        # FLOWCONTROL_ARCHIVE = "immediate"
+        for created_at, done_at, state in chain(
+            FlowRun.objects.filter(
+                flow__in=self.flows, status=FlowRun.Status.DONE, done_at__isnull=False
+            ).values_list(*fields),
+            FlowRunArchive.objects.filter(
+                flow__in=self.flows, done_at__isnull=False
+            ).values_list(*fields),
+        ):
+            due = state.get("loadgen_due", created_at.timestamp())
+            latencies.append(max(done_at.timestamp() - max(due, start), 0.0))
+        latencies.sort()
+        return latencies
+
+    def cleanup(self) -> int:
+        """
+        Delete the flows created by this generator with their flow runs and
+        triggers. Other flows are kept, even if their names look generated.
+
+        Returns:
+            The number of deleted flows.
+        """
+        _count, deleted = Flow.objects.filter(
+            id__in=[flow.id for flow in self.flows]
+        ).delete()
+        self.flows = []
+        return deleted.get(Flow._meta.label, 0)
@@ -1,9 +1,26 @@
+import json
+import signal
+import time
 from collections import Counter
+from itertools import chain
 
-from django.core.management.base import BaseCommand, CommandParser
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
 
-from ...engine import execute_flowrun
-from ...models import FlowRun
+from ... import conf, metrics
+from ...archive import archive_flowruns
+from ...benchmark import SCENARIOS, compare_results, run_benchmarks
+from ...engine import claim_flowruns, execute_flowruns, recover_flowruns
+from ...instrumentation import (
+    HISTOGRAM_BUCKETS,
+    CacheCollector,
+    flush_collectors,
+    get_collector,
+)
+from ...loadgen import DRIVERS, SHAPES, LoadGenerator
+from ...models import FlowRun, FlowRunArchive
+from ...retention import get_purgeable_flowruns, purge_flowruns
+from ...worker import FlowRunWorker
 
 
 class Command(BaseCommand):
@@ -13,29 +30,465 @@ class Command(BaseCommand):
         subparsers = parser.add_subparsers(dest="subcommand", help="Subcommands")
         # Add 'run' subcommand
         run_parser = subparsers.add_parser("run", help="Run the flowcontrol process")
-        # You can add more arguments to 'run' here if needed
+        run_parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of flow runs to claim at once",
+        )
+        run_parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximum number of flow runs to execute",
+        )
+        run_parser.add_argument(
+            "--flow",
+            type=int,
+            action="append",
+            dest="flow_ids",
+            default=None,
+            help="Only execute runs of the flow with this id, can be given multiple times",
+        )
+        run_parser.add_argument(
+            "--max-seconds",
+            type=float,
+            default=None,
+            help="Stop claiming new batches after this many seconds",
+        )
+        run_parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of parallel workers per batch",
+        )
+        subparsers.add_parser(
+            "recover", help="Return running flow runs with expired leases to the queue"
+        )
+        stats_parser = subparsers.add_parser(
+            "stats",
+            help="Show action latency percentiles collected by the cache collector",
+        )
+        stats_parser.add_argument(
+            "--by-action",
+            action="store_true",
+            help="Show statistics per flow action instead of per action class",
+        )
+        stats_parser.add_argument(
+            "--clear", action="store_true", help="Clear the collected statistics"
+        )
+        worker_parser = subparsers.add_parser(
+            "worker", help="Execute flow runs as they become due until stopped"
+        )
+        worker_parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of flow runs to claim at once",
+        )
+        worker_parser.add_argument(
+            "--max-sleep",
+            type=float,
+            default=None,
+            help="Maximum number of seconds to sleep before checking for due flow runs",
+        )
+
+        benchmark_parser = subparsers.add_parser(
+            "benchmark",
+            help="Measure engine throughput with synthetic flows, changes are rolled back",
+        )
+        benchmark_parser.add_argument(
+            "--scenario",
+            action="append",
+            dest="scenarios",
+            choices=sorted(SCENARIOS),
+            default=None,
+            help="Only run this scenario, can be given multiple times",
+        )
+        benchmark_parser.add_argument(
+            "--scale",
+            type=float,
+            default=1.0,
+            help="Factor for the number of runs and loop iterations",
+        )
+        benchmark_parser.add_argument(
+            "--no-memory",
+            action="store_false",
+            dest="memory",
+            help="Skip the second pass that measures peak memory",
+        )
+        benchmark_parser.add_argument(
+            "--json", action="store_true", help="Write the results as JSON"
+        )
+        benchmark_parser.add_argument(
+            "--output", default=None, help="Store the results as JSON in this file"
+        )
+        benchmark_parser.add_argument(
+            "--baseline",
+            default=None,
+            help="Compare the results against a JSON file stored with --output",
+        )
+        benchmark_parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed relative deviation from the baseline",
+        )
+
+        loadgen_parser = subparsers.add_parser(
+            "loadgen",
+            help="Create synthetic flows and runs and measure throughput and latency",
+        )
+        loadgen_parser.add_argument(
+            "--flows", type=int, default=10, help="Number of flows to create"
+        )
+        loadgen_parser.add_argument(
+            "--shape",
+            choices=SHAPES,
+            default=None,
+            help="Shape of the flows, cycles through all shapes by default",
+        )
+        loadgen_parser.add_argument(
+            "--size",
+            type=int,
+            default=5,
+            help="Number of actions, nesting depth or loop iterations per flow",
+        )
+        loadgen_parser.add_argument(
+            "--rate", type=float, default=50.0, help="Triggers fired per second"
+        )
+        loadgen_parser.add_argument(
+            "--duration",
+            type=float,
+            default=10.0,
+            help="Number of seconds to generate load",
+        )
+        loadgen_parser.add_argument(
+            "--waiting",
+            type=int,
+            default=100,
+            help="Number of waiting flow runs to create up front",
+        )
+        loadgen_parser.add_argument(
+            "--spread",
+            type=float,
+            default=60.0,
+            help="Number of seconds over which waiting flow runs become due",
+        )
+        loadgen_parser.add_argument(
+            "--driver",
+            choices=DRIVERS,
+            default="run",
+            help="Execute due runs with continue_flowruns or the worker",
+        )
+        loadgen_parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of flow runs to claim at once",
+        )
+        loadgen_parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of parallel workers per batch",
+        )
+        loadgen_parser.add_argument(
+            "--seed", type=int, default=None, help="Seed for the random distribution"
+        )
+        loadgen_parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the generated flows and runs afterwards",
+        )
+
+        purge_parser = subparsers.add_parser(
+            "purge", help="Delete finished flow runs after their retention period"
+        )
+        purge_parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Days to keep finished runs, defaults to FLOWCONTROL_RETENTION_DAYS",
+        )
+        purge_parser.add_argument(
+            "--outcome-days",
+            action="append",
+            default=None,
+            metavar="OUTCOME=DAYS",
+            help="Days to keep finished runs with this outcome, can be given multiple times",
+        )
+        purge_parser.add_argument(
+            "--flow",
+            type=int,
+            action="append",
+            dest="flow_ids",
+            default=None,
+            help="Only purge runs of the flow with this id, can be given multiple times",
+        )
+        purge_parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of flow runs to delete per transaction",
+        )
+        purge_parser.add_argument(
+            "--export",
+            default=None,
+            metavar="PATH",
+            help="Append the purged runs to this gzip compressed JSON lines file",
+        )
+        purge_parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the flow runs that would be purged",
+        )
+
+        archive_parser = subparsers.add_parser(
+            "archive", help="Move finished flow runs to the archive table"
+        )
+        archive_parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of flow runs to archive per transaction",
+        )
 
     def handle(self, *args, **options):
         subcommand = options.get("subcommand")
         if subcommand == "run":
             self.handle_run(options)
+        elif subcommand == "recover":
+            self.handle_recover(options)
+        elif subcommand == "worker":
+            self.handle_worker(options)
+        elif subcommand == "stats":
+            self.handle_stats(options)
+        elif subcommand == "benchmark":
+            self.handle_benchmark(options)
+        elif subcommand == "loadgen":
+            self.handle_loadgen(options)
+        elif subcommand == "purge":
+            self.handle_purge(options)
+        elif subcommand == "archive":
+            self.handle_archive(options)
         else:
             self.stdout.write(self.style.ERROR("No valid subcommand provided."))
 
+    def handle_recover(self, options):
+        count = recover_flowruns()
+        self.stdout.write(self.style.SUCCESS(f"Recovered {count} flow runs."))
+
+    def handle_stats(self, options):
+        collector = get_collector(CacheCollector) or CacheCollector()
+        collector.flush()
+        if options["clear"]:
+            collector.clear()
+            self.stdout.write(self.style.SUCCESS("Cleared action statistics."))
+            return
+        by_class = not options["by_action"]
+        stats = collector.stats(by_class=by_class)
+        if not stats:
+            self.stdout.write("No action statistics collected.")
+            return
+        header = "Action" if by_class else "Flow / Action id / Action"
+        self.stdout.write(
+            f"{header:<40} {'Count':>8} {'Errors':>7} {'p50 ms':>9} "
+            f"{'p95 ms':>9} {'Mean ms':>9} {'Queries':>8}"
+        )
+        for row in stats:
+            label = " / ".join(str(part) for part in row.key)
+            queries = "-" if row.queries is None else f"{row.queries:.1f}"
+            self.stdout.write(
+                f"{label:<40} {row.count:>8} {row.errors:>7} "
+                f"{self._format_ms(row.p50):>9} {self._format_ms(row.p95):>9} "
+                f"{row.mean * 1000:>9.1f} {queries:>8}"
+            )
+
+    def handle_benchmark(self, options):
+        results = run_benchmarks(
+            options["scenarios"], scale=options["scale"], memory=options["memory"]
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(
+                f"{'Scenario':<16} {'Runs':>6} {'Steps':>7} {'Runs/s':>9} "
+                f"{'Steps/s':>10} {'Queries/step':>13} {'Peak KiB':>9}"
+            )
+            for name, result in results["scenarios"].items():
+                queries = result["queries_per_step"]
+                memory = result["peak_memory_kb"]
+                self.stdout.write(
+                    f"{name:<16} {result['runs']:>6} {result['steps']:>7} "
+                    f"{result['runs_per_second']:>9.1f} "
+                    f"{result['steps_per_second']:>10.1f} "
+                    f"{'-' if queries is None else f'{queries:.3f}':>13} "
+                    f"{'-' if memory is None else f'{memory:.0f}':>9}"
+                )
+        if not options["baseline"]:
+            return
+        with open(options["baseline"]) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, options["tolerance"])
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(f"Regression: {regression}")
+            raise CommandError(f"{len(regressions)} benchmark regressions found.")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def handle_loadgen(self, options):
+        generator = LoadGenerator(
+            flows=options["flows"],
+            shape=options["shape"],
+            size=options["size"],
+            rate=options["rate"],
+            duration=options["duration"],
+            waiting=options["waiting"],
+            spread=options["spread"],
+            driver=options["driver"],
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            seed=options["seed"],
+        )
+        generator.setup()
+        self.stdout.write(
+            f"Generating load on {len(generator.flows)} flows "
+            f"for {options['duration']:.0f}s..."
+        )
+        try:
+            report = generator.drive()
+        finally:
+            if options["cleanup"]:
+                generator.cleanup()
+        self.stdout.write(
+            f"Triggered {report.triggered} runs, created {report.waiting} waiting runs."
+        )
+        self.stdout.write(
+            f"Executed {report.executed} runs in {report.seconds:.1f}s "
+            f"({report.throughput:.1f} runs/s), {report.remaining} not done."
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Latency p50 {self._format_ms(report.latency_p50)}ms, "
+                f"p95 {self._format_ms(report.latency_p95)}ms, "
+                f"p99 {self._format_ms(report.latency_p99)}ms"
+            )
+        )
+
+    def handle_purge(self, options):
+        outcome_days = None
+        if options["outcome_days"]:
+            outcome_days = conf.get_retention_days_by_outcome()
+            for value in options["outcome_days"]:
+                outcome, _sep, days = value.partition("=")
+                if outcome not in FlowRun.Outcome.values or not days.isdigit():
+                    raise CommandError(f"Invalid --outcome-days value: {value}")
+                outcome_days[outcome] = int(days)
+        queryset = get_purgeable_flowruns(
+            default_days=options["days"], outcome_days=outcome_days
+        )
+        if options["flow_ids"]:
+            queryset = queryset.filter(flow_id__in=options["flow_ids"])
+        count = purge_flowruns(
+            queryset,
+            chunk_size=options["chunk_size"],
+            export_path=options["export"],
+            dry_run=options["dry_run"],
+        )
+        if options["dry_run"]:
+            self.stdout.write(f"{count} flow runs would be purged.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Purged {count} flow runs."))
+
+    def handle_archive(self, options):
+        count = archive_flowruns(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {count} flow runs."))
+
+    def _format_ms(self, seconds):
+        if seconds == float("inf"):
+            return f">{HISTOGRAM_BUCKETS[-2] * 1000:.0f}"
+        return f"{seconds * 1000:.1f}"
+
+    def handle_worker(self, options):
+        worker = FlowRunWorker(
+            batch_size=options["batch_size"], max_sleep=options["max_sleep"]
+        )
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping worker...")
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write("Worker started.")
+        worker.run()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Worker stopped after executing {worker.executed} flow runs."
+            )
+        )
+
     def handle_run(self, options):
-        runnable = FlowRun.objects.get_runnable()
-        count = runnable.count()
+        batch_size = options.get("batch_size") or conf.get_claim_batch_size()
+        limit = options.get("limit")
+        max_seconds = options.get("max_seconds")
+        queryset = None
+        if options.get("flow_ids"):
+            queryset = FlowRun.objects.filter(flow_id__in=options["flow_ids"])
+
+        recover_flowruns()
+        now = timezone.now()
         status_counter = Counter()
         outcome_counter = Counter()
 
-        self.stdout.write(f"Executing {count} runnable flow runs...\n")
+        self.stdout.write("Executing runnable flow runs...\n")
 
-        for runnable_run in runnable:
-            execute_flowrun(runnable_run)
-            status_counter[runnable_run.status] += 1
-            if runnable_run.outcome:
-                outcome_counter[runnable_run.outcome] += 1
+        start = time.monotonic()
+        count = 0
+        batch_number = 0
+        while limit is None or count < limit:
+            if max_seconds is not None and time.monotonic() - start >= max_seconds:
+                self.stdout.write("Time limit reached.")
+                break
+            claim_size = batch_size
+            if limit is not None:
+                claim_size = min(batch_size, limit - count)
+            runs = claim_flowruns(claim_size, now=now, queryset=queryset)
+            if not runs:
+                break
+            batch_start = time.monotonic()
+            execute_flowruns(runs, workers=options.get("workers"))
+            batch_seconds = time.monotonic() - batch_start
+            # Process pools don't update the instances, read the result back.
+            # Runs archived on completion keep their id in the archive.
+            run_ids = [run.id for run in runs]
+            for status, outcome in chain(
+                FlowRun.objects.filter(id__in=run_ids).values_list("status", "outcome"),
+                FlowRunArchive.objects.filter(id__in=run_ids).values_list(
+                    "status", "outcome"
+                ),
+            ):
+                status_counter[status] += 1
+                if outcome:
+                    outcome_counter[outcome] += 1
+            count += len(runs)
+            batch_number += 1
+            rate = len(runs) / batch_seconds if batch_seconds else 0
+            total_rate = count / (time.monotonic() - start)
+            self.stdout.write(
+                f"Batch {batch_number}: {len(runs)} runs in {batch_seconds:.2f}s "
+                f"({rate:.1f} runs/s), {count} total ({total_rate:.1f} runs/s)"
+            )
 
-        self.stdout.write(self.style.SUCCESS("Finished executing runnable flow runs."))
+        flush_collectors()
+        metrics.registry.flush()
+        self.stdout.write(
+            self.style.SUCCESS(f"Finished executing {count} runnable flow runs.")
+        )
         self.stdout.write(f"Status counts: {status_counter.most_common()}")
         self.stdout.write(f"Outcome counts: {outcome_counter.most_common()}")
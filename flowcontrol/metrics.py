@@ -0,0 +1,307 @@
+import hashlib
+import threading
+import time
+from collections.abc import Callable, Iterable
+from typing import Optional
+
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import models
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import conf
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_sample(name: str, labels: dict, value: float) -> str:
+    if labels:
+        label_text = ",".join(
+            f'{key}="{escape_label_value(label)}"' for key, label in labels.items()
+        )
+        name = f"{name}{{{label_text}}}"
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{name} {value}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def samples(self) -> Iterable[tuple[dict, float]]:
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for labels, value in self.samples():
+            lines.append(format_sample(self.name, labels, value))
+        return lines
+
+
+class CounterMetric(Metric):
+    """
+    Counter rolled up across processes in a Django cache, optionally with
+    labels.
+
+    Increments are buffered per process and added to counters in the cache
+    every `flush_interval` seconds of the registry, so runs executed by
+    workers, Celery tasks or process pools show up in the metrics view of
+    the web process. Samples include the increments of this process that
+    are not flushed yet.
+    """
+
+    type = "counter"
+    prefix = "flowcontrol:metrics"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[conf.get_metrics_cache()]
+
+    def _key(self, labelvalues: tuple) -> str:
+        # Label values are arbitrary text, keep cache keys short and safe
+        digest = hashlib.md5(repr(labelvalues).encode(), usedforsecurity=False)
+        return f"{self.prefix}:{self.name}:{digest.hexdigest()}"
+
+    # The label values of all series are kept in an append-only index of
+    # numbered entries, so concurrent flushes only use atomic add and incr
+    # and never overwrite each other's series.
+    @property
+    def _index_key(self) -> str:
+        return f"{self.prefix}:{self.name}:labels"
+
+    def _index_entry_keys(self, count: int) -> list[str]:
+        return [f"{self._index_key}:{number}" for number in range(1, count + 1)]
+
+    def _add_to_index(self, labelvalues: tuple):
+        cache = self.cache
+        if not cache.add(f"{self._key(labelvalues)}:indexed", True, timeout=None):
+            return
+        cache.add(self._index_key, 0, timeout=None)
+        number = cache.incr(self._index_key)
+        cache.set(f"{self._index_key}:{number}", labelvalues, timeout=None)
+
+    def _get_indexed_labels(self) -> set[tuple]:
+        cache = self.cache
+        count = cache.get(self._index_key) or 0
+        return set(cache.get_many(self._index_entry_keys(count)).values())
+
+    def inc(self, *labelvalues, amount: float = 1):
+        if not registry.enabled:
+            return
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        labelvalues = tuple(str(value) for value in labelvalues)
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+        registry.flush_if_due()
+
+    def flush(self):
+        """
+        Add the buffered increments of this process to the cache.
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+        cache = self.cache
+        for labelvalues, value in values.items():
+            cache_key = self._key(labelvalues)
+            cache.add(cache_key, 0, timeout=None)
+            try:
+                cache.incr(cache_key, int(value))
+            except ValueError:
+                # Evicted between add and incr
+                cache.set(cache_key, int(value), timeout=None)
+            self._add_to_index(labelvalues)
+
+    def get(self, *labelvalues) -> float:
+        labelvalues = tuple(str(value) for value in labelvalues)
+        with self._lock:
+            pending = self._values.get(labelvalues, 0)
+        return (self.cache.get(self._key(labelvalues)) or 0) + pending
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+        cache = self.cache
+        count = cache.get(self._index_key) or 0
+        keys = [self._index_key, *self._index_entry_keys(count)]
+        for labelvalues in self._get_indexed_labels():
+            keys += [self._key(labelvalues), f"{self._key(labelvalues)}:indexed"]
+        cache.delete_many(keys)
+
+    def samples(self):
+        cache = self.cache
+        with self._lock:
+            pending = dict(self._values)
+        labels = self._get_indexed_labels() | pending.keys()
+        stored = cache.get_many([self._key(labelvalues) for labelvalues in labels])
+        for labelvalues in sorted(labels):
+            value = stored.get(self._key(labelvalues), 0) + pending.get(labelvalues, 0)
+            yield dict(zip(self.labelnames, labelvalues, strict=True)), value
+
+
+class CallbackMetric(Metric):
+    """
+    Gauge or counter whose samples are computed when metrics are rendered.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Iterable[tuple[dict, float]]],
+        type: str = "gauge",
+    ):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self.type = type
+
+    def samples(self):
+        return self.callback()
+
+
+class MetricsRegistry:
+    """
+    Registry of the metrics exposed by `flowcontrol.views.metrics_view`.
+
+    Counters are only incremented when `FLOWCONTROL_METRICS` is enabled.
+    """
+
+    def __init__(self, flush_interval: float = 10.0):
+        self.metrics: dict[str, Metric] = {}
+        self.enabled = conf.get_metrics_enabled()
+        self.flush_interval = flush_interval
+        self._flushed_at = time.monotonic()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()):
+        return self.register(CounterMetric(name, documentation, labelnames))
+
+    def callback(self, name: str, documentation: str, callback, type="gauge"):
+        return self.register(CallbackMetric(name, documentation, callback, type))
+
+    def flush(self):
+        """
+        Add the counter increments of this process to the cache.
+        """
+        self._flushed_at = time.monotonic()
+        for metric in self.metrics.values():
+            if isinstance(metric, CounterMetric):
+                metric.flush()
+
+    def flush_if_due(self):
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def clear(self):
+        for metric in self.metrics.values():
+            if isinstance(metric, CounterMetric):
+                metric.clear()
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@receiver(setting_changed)
+def metrics_setting_changed(*, setting, **kwargs):
+    if setting == "FLOWCONTROL_METRICS":
+        registry.enabled = conf.get_metrics_enabled()
+
+
+runs_created = registry.counter(
+    "flowcontrol_runs_created_total", "Flow runs created.", ("flow",)
+)
+runs_finished = registry.counter(
+    "flowcontrol_runs_finished_total", "Flow runs finished.", ("outcome",)
+)
+run_executions = registry.counter(
+    "flowcontrol_run_executions_total", "Flow run executions started."
+)
+actions_executed = registry.counter(
+    "flowcontrol_actions_executed_total", "Action steps executed.", ("action",)
+)
+trigger_calls = registry.counter(
+    "flowcontrol_trigger_calls_total", "Triggers fired.", ("trigger",)
+)
+
+
+def get_trigger_cache_samples():
+    from .triggers import trigger_cache
+
+    yield {"result": "hit"}, trigger_cache.hits
+    yield {"result": "miss"}, trigger_cache.misses
+
+
+def get_runnable_backlog_samples():
+    from .models import FlowRun
+
+    yield {}, FlowRun.objects.get_runnable().order_by().count()
+
+
+def get_oldest_due_age(now=None) -> Optional[float]:
+    """
+    Returns the number of seconds the oldest runnable flow run is overdue.
+    """
+    from .models import FlowRun
+
+    if now is None:
+        now = timezone.now()
+    pending = FlowRun.objects.filter(
+        status=FlowRun.Status.PENDING, continue_after__isnull=True
+    ).aggregate(due=models.Min("created_at"))["due"]
+    waiting = FlowRun.objects.filter(
+        status=FlowRun.Status.WAITING, continue_after__lte=now
+    ).aggregate(due=models.Min("continue_after"))["due"]
+    due_times = [due for due in (pending, waiting) if due is not None]
+    if not due_times:
+        return None
+    return max((now - min(due_times)).total_seconds(), 0)
+
+
+def get_oldest_due_age_samples():
+    yield {}, get_oldest_due_age() or 0.0
+
+
+registry.callback(
+    "flowcontrol_trigger_cache_lookups_total",
+    "Trigger cache lookups by result.",
+    get_trigger_cache_samples,
+    type="counter",
+)
+registry.callback(
+    "flowcontrol_runnable_runs",
+    "Flow runs that are due for execution.",
+    get_runnable_backlog_samples,
+)
+registry.callback(
+    "flowcontrol_oldest_due_run_age_seconds",
+    "Seconds the oldest runnable flow run has been due.",
+    get_oldest_due_age_samples,
+)
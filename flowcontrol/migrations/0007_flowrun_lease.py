@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcontrol', '0006_trigger_reset_to_action'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowrun',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text='Running runs are recovered after their lease expired.', null=True, verbose_name='Lease expires at'),
+        ),
+        migrations.AddField(
+            model_name='flowrun',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', help_text='Worker that is currently executing this run.', max_length=255, verbose_name='Lease owner'),
+        ),
+    ]
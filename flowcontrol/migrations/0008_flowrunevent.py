@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:16
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_log_to_events(apps, schema_editor):
+    FlowRun = apps.get_model('flowcontrol', 'FlowRun')
+    FlowRunEvent = apps.get_model('flowcontrol', 'FlowRunEvent')
+    runs = FlowRun.objects.exclude(log='').only('id', 'log', 'created_at', 'done_at')
+    events = []
+    for run in runs.iterator(chunk_size=1000):
+        timestamp = run.done_at or run.created_at
+        for line in run.log.splitlines():
+            if line:
+                events.append(FlowRunEvent(run_id=run.id, timestamp=timestamp, message=line))
+        if len(events) >= 1000:
+            FlowRunEvent.objects.bulk_create(events)
+            events = []
+    FlowRunEvent.objects.bulk_create(events)
+
+
+def copy_events_to_log(apps, schema_editor):
+    FlowRun = apps.get_model('flowcontrol', 'FlowRun')
+    FlowRunEvent = apps.get_model('flowcontrol', 'FlowRunEvent')
+    run_ids = FlowRunEvent.objects.values_list('run_id', flat=True).distinct()
+    for run_id in run_ids.iterator():
+        messages = FlowRunEvent.objects.filter(run_id=run_id).order_by('id').values_list('message', flat=True)
+        FlowRun.objects.filter(id=run_id).update(log='\n'.join(messages))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcontrol', '0007_flowrun_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowRunEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Timestamp')),
+                ('level', models.PositiveSmallIntegerField(choices=[(10, 'Debug'), (20, 'Info'), (30, 'Warning'), (40, 'Error')], default=20, verbose_name='Level')),
+                ('message', models.TextField(verbose_name='Message')),
+                ('data', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Data')),
+                ('action', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='flowcontrol.flowaction', verbose_name='Action')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='flowcontrol.flowrun', verbose_name='Flow Run')),
+            ],
+            options={
+                'verbose_name': 'Flow Run Event',
+                'verbose_name_plural': 'Flow Run Events',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(copy_log_to_events, copy_events_to_log),
+        migrations.RemoveField(
+            model_name='flowrun',
+            name='log',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcontrol', '0008_flowrunevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowrun',
+            name='loop_counters',
+            field=models.JSONField(blank=True, default=dict, help_text='Loop iterations per action id, kept between execution slices.', verbose_name='Loop counters'),
+        ),
+        migrations.AddField(
+            model_name='flowrun',
+            name='returning',
+            field=models.BooleanField(default=False, help_text="Set when execution was paused after the action's children.", verbose_name='Return from children on resume'),
+        ),
+    ]
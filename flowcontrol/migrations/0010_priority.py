@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('flowcontrol', '0009_flowrun_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flow',
+            name='priority',
+            field=models.SmallIntegerField(default=0, help_text='Runs of flows with a higher priority are executed first.', verbose_name='Priority'),
+        ),
+        migrations.AddField(
+            model_name='flowrun',
+            name='priority',
+            field=models.SmallIntegerField(default=0, help_text='Runs with a higher priority are executed first.', verbose_name='Priority'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('flowcontrol', '0010_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flow',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Finished runs are purged after this many days. Leave empty to use the retention settings.', null=True, verbose_name='Retention days'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:37
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('flowcontrol', '0011_flow_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowRunArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Flow run id')),
+                ('parent_run_id', models.BigIntegerField(blank=True, null=True, verbose_name='Parent Run')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('waiting', 'Waiting'), ('paused', 'Paused'), ('done', 'done')], default='done', max_length=20, verbose_name='Status')),
+                ('outcome', models.CharField(blank=True, choices=[('complete', 'Complete'), ('aborted', 'Aborted'), ('errored', 'Errored'), ('obsolete', 'Obsolete'), ('canceled', 'Canceled')], max_length=20, verbose_name='Outcome')),
+                ('priority', models.SmallIntegerField(default=0, verbose_name='Priority')),
+                ('created_at', models.DateTimeField(verbose_name='Created At')),
+                ('done_at', models.DateTimeField(blank=True, null=True, verbose_name='Completed At')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Archived At')),
+                ('object_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('state', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='State')),
+                ('events', models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Events')),
+                ('action', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='flowcontrol.flowaction', verbose_name='Action')),
+                ('content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('flow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_runs', to='flowcontrol.flow', verbose_name='Flow')),
+                ('trigger', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='flowcontrol.trigger', verbose_name='Created by trigger')),
+            ],
+            options={
+                'verbose_name': 'Archived Flow Run',
+                'verbose_name_plural': 'Archived Flow Runs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['content_type', 'object_id', 'flow'], name='flowrunarchive_object_idx'), models.Index(fields=['done_at'], name='flowrunarchive_done_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def set_missing_leases(apps, schema_editor):
+    from flowcontrol import conf
+
+    # Runs stuck in running before leases existed have no expiry and would
+    # never be recovered. Give them one lease period to finish if they are
+    # still executing.
+    FlowRun = apps.get_model("flowcontrol", "FlowRun")
+    FlowRun.objects.filter(status="running", lease_expires_at__isnull=True).update(
+        lease_expires_at=timezone.now() + conf.get_lease_duration()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flowcontrol", "0012_flowrunarchive"),
+    ]
+
+    operations = [
+        migrations.RunPython(set_missing_leases, migrations.RunPython.noop),
+    ]
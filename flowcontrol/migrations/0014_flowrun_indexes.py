@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:22
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('flowcontrol', '0013_flowrun_lease_backfill'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flowrun',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['status', 'continue_after'], name='flowrun_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowrun',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['status', 'continue_after'], name='flowrun_waiting_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowrun',
+            index=models.Index(models.OrderBy(models.F('priority'), descending=True), django.db.models.functions.comparison.Coalesce('continue_after', 'created_at'), models.F('id'), condition=models.Q(('status__in', ['pending', 'waiting'])), name='flowrun_priority_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowrun',
+            index=models.Index(condition=models.Q(('status', 'done')), fields=['status', 'done_at'], name='flowrun_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowrun',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['waiting_trigger', 'status', 'content_type', 'object_id'], name='flowrun_waiting_trigger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowrun',
+            index=models.Index(fields=['content_type', 'object_id', 'status'], name='flowrun_object_idx'),
+        ),
+    ]
@@ -1,10 +1,20 @@
 from .config import Condition, Delay, StartFlow
-from .core import ActionBase, Flow, FlowAction, FlowRun, Trigger
+from .core import (
+    ActionBase,
+    Flow,
+    FlowAction,
+    FlowRun,
+    FlowRunArchive,
+    FlowRunEvent,
+    Trigger,
+)
 
 __all__ = [
     "Flow",
     "FlowAction",
     "FlowRun",
+    "FlowRunEvent",
+    "FlowRunArchive",
     "ActionBase",
     "Trigger",
     "Condition",
@@ -1,3 +1,4 @@
+import logging
 from typing import TYPE_CHECKING, Optional
 
 from django.conf import settings
@@ -6,12 +7,14 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from treebeard.mp_tree import MP_Node
 
+from .. import conf
 from ..registry import (
     MAX_ACTION_NAME_LENGTH,
     MAX_TRIGGER_NAME_LENGTH,
@@ -76,12 +79,26 @@ class Flow(models.Model):
         editable=False,
     )
 
+    priority = models.SmallIntegerField(
+        default=0,
+        verbose_name=_("Priority"),
+        help_text=_("Runs of flows with a higher priority are executed first."),
+    )
     max_concurrent = models.PositiveIntegerField(
         default=0, verbose_name=_("Max Concurrent Runs")
     )
     max_per_object = models.PositiveIntegerField(default=0)
     max_concurrent_per_object = models.PositiveIntegerField(default=1)
 
+    retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Retention days"),
+        help_text=_(
+            "Finished runs are purged after this many days. "
+            "Leave empty to use the retention settings."
+        ),
+    )
     content_type = models.ForeignKey(
         ContentType,
         on_delete=models.SET_NULL,
@@ -202,7 +219,11 @@ class FlowAction(MP_Node):
             if target_action_class and not target_action_class.has_children:
                 return
 
-        return super().move(target, pos=pos)
+        from ..plan import flow_actions_changed
+
+        result = super().move(target, pos=pos)
+        flow_actions_changed(self.flow_id)
+        return result
 
 
 class ActionBase(FlowAction):
@@ -218,19 +239,46 @@ class ActionBase(FlowAction):
         abstract = True
 
 
-class FlowRunManager(models.Manager):
-    def get_queryset(self):
-        return (
-            super()
-            .get_queryset()
-            .select_related("flow")
-            .prefetch_related("flow__actions")
+def get_due_at() -> Coalesce:
+    """
+    Returns the expression for the time a flow run became due: its
+    `continue_after` or, for pending runs, its creation time.
+    """
+    return Coalesce("continue_after", "created_at")
+
+
+class FlowRunQuerySet(models.QuerySet):
+    def with_flow(self):
+        """
+        Load the flow of each run in the same query.
+        """
+        return self.select_related("flow")
+
+    def with_plan(self):
+        """
+        Load the flow and its complete action tree of each run.
+
+        The engine does not need this, it uses the cached flow plan from
+        `flowcontrol.plan.get_flow_plan`.
+        """
+        return self.with_flow().prefetch_related(
+            models.Prefetch(
+                "flow__actions", queryset=FlowAction.objects.order_by("path")
+            )
         )
 
-    def get_runnable(self):
-        return self.get_queryset().filter(
-            Q(status=FlowRun.Status.PENDING, continue_after__isnull=True)
-            | Q(status=FlowRun.Status.WAITING, continue_after__lte=timezone.now())
+
+class FlowRunManager(models.Manager.from_queryset(FlowRunQuerySet)):
+    def get_runnable(self, now=None):
+        if now is None:
+            now = timezone.now()
+        return (
+            self.get_queryset()
+            .with_flow()
+            .filter(
+                Q(status=FlowRun.Status.PENDING, continue_after__isnull=True)
+                | Q(status=FlowRun.Status.WAITING, continue_after__lte=now)
+            )
         )
 
 
@@ -301,6 +349,17 @@ class FlowRun(models.Model):
         default=False,
         verbose_name=_("Execute action again on resume"),
     )
+    returning = models.BooleanField(
+        default=False,
+        verbose_name=_("Return from children on resume"),
+        help_text=_("Set when execution was paused after the action's children."),
+    )
+    loop_counters = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_("Loop counters"),
+        help_text=_("Loop iterations per action id, kept between execution slices."),
+    )
     status = models.CharField(
         max_length=20,
         choices=Status,
@@ -314,7 +373,11 @@ class FlowRun(models.Model):
         default="",
         verbose_name=_("Outcome"),
     )
-    log = models.TextField(blank=True, verbose_name=_("Log"))
+    priority = models.SmallIntegerField(
+        default=0,
+        verbose_name=_("Priority"),
+        help_text=_("Runs with a higher priority are executed first."),
+    )
     created_at = models.DateTimeField(
         default=timezone.now,
         verbose_name=_("Created At"),
@@ -330,6 +393,20 @@ class FlowRun(models.Model):
         verbose_name=_("Completed At"),
     )
 
+    lease_owner = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        verbose_name=_("Lease owner"),
+        help_text=_("Worker that is currently executing this run."),
+    )
+    lease_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Lease expires at"),
+        help_text=_("Running runs are recovered after their lease expired."),
+    )
+
     content_type = models.ForeignKey(
         ContentType, on_delete=models.CASCADE, null=True, blank=True
     )
@@ -349,6 +426,47 @@ class FlowRun(models.Model):
         verbose_name = _("Flow Run")
         verbose_name_plural = _("Flow Runs")
         ordering = ["-created_at"]
+        indexes = [
+            # Databases without partial indexes (MySQL, MariaDB) ignore the
+            # conditions, the status columns keep these indexes selective there.
+            # Runnable queue, one partial index per status so that each branch
+            # of FlowRunManager.get_runnable can use its own index
+            models.Index(
+                fields=["status", "continue_after"],
+                name="flowrun_pending_idx",
+                condition=Q(status=Status.PENDING),
+            ),
+            models.Index(
+                fields=["status", "continue_after"],
+                name="flowrun_waiting_idx",
+                condition=Q(status=Status.WAITING),
+            ),
+            # Runnable queue in claim order
+            models.Index(
+                F("priority").desc(),
+                get_due_at(),
+                F("id"),
+                name="flowrun_priority_idx",
+                condition=Q(status__in=[Status.PENDING, Status.WAITING]),
+            ),
+            # Finished runs by age for purging
+            models.Index(
+                fields=["status", "done_at"],
+                name="flowrun_done_idx",
+                condition=Q(status=Status.DONE),
+            ),
+            # Runs waiting on a trigger for an object
+            models.Index(
+                fields=["waiting_trigger", "status", "content_type", "object_id"],
+                name="flowrun_waiting_trigger_idx",
+                condition=Q(status=Status.WAITING),
+            ),
+            # Runs for an object
+            models.Index(
+                fields=["content_type", "object_id", "status"],
+                name="flowrun_object_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.flow.name} - {self.status}"
@@ -360,17 +478,255 @@ class FlowRun(models.Model):
         if self.action and not self.action.flow_id == self.flow_id:
             raise ValidationError(_("Action does not belong to the flow."))
 
-    def append_log(self, message: str, save=True):
+    def release_lease(self):
         """
-        Append a message to the flow run log.
+        Clear the execution lease of the flow run, does not save.
+        """
+        self.lease_owner = ""
+        self.lease_expires_at = None
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.flush_events()
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None:
+            # Discard unsaved events like other unsaved changes
+            self._pending_events = []
+
+    def append_log(
+        self,
+        message: str,
+        save=True,
+        level: int = logging.INFO,
+        data: Optional[dict] = None,
+    ):
+        """
+        Add an event to the flow run log.
+
+        Events are buffered and written with the next `save()` of the run.
+
+        Args:
+            message (str): The log message.
+            save (bool): Write buffered events right away.
+            level (int): Log level of the event, uses the levels of the logging module.
+            data (Optional[dict]): Optional structured data for the event.
         """
         if not message:
             return
-        if self.log:
-            self.log += "\n"
-        self.log += message
+        if not hasattr(self, "_pending_events"):
+            self._pending_events = []
+        self._pending_events.append(
+            FlowRunEvent(
+                run=self,
+                level=level,
+                action_id=self.action_id,
+                message=message,
+                data=data or {},
+            )
+        )
         if save:
-            self.save(update_fields=["log"])
+            self.flush_events()
+
+    def flush_events(self):
+        """
+        Write buffered log events and drop events beyond
+        `FLOWCONTROL_RUN_EVENT_LIMIT`.
+        """
+        events = getattr(self, "_pending_events", None)
+        if not events or self.pk is None:
+            return
+        self._pending_events = []
+        FlowRunEvent.objects.bulk_create(events)
+        limit = conf.get_run_event_limit()
+        if limit > 0:
+            oldest_kept = list(
+                FlowRunEvent.objects.filter(run_id=self.pk)
+                .order_by("-id")
+                .values_list("id", flat=True)[limit - 1 : limit]
+            )
+            if oldest_kept:
+                FlowRunEvent.objects.filter(
+                    run_id=self.pk, id__lt=oldest_kept[0]
+                ).delete()
+
+    @property
+    def log(self) -> str:
+        """
+        The messages of the flow run's log events as text.
+        """
+        messages = []
+        if self.pk is not None:
+            messages = list(
+                FlowRunEvent.objects.filter(run_id=self.pk)
+                .order_by("id")
+                .values_list("message", flat=True)
+            )
+        messages.extend(event.message for event in getattr(self, "_pending_events", ()))
+        return "\n".join(messages)
+
+
+class EventLevel(models.IntegerChoices):
+    DEBUG = logging.DEBUG, _("Debug")
+    INFO = logging.INFO, _("Info")
+    WARNING = logging.WARNING, _("Warning")
+    ERROR = logging.ERROR, _("Error")
+
+
+class FlowRunEvent(models.Model):
+    """
+    Append-only log event of a flow run.
+    """
+
+    Level = EventLevel
+
+    run = models.ForeignKey(
+        FlowRun,
+        on_delete=models.CASCADE,
+        related_name="events",
+        verbose_name=_("Flow Run"),
+    )
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name=_("Timestamp"))
+    level = models.PositiveSmallIntegerField(
+        choices=EventLevel, default=EventLevel.INFO, verbose_name=_("Level")
+    )
+    action = models.ForeignKey(
+        FlowAction,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name=_("Action"),
+    )
+    message = models.TextField(verbose_name=_("Message"))
+    data = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_("Data"),
+        encoder=DjangoJSONEncoder,
+    )
+
+    class Meta:
+        verbose_name = _("Flow Run Event")
+        verbose_name_plural = _("Flow Run Events")
+        ordering = ["id"]
+
+    def __str__(self):
+        return self.message
+
+
+class FlowRunArchive(models.Model):
+    """
+    Finished flow run moved out of the `FlowRun` table.
+
+    Archived runs keep the id of their flow run. Their events are stored
+    with them as a list.
+    """
+
+    Status = Status
+    Outcome = Outcome
+
+    id = models.BigIntegerField(primary_key=True, verbose_name=_("Flow run id"))
+    flow = models.ForeignKey(
+        Flow,
+        on_delete=models.CASCADE,
+        related_name="archived_runs",
+        verbose_name=_("Flow"),
+    )
+    parent_run_id = models.BigIntegerField(
+        null=True, blank=True, verbose_name=_("Parent Run")
+    )
+    trigger = models.ForeignKey(
+        "Trigger",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name=_("Created by trigger"),
+    )
+    action = models.ForeignKey(
+        FlowAction,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name=_("Action"),
+    )
+    status = models.CharField(
+        max_length=20, choices=Status, default=Status.DONE, verbose_name=_("Status")
+    )
+    outcome = models.CharField(
+        max_length=20, blank=True, choices=Outcome, verbose_name=_("Outcome")
+    )
+    priority = models.SmallIntegerField(default=0, verbose_name=_("Priority"))
+    created_at = models.DateTimeField(verbose_name=_("Created At"))
+    done_at = models.DateTimeField(
+        null=True, blank=True, verbose_name=_("Completed At")
+    )
+    archived_at = models.DateTimeField(
+        default=timezone.now, verbose_name=_("Archived At")
+    )
+
+    content_type = models.ForeignKey(
+        ContentType, on_delete=models.CASCADE, null=True, blank=True
+    )
+    object_id = models.PositiveBigIntegerField(null=True, blank=True)
+    content_object = GenericForeignKey("content_type", "object_id")
+
+    state = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_("State"),
+        encoder=DjangoJSONEncoder,
+    )
+    events = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name=_("Events"),
+        encoder=DjangoJSONEncoder,
+    )
+
+    class Meta:
+        verbose_name = _("Archived Flow Run")
+        verbose_name_plural = _("Archived Flow Runs")
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["content_type", "object_id", "flow"],
+                name="flowrunarchive_object_idx",
+            ),
+            models.Index(fields=["done_at"], name="flowrunarchive_done_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.flow.name} - {self.status}"
+
+    @classmethod
+    def from_flowrun(cls, run: FlowRun, events: list[dict]) -> "FlowRunArchive":
+        return cls(
+            id=run.id,
+            flow_id=run.flow_id,
+            parent_run_id=run.parent_run_id,
+            trigger_id=run.trigger_id,
+            action_id=run.action_id,
+            status=run.status,
+            outcome=run.outcome,
+            priority=run.priority,
+            created_at=run.created_at,
+            done_at=run.done_at,
+            content_type_id=run.content_type_id,
+            object_id=run.object_id,
+            state=run.state,
+            events=events,
+        )
+
+    @property
+    def log(self) -> str:
+        """
+        The messages of the archived events as text.
+        """
+        return "\n".join(event["message"] for event in self.events)
 
 
 def get_trigger_choices():
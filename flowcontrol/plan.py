@@ -0,0 +1,251 @@
+import threading
+from collections import defaultdict
+from collections.abc import Iterable, Mapping
+from types import MappingProxyType
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ActionBase, Flow, FlowAction
+
+if TYPE_CHECKING:
+    from datetime import datetime
+
+
+class PlanNode(NamedTuple):
+    action: FlowAction
+    parent_id: Optional[int] = None
+    first_child_id: Optional[int] = None
+    next_sibling_id: Optional[int] = None
+
+
+class FlowPlan:
+    """
+    Immutable in-memory representation of the action tree of a flow.
+
+    The tree is loaded with a single query and navigated without touching
+    the database again.
+    """
+
+    def __init__(
+        self, flow_id: int, stamp: Optional["datetime"], actions: list[FlowAction]
+    ):
+        self.flow_id = flow_id
+        self.stamp = stamp
+
+        ids_by_path = {}
+        links = {}
+        last_child = {}
+        first_root_id = None
+        for action in sorted(actions, key=lambda a: a.path):
+            parent_id = ids_by_path.get(action.path[: -action.steplen])
+            ids_by_path[action.path] = action.id
+            links[action.id] = {
+                "action": action,
+                "parent_id": parent_id,
+                "first_child_id": None,
+                "next_sibling_id": None,
+            }
+            previous_id = last_child.get(parent_id)
+            if previous_id is not None:
+                links[previous_id]["next_sibling_id"] = action.id
+            elif parent_id is not None:
+                links[parent_id]["first_child_id"] = action.id
+            else:
+                first_root_id = action.id
+            last_child[parent_id] = action.id
+
+        self.first_action_id = first_root_id
+        self.nodes = MappingProxyType(
+            {action_id: PlanNode(**link) for action_id, link in links.items()}
+        )
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, action_id):
+        return action_id in self.nodes
+
+    def _get(self, action_id: Optional[int]) -> Optional[FlowAction]:
+        if action_id is None:
+            return None
+        return self.nodes[action_id].action
+
+    @property
+    def first_action(self) -> Optional[FlowAction]:
+        return self._get(self.first_action_id)
+
+    @property
+    def actions(self) -> list[FlowAction]:
+        return [node.action for node in self.nodes.values()]
+
+    def get_action(self, action_id: int) -> Optional[FlowAction]:
+        node = self.nodes.get(action_id)
+        if node is None:
+            return None
+        return node.action
+
+    def get_parent(self, action: FlowAction) -> Optional[FlowAction]:
+        return self._get(self.nodes[action.id].parent_id)
+
+    def get_first_child(self, action: FlowAction) -> Optional[FlowAction]:
+        return self._get(self.nodes[action.id].first_child_id)
+
+    def get_next_sibling(self, action: FlowAction) -> Optional[FlowAction]:
+        return self._get(self.nodes[action.id].next_sibling_id)
+
+
+def load_action_configs(actions: Iterable[FlowAction]) -> dict[int, ActionBase]:
+    """
+    Load the configuration objects of the given actions with one query per
+    configuration model.
+
+    Args:
+        actions (Iterable[FlowAction]): The actions to load configurations for.
+
+    Returns:
+        A dictionary mapping action ids to their configuration objects.
+    """
+    ids_by_model = defaultdict(list)
+    for action in actions:
+        action_class = action.get_action_class()
+        if action_class and action_class.model is not None:
+            ids_by_model[action_class.model].append(action.id)
+
+    configs = {}
+    for model, action_ids in ids_by_model.items():
+        for config in model.objects.filter(flowaction_ptr_id__in=action_ids):
+            configs[config.pk] = config
+    return configs
+
+
+class ActionConfigMap(Mapping):
+    """
+    Maps action ids of a plan to their configuration objects.
+
+    Configurations are loaded lazily: the first lookup of an action with a
+    given configuration model loads the configurations of all actions of the
+    plan that use the same model.
+    """
+
+    def __init__(self, plan: FlowPlan):
+        self.plan = plan
+        self.configs: dict[int, Optional[ActionBase]] = {}
+        self.loaded_models = set()
+
+    def _load(self, model):
+        self.loaded_models.add(model)
+        actions = []
+        for action in self.plan.actions:
+            action_class = action.get_action_class()
+            if action_class and action_class.model is model:
+                actions.append(action)
+        self.configs.update(load_action_configs(actions))
+
+    def __getitem__(self, action_id: int) -> Optional[ActionBase]:
+        if action_id in self.configs:
+            return self.configs[action_id]
+        action = self.plan.get_action(action_id)
+        if action is None:
+            raise KeyError(action_id)
+        action_class = action.get_action_class()
+        if not action_class or action_class.model is None:
+            return None
+        if action_class.model not in self.loaded_models:
+            self._load(action_class.model)
+        return self.configs.get(action_id)
+
+    def is_loaded(self, action_id: int) -> bool:
+        """
+        Returns True if looking up the action id does not query the database.
+        """
+        if action_id in self.configs:
+            return True
+        action = self.plan.get_action(action_id)
+        if action is None:
+            return True
+        action_class = action.get_action_class()
+        if not action_class or action_class.model is None:
+            return True
+        return action_class.model in self.loaded_models
+
+    def __iter__(self):
+        return iter(self.plan.nodes)
+
+    def __len__(self):
+        return len(self.plan)
+
+
+_plan_cache: dict[int, FlowPlan] = {}
+_plan_lock = threading.Lock()
+
+
+def build_flow_plan(flow: Flow, stamp: Optional["datetime"] = None) -> FlowPlan:
+    actions = list(FlowAction.objects.filter(flow_id=flow.id).order_by("path"))
+    return FlowPlan(flow.id, flow.updated_at if stamp is None else stamp, actions)
+
+
+def get_flow_plan(
+    flow: Flow, refresh: bool = False, check_stamp: bool = False
+) -> FlowPlan:
+    """
+    Returns the compiled plan for the given flow.
+
+    Plans are cached per process and keyed by the flow's `updated_at`
+    timestamp, which is bumped whenever an action of the flow changes.
+    Flow instances kept around, e.g. by the trigger cache, can carry an old
+    timestamp. Use `check_stamp` to compare against the timestamp in the
+    database instead.
+
+    Args:
+        flow (Flow): The flow to get the plan for.
+        refresh (bool): Rebuild the plan even if a cached one is available.
+        check_stamp (bool): Read the flow's current `updated_at` from the database.
+
+    Returns:
+        The FlowPlan for the flow.
+    """
+    stamp = flow.updated_at
+    if check_stamp:
+        stamp = (
+            Flow.objects.filter(id=flow.id).values_list("updated_at", flat=True).first()
+        )
+    if not refresh:
+        plan = _plan_cache.get(flow.id)
+        if plan is not None and plan.stamp == stamp:
+            return plan
+    plan = build_flow_plan(flow, stamp)
+    with _plan_lock:
+        _plan_cache[flow.id] = plan
+    return plan
+
+
+def invalidate_flow_plan(flow_id: Optional[int] = None):
+    """
+    Drop cached plans for the given flow id or for all flows if not given.
+    """
+    with _plan_lock:
+        if flow_id is None:
+            _plan_cache.clear()
+        else:
+            _plan_cache.pop(flow_id, None)
+
+
+def flow_actions_changed(flow_id: int):
+    """
+    Invalidate the local plan and bump the flow's `updated_at` timestamp
+    so that plans cached in other processes are rebuilt as well.
+    """
+    invalidate_flow_plan(flow_id)
+    Flow.objects.filter(id=flow_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def flow_action_changed_handler(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    if isinstance(instance, FlowAction) and instance.flow_id:
+        flow_actions_changed(instance.flow_id)
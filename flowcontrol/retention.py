@@ -0,0 +1,172 @@
+import gzip
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import IO, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.utils import timezone
+
+from . import conf
+from .models import Flow, FlowRun, FlowRunEvent
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = (
+    "id",
+    "flow_id",
+    "parent_run_id",
+    "trigger_id",
+    "action_id",
+    "status",
+    "outcome",
+    "priority",
+    "created_at",
+    "done_at",
+    "content_type_id",
+    "object_id",
+    "state",
+)
+EVENT_EXPORT_FIELDS = ("timestamp", "level", "action_id", "message", "data")
+# Runs for an object count towards their flow's maximum runs per object
+COUNTED_PER_OBJECT = models.Q(flow__max_per_object__gt=0, object_id__isnull=False)
+
+
+def get_purgeable_flowruns(
+    now: Optional[datetime] = None,
+    default_days: Optional[int] = None,
+    outcome_days: Optional[dict[str, int]] = None,
+) -> models.QuerySet[FlowRun]:
+    """
+    Returns the finished flow runs whose retention period has passed.
+
+    The retention of a flow's runs is its `retention_days` if set. Otherwise
+    it is looked up by outcome in `outcome_days`, falling back to
+    `default_days`. Runs without a retention period are kept, as are runs
+    for an object of flows with a maximum number of runs per object, since
+    purging them would let the flow run again for the object. Archive them
+    instead.
+
+    Args:
+        now (Optional[datetime]): Reference time. Defaults to now.
+        default_days (Optional[int]): Days to keep finished runs. Defaults to `FLOWCONTROL_RETENTION_DAYS`.
+        outcome_days (Optional[dict[str, int]]): Days to keep finished runs per outcome. Defaults to `FLOWCONTROL_RETENTION_DAYS_BY_OUTCOME`.
+
+    Returns:
+        A queryset of purgeable flow runs.
+    """
+    if now is None:
+        now = timezone.now()
+    if default_days is None:
+        default_days = conf.get_retention_days()
+    if outcome_days is None:
+        outcome_days = conf.get_retention_days_by_outcome()
+
+    condition = models.Q(pk__in=[])
+    flow_days = dict(
+        Flow.objects.filter(retention_days__isnull=False).values_list(
+            "id", "retention_days"
+        )
+    )
+    flow_ids_by_days = defaultdict(list)
+    for flow_id, days in flow_days.items():
+        flow_ids_by_days[days].append(flow_id)
+    for days, flow_ids in flow_ids_by_days.items():
+        condition |= models.Q(
+            flow_id__in=flow_ids, done_at__lt=now - timedelta(days=days)
+        )
+
+    default_condition = models.Q(pk__in=[])
+    for outcome in FlowRun.Outcome.values:
+        days = outcome_days.get(outcome, default_days)
+        if days is None:
+            continue
+        default_condition |= models.Q(
+            outcome=outcome, done_at__lt=now - timedelta(days=days)
+        )
+    condition |= default_condition & ~models.Q(flow_id__in=flow_days.keys())
+
+    return (
+        FlowRun.objects.filter(status=FlowRun.Status.DONE)
+        .filter(condition)
+        .exclude(COUNTED_PER_OBJECT)
+    )
+
+
+def purge_flowruns(
+    queryset: Optional[models.QuerySet[FlowRun]] = None,
+    chunk_size: int = 1000,
+    export_path: Optional[str] = None,
+    dry_run: bool = False,
+) -> int:
+    """
+    Delete purgeable flow runs with their events in chunks.
+
+    Runs are paged through by id, each chunk is deleted in its own
+    transaction so the table is never locked for long. With `export_path`
+    each chunk is first appended to a gzip compressed JSON lines file, one
+    flow run with its events per line.
+
+    Runs that count towards a flow's `max_per_object` are never purged.
+
+    Args:
+        queryset (Optional[QuerySet]): Runs to purge. Defaults to `get_purgeable_flowruns()`.
+        chunk_size (int): Number of runs to delete per transaction.
+        export_path (Optional[str]): File to export the purged runs to.
+        dry_run (bool): Only count the runs that would be purged.
+
+    Returns:
+        The number of purged flow runs.
+    """
+    if queryset is None:
+        queryset = get_purgeable_flowruns()
+    queryset = queryset.exclude(COUNTED_PER_OBJECT)
+    if dry_run:
+        return queryset.count()
+
+    export_file = gzip.open(export_path, "at") if export_path else None
+    count = 0
+    last_id = 0
+    try:
+        while True:
+            ids = list(
+                queryset.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            if export_file is not None:
+                export_flowruns(ids, export_file)
+                export_file.flush()
+            with transaction.atomic():
+                # Runs restarted in the meantime are no longer done, events
+                # are deleted by cascade
+                _total, deleted = FlowRun.objects.filter(
+                    id__in=ids, status=FlowRun.Status.DONE
+                ).delete()
+            count += deleted.get(FlowRun._meta.label, 0)
+            logger.debug("Purged %d flow runs up to id %d", count, last_id)
+    finally:
+        if export_file is not None:
+            export_file.close()
+    return count
+
+
+def export_flowruns(ids: list[int], file: IO[str]):
+    """
+    Write flow runs and their events as JSON lines.
+    """
+    events = defaultdict(list)
+    for event in (
+        FlowRunEvent.objects.filter(run_id__in=ids)
+        .order_by("id")
+        .values("run_id", *EVENT_EXPORT_FIELDS)
+    ):
+        events[event.pop("run_id")].append(event)
+    for row in FlowRun.objects.filter(id__in=ids).order_by("id").values(*EXPORT_FIELDS):
+        row["events"] = events.get(row["id"], [])
+        file.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
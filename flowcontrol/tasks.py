@@ -1,8 +1,63 @@
+from django.utils import timezone
+
 from celery import shared_task
 
+from . import conf
+
 
 @shared_task
 def continue_flowruns_task():
-    from .engine import continue_flowruns
+    """
+    Claim runnable flow runs in chunks and enqueue an
+    `execute_flowruns_task` for each chunk.
+
+    Claimed runs are marked as running, so the next dispatcher run does not
+    enqueue them again. Claims that are not picked up within
+    `FLOWCONTROL_TASK_LEASE_SECONDS` are returned to the queue by
+    `recover_flowruns`.
+    """
+    from .engine import claim_flowruns, recover_flowruns
+
+    recover_flowruns()
+    chunk_size = conf.get_task_chunk_size()
+    queue = conf.get_task_queue()
+    lease_duration = conf.get_task_lease_duration()
+    now = timezone.now()
+    count = 0
+    while True:
+        # Claimed runs are no longer runnable, the next claim continues
+        # with the next runs by priority
+        runs = claim_flowruns(chunk_size, now=now, lease_duration=lease_duration)
+        if not runs:
+            break
+        claims = [(run.id, run.status) for run in runs]
+        execute_flowruns_task.apply_async(
+            args=(runs[0].lease_owner, claims), queue=queue
+        )
+        count += len(runs)
+    return count
+
+
+@shared_task
+def execute_flowruns_task(lease_owner, claims):
+    """
+    Execute a chunk of flow runs claimed by `continue_flowruns_task`.
+    """
+    from .engine import execute_flowruns, take_over_flowruns
+    from .metrics import registry
+
+    runs = take_over_flowruns(lease_owner, claims)
+    execute_flowruns(runs)
+    registry.flush()
+    return len(runs)
+
+
+@shared_task
+def archive_flowruns_task():
+    """
+    Move finished flow runs to the archive table, schedule it periodically
+    when `FLOWCONTROL_ARCHIVE` is "sweep".
+    """
+    from .archive import archive_flowruns
 
-    continue_flowruns()
+    return archive_flowruns()
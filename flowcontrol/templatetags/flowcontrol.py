@@ -1,6 +1,8 @@
 from django import template
 from django.contrib.contenttypes.models import ContentType
 
+from .. import conf
+from ..archive import get_archived_flowruns_for_object, merge_flowruns
 from ..models import FlowRun
 
 register = template.Library()
@@ -12,3 +14,18 @@ def get_flowruns(obj):
     return FlowRun.objects.filter(content_type=ct, object_id=obj.pk).select_related(
         "flow", "trigger", "action", "waiting_trigger"
     )
+
+
+@register.filter
+def get_all_flowruns(obj):
+    """
+    Returns live and archived flow runs of the object as a list, newest
+    first. Without `FLOWCONTROL_ARCHIVE` only live runs are returned.
+    """
+    runs = get_flowruns(obj)
+    if conf.get_archive_mode() is None:
+        return list(runs)
+    archived_runs = get_archived_flowruns_for_object(obj).select_related(
+        "flow", "trigger", "action"
+    )
+    return merge_flowruns(runs, archived_runs)
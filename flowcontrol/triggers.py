@@ -0,0 +1,164 @@
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from asgiref.sync import sync_to_async
+
+from . import conf
+from .models import Flow, Trigger
+
+
+class CachedTriggers(NamedTuple):
+    version: int
+    triggers: tuple[Trigger, ...]
+    expires_at: Optional[datetime]
+    loaded_at: float
+
+
+def get_activation_time(trigger: Trigger) -> Optional[datetime]:
+    """
+    Returns the time from which the trigger and its flow are both active.
+    """
+    if trigger.active_at is None:
+        return None
+    if trigger.flow_id is None:
+        return trigger.active_at
+    if trigger.flow.active_at is None:
+        return None
+    return max(trigger.active_at, trigger.flow.active_at)
+
+
+class TriggerCache:
+    """
+    Per-process cache of active triggers with their flows by trigger name.
+
+    Entries are dropped when a trigger or flow is saved or deleted, at the
+    next activation time of a trigger with the same name and after
+    `FLOWCONTROL_TRIGGER_CACHE_TIMEOUT` seconds to pick up changes made in
+    other processes.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, CachedTriggers] = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_active(self, trigger_name: str) -> tuple[Trigger, ...]:
+        timeout = conf.get_trigger_cache_timeout()
+        if timeout <= 0:
+            return self._load(trigger_name)[0]
+
+        triggers = self._get_cached(trigger_name, timeout)
+        if triggers is not None:
+            return triggers
+
+        self.misses += 1
+        version = self.version
+        triggers, expires_at = self._load(trigger_name)
+        with self._lock:
+            self._entries[trigger_name] = CachedTriggers(
+                version=version,
+                triggers=triggers,
+                expires_at=expires_at,
+                loaded_at=time.monotonic(),
+            )
+        return triggers
+
+    async def aget_active(self, trigger_name: str) -> tuple[Trigger, ...]:
+        timeout = conf.get_trigger_cache_timeout()
+        if timeout > 0:
+            triggers = self._get_cached(trigger_name, timeout)
+            if triggers is not None:
+                return triggers
+        return await sync_to_async(self.get_active)(trigger_name)
+
+    def _get_cached(
+        self, trigger_name: str, timeout: float
+    ) -> Optional[tuple[Trigger, ...]]:
+        entry = self._entries.get(trigger_name)
+        if entry is not None and self._is_valid(entry, timeout):
+            self.hits += 1
+            return entry.triggers
+        return None
+
+    def _is_valid(self, entry: CachedTriggers, timeout: float) -> bool:
+        if entry.version != self.version:
+            return False
+        if time.monotonic() - entry.loaded_at > timeout:
+            return False
+        if entry.expires_at is not None and entry.expires_at <= timezone.now():
+            return False
+        return True
+
+    def _load(
+        self, trigger_name: str
+    ) -> tuple[tuple[Trigger, ...], Optional[datetime]]:
+        now = timezone.now()
+        active = []
+        expires_at = None
+        for trigger in Trigger.objects.filter(trigger=trigger_name).select_related(
+            "flow"
+        ):
+            activation_time = get_activation_time(trigger)
+            if activation_time is None:
+                continue
+            if activation_time <= now:
+                active.append(trigger)
+            elif expires_at is None or activation_time < expires_at:
+                expires_at = activation_time
+        active.sort(key=lambda trigger: trigger.id)
+        return tuple(active), expires_at
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+trigger_cache = TriggerCache()
+
+
+def get_active_triggers(trigger_name: str) -> tuple[Trigger, ...]:
+    """
+    Returns the active triggers with their flows for the given trigger name.
+
+    Results are cached, so looking up a trigger name without active
+    triggers usually does not query the database.
+
+    Args:
+        trigger_name (str): The trigger name to look up.
+
+    Returns:
+        A tuple of active Trigger instances with their flows.
+    """
+    return trigger_cache.get_active(trigger_name)
+
+
+async def aget_active_triggers(trigger_name: str) -> tuple[Trigger, ...]:
+    """
+    Async version of `get_active_triggers`.
+    """
+    return await trigger_cache.aget_active(trigger_name)
+
+
+def invalidate_trigger_cache():
+    """
+    Drop all cached triggers, e.g. after updating triggers or flows with
+    `QuerySet.update()`, which does not send signals.
+    """
+    trigger_cache.invalidate()
+
+
+@receiver(post_save, sender=Trigger)
+@receiver(post_delete, sender=Trigger)
+@receiver(post_save, sender=Flow)
+@receiver(post_delete, sender=Flow)
+def trigger_or_flow_changed(sender, **kwargs):
+    invalidate_trigger_cache()
@@ -1,8 +1,12 @@
+import threading
+from collections import OrderedDict
 from datetime import timedelta
-from typing import Any, NamedTuple
+from typing import Any, Callable, Hashable, NamedTuple
 
 from django.contrib import admin
 from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.template import Context
 from django.template.base import Parser
 from django.template.defaulttags import TemplateIfParser
@@ -20,14 +24,140 @@ def evaluate_expression(expression: str, context: dict) -> Any:
     return template_literal.eval(Context(context))
 
 
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class ExpressionCache:
+    """
+    Thread-safe LRU cache of compiled condition expressions.
+
+    The maximum size is read from the `FLOWCONTROL_EXPRESSION_CACHE_SIZE`
+    setting unless given explicitly. A size of 0 disables caching.
+    """
+
+    def __init__(self, maxsize: int | None = None):
+        self._maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self) -> int:
+        if self._maxsize is None:
+            return conf.get_expression_cache_size()
+        return self._maxsize
+
+    def get_or_compile(self, key: Hashable, compile_func: Callable[[], Any]) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+        # Compile outside of the lock, errors are not cached
+        value = compile_func()
+        maxsize = self.maxsize
+        if maxsize <= 0:
+            return value
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                maxsize=self.maxsize,
+                currsize=len(self._data),
+            )
+
+
+expression_cache = ExpressionCache()
+
+
 def make_expression(expression: str) -> Any:
+    key = (expression, tuple(conf.get_flowcontrol_filters()))
+    return expression_cache.get_or_compile(key, lambda: compile_expression(expression))
+
+
+def compile_expression(expression: str) -> Any:
     engine = get_engine()
     parser = Parser("", engine.template_libraries, engine.template_builtins)
     return TemplateIfParser(parser, list(smart_split(expression))).parse()
 
 
-def get_engine():
-    return Engine(builtins=conf.get_flowcontrol_filters())
+def clear_expression_cache():
+    """
+    Drop all compiled expressions, e.g. after template filters have changed.
+    """
+    expression_cache.clear()
+
+
+@receiver(setting_changed)
+def filter_setting_changed(*, setting, **kwargs):
+    if setting in conf.FILTER_SETTINGS:
+        reset_engine()
+        clear_expression_cache()
+
+
+_engine: Engine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """
+    Returns the template engine used for conditions, expressions and
+    templated alerts.
+
+    The engine is created once per process and rebuilt when the filter
+    settings change. Custom actions can use it to render templates with the
+    same filters that are available in conditions.
+
+    Returns:
+        The shared template engine.
+    """
+    global _engine
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = Engine(builtins=conf.get_flowcontrol_filters())
+            engine = _engine
+    return engine
+
+
+def reset_engine():
+    """
+    Drop the shared template engine so that it is rebuilt on next use.
+    """
+    global _engine
+    with _engine_lock:
+        _engine = None
 
 
 def validate_template_condition(condition: str) -> None:
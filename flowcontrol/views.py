@@ -0,0 +1,26 @@
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from . import conf
+from .metrics import registry
+
+
+def metrics_view(request):
+    """
+    Serves the flowcontrol metrics in the Prometheus text exposition format.
+
+    Requires the bearer token in `FLOWCONTROL_METRICS_TOKEN` if it is set,
+    otherwise a logged in staff user.
+    """
+    if not registry.enabled:
+        raise Http404
+    token = conf.get_metrics_token()
+    if token:
+        header = request.headers.get("Authorization", "")
+        if not constant_time_compare(header, f"Bearer {token}"):
+            return HttpResponseForbidden()
+    elif not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,121 @@
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from typing import Optional
+
+from django.core.cache import caches
+from django.db import transaction
+
+from . import conf
+
+WAKEUP_CACHE_KEY = "flowcontrol:wakeup"
+
+
+class Wakeup:
+    """
+    In-process notification for a flow run worker that sleeps until the
+    next flow run is due.
+
+    The engine calls `notify` when flow runs are created or suspended. The
+    worker is only woken if the run is due before its planned wake-up time.
+    Notifications are sent after the current transaction commits, so the
+    worker sees the new runs when it wakes up.
+
+    With `FLOWCONTROL_WORKER_WAKEUP_CACHE` set, processes without a worker,
+    e.g. web servers, bump a counter in that cache instead. A sleeping
+    worker checks the counter every `poll_interval` seconds and wakes up
+    to look for due runs when it changed.
+    """
+
+    poll_interval = 1.0
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._generation = None
+        self.listening = False
+        self.wake_at: Optional[datetime] = None
+
+    @property
+    def cache(self):
+        alias = conf.get_worker_wakeup_cache()
+        return caches[alias] if alias else None
+
+    def notify(self, when: Optional[datetime] = None):
+        """
+        Notify the worker that a flow run is due at the given time or now.
+        """
+        if self.listening:
+            transaction.on_commit(partial(self._notify, when))
+        elif self.cache is not None:
+            transaction.on_commit(self._publish)
+
+    def _notify(self, when: Optional[datetime]):
+        with self._lock:
+            if when is None or self.wake_at is None or when < self.wake_at:
+                self._event.set()
+
+    def _publish(self):
+        cache = self.cache
+        cache.add(WAKEUP_CACHE_KEY, 0, timeout=None)
+        try:
+            cache.incr(WAKEUP_CACHE_KEY)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(WAKEUP_CACHE_KEY, 1, timeout=None)
+
+    def _get_generation(self):
+        cache = self.cache
+        return cache.get(WAKEUP_CACHE_KEY) if cache is not None else None
+
+    def wake(self):
+        """
+        Wake the worker unconditionally, e.g. to stop it.
+        """
+        self._event.set()
+
+    def prepare(self):
+        """
+        Reset the notification before the worker looks for due runs.
+        Notifications arriving after this wake up the next `wait`.
+        """
+        with self._lock:
+            self.wake_at = None
+            self._event.clear()
+        self._generation = self._get_generation()
+
+    def wait(self, wake_at: Optional[datetime], timeout: float) -> bool:
+        """
+        Sleep for up to `timeout` seconds or until notified.
+
+        Returns:
+            True if the worker was notified.
+        """
+        with self._lock:
+            self.wake_at = wake_at
+        if self.cache is None:
+            return self._event.wait(timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if self._event.wait(max(min(self.poll_interval, remaining), 0)):
+                return True
+            # Other processes can't tell when the worker plans to wake up,
+            # it wakes up for every notification and looks for due runs
+            if self._get_generation() != self._generation:
+                return True
+            if remaining <= self.poll_interval:
+                return False
+
+
+wakeup = Wakeup()
+
+
+def notify_worker(when: Optional[datetime] = None):
+    """
+    Wake a flow run worker in this process if a flow run is due at `when`
+    (now if not given) before its planned wake-up time. Workers in other
+    processes are only woken with `FLOWCONTROL_WORKER_WAKEUP_CACHE`.
+    """
+    wakeup.notify(when)
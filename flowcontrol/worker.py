@@ -0,0 +1,152 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from django.db import close_old_connections, models
+from django.utils import timezone
+
+from . import conf, metrics
+from .engine import (
+    claim_flowruns,
+    execute_claimed_flowrun,
+    load_flowrun_objects,
+    recover_flowruns,
+    release_claimed_flowrun,
+)
+from .instrumentation import flush_collectors
+from .models import FlowRun
+from .wakeup import Wakeup, wakeup
+
+logger = logging.getLogger(__name__)
+
+
+class FlowRunWorker:
+    """
+    Long-running worker that executes flow runs when they are due.
+
+    Instead of polling at a fixed interval, the worker sleeps until the
+    earliest `continue_after` of waiting runs or the earliest lease expiry
+    of running runs. It is woken earlier by `flowcontrol.wakeup.notify_worker`
+    when runs are created or suspended in the same process, or in other
+    processes with `FLOWCONTROL_WORKER_WAKEUP_CACHE`. Otherwise changes made
+    by other processes are picked up after at most
+    `FLOWCONTROL_WORKER_MAX_SLEEP` seconds.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        max_sleep: Optional[float] = None,
+        wakeup: Wakeup = wakeup,
+    ):
+        self.batch_size = batch_size or conf.get_claim_batch_size()
+        self.max_sleep = conf.get_worker_max_sleep() if max_sleep is None else max_sleep
+        self.wakeup = wakeup
+        self.stopping = False
+        self.executed = 0
+
+    def stop(self):
+        """
+        Stop the worker after the flow run it is currently executing.
+        """
+        self.stopping = True
+        self.wakeup.wake()
+
+    def run(self):
+        self.wakeup.listening = True
+        try:
+            while not self.stopping:
+                self.wakeup.prepare()
+                close_old_connections()
+                self.run_once()
+                if self.stopping:
+                    break
+                flush_collectors()
+                metrics.registry.flush()
+                self.sleep()
+        finally:
+            self.wakeup.listening = False
+            flush_collectors()
+            metrics.registry.flush()
+
+    def run_once(self) -> int:
+        """
+        Execute all flow runs that are due now.
+
+        Returns:
+            The number of executed flow runs.
+        """
+        recover_flowruns()
+        now = timezone.now()
+        count = 0
+        while not self.stopping:
+            runs = claim_flowruns(self.batch_size, now=now)
+            if not runs:
+                break
+            loaded = load_flowrun_objects(runs)
+            # Runs discarded for missing objects count as executed
+            count += len(runs) - len(loaded)
+            for run in loaded:
+                if self.stopping:
+                    release_claimed_flowrun(run)
+                    continue
+                try:
+                    execute_claimed_flowrun(run)
+                except Exception:
+                    logger.exception("Error executing flow run %s", run.id)
+                count += 1
+        self.executed += count
+        return count
+
+    def get_next_wake(self) -> Optional[datetime]:
+        """
+        Returns the time the next flow run is due or a lease expires.
+
+        Runs leased by another worker are left out until their lease
+        expires, so the worker does not wake up for runs it can't claim.
+        """
+        now = timezone.now()
+        unleased = FlowRun.objects.filter(
+            models.Q(lease_expires_at__isnull=True)
+            | models.Q(lease_expires_at__lte=now)
+        )
+        if unleased.filter(
+            status=FlowRun.Status.PENDING, continue_after__isnull=True
+        ).exists():
+            return now
+        times = [
+            unleased.filter(status=FlowRun.Status.WAITING).aggregate(
+                next_time=models.Min("continue_after")
+            )["next_time"],
+            FlowRun.objects.filter(
+                status__in=[
+                    FlowRun.Status.PENDING,
+                    FlowRun.Status.WAITING,
+                    FlowRun.Status.RUNNING,
+                ]
+            ).aggregate(next_time=models.Min("lease_expires_at"))["next_time"],
+        ]
+        times = [time for time in times if time is not None]
+        if not times:
+            return None
+        return min(times)
+
+    def get_sleep_time(self, wake_at: Optional[datetime]) -> float:
+        if wake_at is None:
+            return self.max_sleep
+        seconds = (wake_at - timezone.now()).total_seconds()
+        return min(max(seconds, 0), self.max_sleep)
+
+    def sleep(self) -> bool:
+        """
+        Sleep until the next flow run is due or the worker is notified.
+
+        Returns:
+            True if the worker was notified.
+        """
+        wake_at = self.get_next_wake()
+        timeout = self.get_sleep_time(wake_at)
+        if timeout <= 0:
+            return False
+        logger.debug("Sleeping for %.1f seconds", timeout)
+        return self.wakeup.wait(wake_at, timeout)
@@ -7,10 +7,22 @@ import pytest
 
 from flowcontrol.actions import SetStateAction
 from flowcontrol.models import Flow, FlowRun, Trigger
+from flowcontrol.plan import invalidate_flow_plan
 from flowcontrol.registry import action_registry
+from flowcontrol.triggers import invalidate_trigger_cache
 from flowcontrol.utils import ActionNode, make_action_tree
 
 
+@pytest.fixture(autouse=True)
+def clear_flowcontrol_caches():
+    """
+    Per-process caches outlive the database rollback between tests.
+    """
+    invalidate_flow_plan()
+    invalidate_trigger_cache()
+    yield
+
+
 @pytest.fixture
 def flow(db):
     ct = ContentType.objects.get_by_natural_key("auth", "user")
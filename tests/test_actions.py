@@ -18,6 +18,7 @@ from flowcontrol.actions import (
     WhileLoopAction,
 )
 from flowcontrol.base import BaseAction, FlowDirective
+from flowcontrol.engine import get_action_context
 from flowcontrol.models import Flow, FlowRun
 from flowcontrol.models.config import (
     Condition,
@@ -435,3 +436,18 @@ def test_send_alert_templated(run, mailoutbox):
     assert mail.subject == "Alert"
     assert mail.to == ["info@example.com"]
     assert mail.body == "foobar"
+
+
+def test_send_alert_templated_assignment(run, mailoutbox):
+    message = EmailAlert(
+        subject="Alert",
+        body='{% now "Y" as year %}{% firstof missing test as value %}{{ value }} {{ year }}',
+        templated=True,
+        recipient="info@example.com",
+    )
+    action = SendAlertAction()
+    run.state = {"test": "foobar"}
+    action._set_context(get_action_context(run, None))
+    action.run(obj=None, run=run, config=message)
+    assert mailoutbox[0].body == f"foobar {timezone.now().year}"
+    assert run.state == {"test": "foobar"}
@@ -389,6 +389,8 @@ def test_deactivate_flows(admin_user, client, flow):
 def test_duplicate_flow(admin_user, client, flow_with_all_actions):
     client.force_login(admin_user)
     flow = flow_with_all_actions
+    flow.retention_days = 7
+    flow.save()
 
     resp = client.post(
         reverse("admin:flowcontrol_flow_changelist"),
@@ -404,6 +406,7 @@ def test_duplicate_flow(admin_user, client, flow_with_all_actions):
     assert new_flow.description == flow.description
     assert new_flow.content_type == flow.content_type
     assert new_flow.condition == flow.condition
+    assert new_flow.retention_days == 7
     assert new_flow.actions.count() == flow.actions.count()
     assert new_flow.actions.first().action == flow.actions.first().action
 
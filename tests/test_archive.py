@@ -0,0 +1,133 @@
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+import pytest
+
+from flowcontrol.archive import archive_flowrun, archive_flowruns
+from flowcontrol.engine import (
+    cancel_flowruns_for_object,
+    complete_flowrun,
+    create_flowrun,
+    create_flowruns_bulk,
+    error_flowrun,
+    execute_flowrun,
+    get_flowruns_for_object,
+)
+from flowcontrol.models import FlowRun, FlowRunArchive, FlowRunEvent
+from flowcontrol.templatetags.flowcontrol import get_all_flowruns, get_flowruns
+
+from .test_commands import run_command
+
+
+@pytest.mark.django_db
+def test_archive_flowrun(flow, user):
+    run = create_flowrun(flow, user, state={"foo": "bar"})
+    assert archive_flowrun(run) is False
+
+    error_flowrun(run, "Broken")
+    assert archive_flowrun(run) is True
+
+    assert not FlowRun.objects.filter(id=run.id).exists()
+    assert not FlowRunEvent.objects.filter(run_id=run.id).exists()
+    archived = FlowRunArchive.objects.get(id=run.id)
+    assert archived.flow == flow
+    assert archived.content_object == user
+    assert archived.outcome == FlowRun.Outcome.ERRORED
+    assert archived.state == {"foo": "bar"}
+    assert archived.created_at == run.created_at
+    assert archived.log == "Broken"
+    assert archived.events[0]["level"] == FlowRunEvent.Level.ERROR
+
+
+@pytest.mark.django_db
+def test_archive_flowruns_in_chunks(other_flow):
+    done = []
+    for _ in range(5):
+        run = create_flowrun(other_flow)
+        complete_flowrun(run)
+        done.append(run.id)
+    pending = create_flowrun(other_flow)
+
+    assert archive_flowruns(chunk_size=2) == 5
+
+    assert list(FlowRun.objects.all()) == [pending]
+    assert sorted(FlowRunArchive.objects.values_list("id", flat=True)) == done
+
+
+@pytest.mark.django_db
+def test_archive_immediately(flow, flow_action, user, settings):
+    settings.FLOWCONTROL_ARCHIVE = "immediate"
+    run = create_flowrun(flow, user)
+    execute_flowrun(run)
+
+    assert not FlowRun.objects.filter(id=run.id).exists()
+    assert FlowRunArchive.objects.get(id=run.id).state == {"foo": "bar"}
+
+    other_run = create_flowrun(flow, user)
+    cancel_flowruns_for_object(user)
+    assert not FlowRun.objects.exists()
+    assert (
+        FlowRunArchive.objects.get(id=other_run.id).outcome == FlowRun.Outcome.CANCELED
+    )
+
+
+@pytest.mark.django_db
+def test_archive_sweep_keeps_finished_runs(flow, flow_action, user, settings):
+    settings.FLOWCONTROL_ARCHIVE = "sweep"
+    run = create_flowrun(flow, user)
+    execute_flowrun(run)
+    assert FlowRun.objects.get(id=run.id).status == FlowRun.Status.DONE
+
+    run_command("archive")
+    assert FlowRunArchive.objects.filter(id=run.id).exists()
+
+
+@pytest.mark.django_db
+def test_flowruns_for_object_include_archived(flow, user, settings):
+    settings.FLOWCONTROL_ARCHIVE = "sweep"
+    archived_run = create_flowrun(flow, user)
+    complete_flowrun(archived_run)
+    archive_flowrun(archived_run)
+    run = create_flowrun(flow, user)
+
+    assert list(get_flowruns_for_object(user)) == [run]
+    runs = get_flowruns_for_object(user, include_archived=True)
+    assert [(type(r), r.id) for r in runs] == [
+        (FlowRun, run.id),
+        (FlowRunArchive, archived_run.id),
+    ]
+    assert [r.id for r in get_all_flowruns(user)] == [run.id, archived_run.id]
+    assert list(get_flowruns(user)) == [run]
+
+
+@pytest.mark.django_db
+def test_archived_runs_count_for_max_per_object(flow, user):
+    flow.max_per_object = 1
+    flow.save()
+    run = create_flowrun(flow, user)
+    complete_flowrun(run)
+    archive_flowrun(run)
+
+    assert create_flowrun(flow, user) is None
+    other_user = User.objects.create(username="other")
+    assert create_flowruns_bulk(flow, [user, other_user])[0] is None
+    assert not FlowRun.objects.filter(object_id=user.pk).exists()
+    assert FlowRun.objects.filter(object_id=other_user.pk).exists()
+
+
+@pytest.mark.django_db
+def test_archive_admin(admin_user, client, flow, user):
+    run = create_flowrun(flow, user)
+    complete_flowrun(run)
+    archive_flowrun(run)
+    client.force_login(admin_user)
+
+    resp = client.get(reverse("admin:flowcontrol_flowrun_change", args=(run.id,)))
+    archive_url = reverse("admin:flowcontrol_flowrunarchive_change", args=(run.id,))
+    assert resp.status_code == 302
+    assert resp.url == archive_url
+
+    resp = client.get(archive_url)
+    assert resp.status_code == 200
+    resp = client.get(reverse("admin:flowcontrol_flowrunarchive_changelist"))
+    assert resp.status_code == 200
@@ -0,0 +1,185 @@
+import asyncio
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from flowcontrol.actions import (
+    SetStateAction,
+    UpdateStateAction,
+    WaitForTriggerAction,
+)
+from flowcontrol.base import BaseAction, FlowDirective
+from flowcontrol.engine import (
+    acontinue_flowruns,
+    acreate_flowrun,
+    aexecute_flowrun,
+    atrigger_flows,
+    create_flowrun,
+)
+from flowcontrol.models import FlowRun
+from flowcontrol.registry import register_action
+from flowcontrol.utils import ActionNode, make_action_tree
+
+
+@pytest.mark.django_db
+def test_acreate_flowrun(flow, user):
+    run = async_to_sync(acreate_flowrun)(flow, user, state={"foo": "bar"})
+    assert run.status == FlowRun.Status.PENDING
+    assert run.content_object == user
+    assert run.state == {"foo": "bar"}
+
+
+@pytest.mark.django_db
+def test_acreate_flowrun_respects_limits(flow, user):
+    flow.max_per_object = 1
+    flow.save()
+    assert async_to_sync(acreate_flowrun)(flow, user) is not None
+    assert async_to_sync(acreate_flowrun)(flow, user) is None
+    assert FlowRun.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_acreate_flowrun_wrong_content_type(flow, other_flow):
+    ct = ContentType.objects.get_for_model(other_flow)
+    assert async_to_sync(acreate_flowrun)(flow, ct) is None
+
+
+@pytest.mark.django_db
+def test_aexecute_flowrun_with_sync_actions(flow, user):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(SetStateAction, {"state": {"foo": "bar"}}),
+            ActionNode(UpdateStateAction, {"state": {"baz": 1}}),
+        ],
+    )
+    run = create_flowrun(flow, user)
+    async_to_sync(aexecute_flowrun)(run)
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.DONE
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state == {"foo": "bar", "baz": 1}
+    assert run.lease_owner == ""
+
+
+@pytest.mark.django_db
+def test_aexecute_flowrun_step_budget(flow, user):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(SetStateAction, {"state": {"foo": "bar"}}),
+            ActionNode(UpdateStateAction, {"state": {"baz": 1}}),
+        ],
+    )
+    run = create_flowrun(flow, user)
+    async_to_sync(aexecute_flowrun)(run, step_budget=1)
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.WAITING
+    assert run.state == {"foo": "bar"}
+    async_to_sync(aexecute_flowrun)(run, step_budget=1)
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state == {"foo": "bar", "baz": 1}
+
+
+@pytest.mark.django_db
+def test_aexecute_flowrun_with_async_action(flow, temp_registry):
+    @register_action
+    class AsyncAction(BaseAction):
+        async def arun(self, *, run, obj, config):
+            await asyncio.sleep(0)
+            run.state["awaited"] = True
+            return FlowDirective.CONTINUE
+
+    make_action_tree(flow, [ActionNode(AsyncAction)])
+    run = create_flowrun(flow)
+    async_to_sync(aexecute_flowrun)(run)
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state == {"awaited": True}
+
+
+@pytest.mark.django_db
+def test_aexecute_flowrun_action_error(flow, temp_registry):
+    @register_action
+    class FailingAction(BaseAction):
+        async def arun(self, *, run, obj, config):
+            raise ValueError("failed")
+
+    make_action_tree(flow, [ActionNode(FailingAction)])
+    run = create_flowrun(flow)
+    async_to_sync(aexecute_flowrun)(run)
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.ERRORED
+    assert "failed" in run.log
+
+
+@pytest.mark.django_db
+def test_atrigger_flows(trigger, user):
+    make_action_tree(
+        trigger.flow, [ActionNode(SetStateAction, {"state": {"foo": "bar"}})]
+    )
+    runs = async_to_sync(atrigger_flows)("trigger_name", user, immediate=True)
+    assert len(runs) == 1
+    runs[0].refresh_from_db()
+    assert runs[0].outcome == FlowRun.Outcome.COMPLETE
+    assert runs[0].state == {"foo": "bar"}
+
+
+@pytest.mark.django_db
+def test_atrigger_flows_condition(trigger, user):
+    trigger.condition = "obj.username == 'other'"
+    trigger.save()
+    assert async_to_sync(atrigger_flows)("trigger_name", user) == []
+
+
+@pytest.mark.django_db
+def test_atrigger_flows_resumes_waiting_run(flow, user, wait_trigger):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(WaitForTriggerAction, {"trigger": wait_trigger}),
+            ActionNode(SetStateAction, {"state": {"foo": "bar"}}),
+        ],
+    )
+    run = create_flowrun(flow, user)
+    async_to_sync(aexecute_flowrun)(run)
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.WAITING
+
+    runs = async_to_sync(atrigger_flows)("wait_trigger_name", user)
+    assert runs == [run]
+    run.refresh_from_db()
+    assert run.waiting_trigger is None
+    assert run.continue_after is not None
+
+    assert async_to_sync(acontinue_flowruns)() == 1
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state == {"foo": "bar"}
+
+
+@pytest.mark.django_db
+def test_acontinue_flowruns(flow, user):
+    make_action_tree(flow, [ActionNode(SetStateAction, {"state": {"foo": "bar"}})])
+    runs = [create_flowrun(flow) for _ in range(5)]
+    assert async_to_sync(acontinue_flowruns)(batch_size=2) == 5
+    for run in runs:
+        run.refresh_from_db()
+        assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert async_to_sync(acontinue_flowruns)() == 0
+
+
+@pytest.mark.django_db
+def test_acontinue_flowruns_finishes_invalid_runs(flow):
+    run = create_flowrun(flow)
+    # Waiting run without action is invalid
+    FlowRun.objects.filter(id=run.id).update(
+        status=FlowRun.Status.WAITING, continue_after=timezone.now()
+    )
+    assert async_to_sync(acontinue_flowruns)() == 1
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.ERRORED
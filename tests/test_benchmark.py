@@ -0,0 +1,121 @@
+import json
+import os
+
+import pytest
+
+from flowcontrol import metrics
+from flowcontrol.benchmark import SCENARIOS, compare_results, run_benchmarks
+from flowcontrol.models import Flow, FlowRun
+
+from .test_commands import run_command
+
+
+@pytest.mark.django_db
+def test_run_benchmarks_rolls_back():
+    results = run_benchmarks(scale=0.01)
+    assert set(results["scenarios"]) == set(SCENARIOS)
+    for result in results["scenarios"].values():
+        assert result["runs"] > 0
+        assert result["steps"] >= result["runs"]
+        assert result["steps_per_second"] > 0
+        assert result["queries_per_step"] > 0
+        assert result["peak_memory_kb"] > 0
+    assert results["scenarios"]["for_loop"]["steps"] == 2 * (1 + 2 * 10)
+    assert results["scenarios"]["many_runs"]["runs"] == 10
+    # Every object's second trigger is rejected by the limit
+    assert results["scenarios"]["trigger_flows"]["runs"] == 2
+    assert not Flow.objects.exists()
+    assert not FlowRun.objects.exists()
+
+
+@pytest.mark.django_db
+def test_run_benchmarks_leaves_metrics_alone(settings):
+    settings.FLOWCONTROL_METRICS = True
+    metrics.registry.clear()
+    results = run_benchmarks(["deep_nesting"], scale=0.1, memory=False)
+    assert results["scenarios"]["deep_nesting"]["steps"] > 0
+    metrics.registry.flush()
+    assert metrics.actions_executed.get("UpdateStateAction") == 0
+    assert metrics.registry.enabled
+
+
+@pytest.mark.django_db
+def test_run_benchmarks_without_memory():
+    results = run_benchmarks(["while_loop"], scale=0.01, memory=False)
+    assert list(results["scenarios"]) == ["while_loop"]
+    assert results["scenarios"]["while_loop"]["peak_memory_kb"] is None
+
+
+def test_compare_results():
+    baseline = {
+        "scenarios": {
+            "for_loop": {
+                "steps_per_second": 1000.0,
+                "queries_per_step": 0.1,
+                "peak_memory_kb": None,
+            }
+        }
+    }
+    results = {
+        "scenarios": {
+            "for_loop": {
+                "steps_per_second": 850.0,
+                "queries_per_step": 0.2,
+                "peak_memory_kb": 100.0,
+            },
+            "many_runs": {"steps_per_second": 1.0},
+        }
+    }
+    regressions = compare_results(results, baseline, tolerance=0.2)
+    assert [(r.scenario, r.metric) for r in regressions] == [
+        ("for_loop", "queries_per_step")
+    ]
+    regressions = compare_results(results, baseline, tolerance=0.1)
+    assert {r.metric for r in regressions} == {"steps_per_second", "queries_per_step"}
+
+
+@pytest.mark.django_db
+def test_benchmark_command(tmp_path):
+    output_path = tmp_path / "baseline.json"
+    output = run_command(
+        "benchmark",
+        "--scenario",
+        "for_loop",
+        "--scale",
+        "0.01",
+        "--no-memory",
+        "--output",
+        str(output_path),
+    )
+    assert "for_loop" in output
+    baseline = json.loads(output_path.read_text())
+    assert list(baseline["scenarios"]) == ["for_loop"]
+
+    # No real run reaches this throughput, ignore the other metrics so timing
+    # noise does not add regressions
+    baseline["scenarios"]["for_loop"] = {"steps_per_second": 1e12}
+    output_path.write_text(json.dumps(baseline))
+    with pytest.raises(Exception, match="1 benchmark regressions found"):
+        run_command(
+            "benchmark",
+            "--scenario",
+            "for_loop",
+            "--scale",
+            "0.01",
+            "--baseline",
+            str(output_path),
+        )
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_benchmark_baseline():
+    results = run_benchmarks()
+    baseline_path = os.environ.get("FLOWCONTROL_BENCHMARK_BASELINE")
+    if not baseline_path:
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    tolerance = float(os.environ.get("FLOWCONTROL_BENCHMARK_TOLERANCE", "0.2"))
+    regressions = compare_results(results, baseline, tolerance)
+    assert not regressions, "\n".join(str(regression) for regression in regressions)
@@ -0,0 +1,62 @@
+from io import StringIO
+
+from django.core.management import call_command
+
+import pytest
+
+from flowcontrol.engine import create_flowrun
+from flowcontrol.models import FlowRun
+
+
+def run_command(*args):
+    out = StringIO()
+    call_command("flowcontrol", *args, stdout=out)
+    return out.getvalue()
+
+
+@pytest.mark.django_db
+def test_run_command(flow, flow_action):
+    for _ in range(5):
+        create_flowrun(flow)
+    output = run_command("run", "--batch-size", "2")
+    assert "Batch 3: 1 runs" in output
+    assert "Finished executing 5 runnable flow runs." in output
+    assert not FlowRun.objects.exclude(outcome=FlowRun.Outcome.COMPLETE).exists()
+
+
+@pytest.mark.django_db
+def test_run_command_counts_archived_runs(flow, flow_action, settings):
+    settings.FLOWCONTROL_ARCHIVE = "immediate"
+    for _ in range(3):
+        create_flowrun(flow)
+    output = run_command("run")
+    assert not FlowRun.objects.exists()
+    assert "Status counts: [('done', 3)]" in output
+    assert "Outcome counts: [('complete', 3)]" in output
+
+
+@pytest.mark.django_db
+def test_run_command_limit(flow, flow_action):
+    for _ in range(5):
+        create_flowrun(flow)
+    output = run_command("run", "--batch-size", "2", "--limit", "3")
+    assert "Finished executing 3 runnable flow runs." in output
+    assert FlowRun.objects.filter(status=FlowRun.Status.PENDING).count() == 2
+
+
+@pytest.mark.django_db
+def test_run_command_flow_filter(flow, other_flow, flow_action):
+    create_flowrun(flow)
+    other_run = create_flowrun(other_flow)
+    output = run_command("run", "--flow", str(flow.id))
+    assert "Finished executing 1 runnable flow runs." in output
+    other_run.refresh_from_db()
+    assert other_run.status == FlowRun.Status.PENDING
+
+
+@pytest.mark.django_db
+def test_run_command_max_seconds(flow, flow_action):
+    create_flowrun(flow)
+    output = run_command("run", "--max-seconds", "0")
+    assert "Time limit reached." in output
+    assert FlowRun.objects.filter(status=FlowRun.Status.PENDING).count() == 1
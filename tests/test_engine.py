@@ -1,20 +1,42 @@
-from django.contrib.auth.models import Group
+import importlib
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.auth.models import Group, User
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
 import pytest
 
+from flowcontrol.actions import (
+    ForLoopAction,
+    SetStateAction,
+    UpdateStateAction,
+    WaitForTriggerAction,
+)
+from flowcontrol.base import BaseAction
 from flowcontrol.engine import (
     abort_flowrun,
     cancel_flowrun,
     cancel_flowruns_for_object,
+    check_condition,
+    claim_flowruns,
     continue_flowruns,
     create_flowrun,
     discard_flowrun,
     error_flowrun,
+    execute_claimed_flowrun,
+    execute_flowrun,
+    load_flowrun_objects,
+    recover_flowruns,
     reset_flowrun,
     start_flowrun,
+    take_over_flowruns,
+    trigger_flows,
 )
 from flowcontrol.models import FlowRun
+from flowcontrol.registry import register_action
+from flowcontrol.utils import ActionNode, make_action_tree
 
 
 @pytest.mark.django_db
@@ -129,3 +151,493 @@ def test_reset_flowrun_with_action(flowrun, flow_action):
     assert flowrun.repeat_action
     assert flowrun.done_at is None
     assert flowrun.state == {"foo": "bar"}
+
+
+@pytest.mark.django_db
+def test_claim_flowruns(flow):
+    runs = [create_flowrun(flow) for _ in range(3)]
+    claimed = claim_flowruns(2)
+    assert [run.id for run in claimed] == [runs[0].id, runs[1].id]
+    # Claimed instances keep their status until they are executed
+    assert all(run.status == FlowRun.Status.PENDING for run in claimed)
+    assert FlowRun.objects.filter(status=FlowRun.Status.RUNNING).count() == 2
+
+    assert [run.id for run in claim_flowruns(10)] == [runs[2].id]
+    assert claim_flowruns(10) == []
+
+
+@pytest.mark.django_db
+def test_claim_flowruns_after_id(flow):
+    runs = [create_flowrun(flow) for _ in range(3)]
+    claimed = claim_flowruns(10, after_id=runs[0].id)
+    assert [run.id for run in claimed] == [runs[1].id, runs[2].id]
+
+
+@pytest.mark.django_db
+def test_create_flowrun_priority(flow, other_flow):
+    other_flow.priority = 5
+    other_flow.save()
+    assert create_flowrun(other_flow).priority == 5
+    assert create_flowrun(other_flow, priority=-1).priority == -1
+    assert create_flowrun(flow).priority == 0
+
+
+@pytest.mark.django_db
+def test_claim_flowruns_by_priority(other_flow):
+    low = create_flowrun(other_flow, priority=-1)
+    normal = create_flowrun(other_flow)
+    waiting = create_flowrun(other_flow, priority=10)
+    high = create_flowrun(other_flow, priority=10)
+    late = create_flowrun(other_flow, priority=10)
+    now = timezone.now()
+    # Waiting runs are due at continue_after, pending runs when created
+    FlowRun.objects.filter(id=waiting.id).update(
+        status=FlowRun.Status.WAITING,
+        continue_after=high.created_at - timedelta(seconds=10),
+    )
+    FlowRun.objects.filter(id=late.id).update(
+        status=FlowRun.Status.WAITING, continue_after=now
+    )
+    FlowRun.objects.filter(id=high.id).update(created_at=now - timedelta(seconds=5))
+    claimed = claim_flowruns(10, now=now)
+    assert [run.id for run in claimed] == [
+        waiting.id,
+        high.id,
+        late.id,
+        normal.id,
+        low.id,
+    ]
+
+
+@pytest.mark.django_db
+def test_claim_flowruns_ages_low_priority(other_flow, settings):
+    settings.FLOWCONTROL_PRIORITY_AGING_SECONDS = 60
+    now = timezone.now()
+    old = create_flowrun(other_flow, priority=-10)
+    FlowRun.objects.filter(id=old.id).update(created_at=now - timedelta(minutes=2))
+    high = create_flowrun(other_flow, priority=10)
+    assert claim_flowruns(1, now=now) == [old]
+    assert claim_flowruns(1, now=now) == [high]
+
+    settings.FLOWCONTROL_PRIORITY_AGING_SECONDS = 0
+    old = create_flowrun(other_flow, priority=-10)
+    FlowRun.objects.filter(id=old.id).update(created_at=now - timedelta(minutes=2))
+    high = create_flowrun(other_flow, priority=10)
+    assert claim_flowruns(1, now=now) == [high]
+
+
+@pytest.mark.django_db
+def test_claim_flowruns_lease_duration(flow):
+    create_flowrun(flow)
+    (run,) = claim_flowruns(1, lease_duration=timedelta(hours=1))
+    assert run.lease_expires_at > timezone.now() + timedelta(minutes=59)
+
+
+@pytest.mark.django_db
+def test_take_over_flowruns(flow, flow_action):
+    create_flowrun(flow)
+    create_flowrun(flow)
+    claimed = claim_flowruns(2)
+    owner = claimed[0].lease_owner
+    claims = [(run.id, run.status) for run in claimed]
+    FlowRun.objects.filter(id=claimed[1].id).update(lease_owner="other-worker")
+
+    runs = take_over_flowruns(owner, claims)
+    assert [run.id for run in runs] == [claimed[0].id]
+    assert runs[0].status == FlowRun.Status.PENDING
+    # A second delivery of the same claims does not execute them again
+    FlowRun.objects.filter(id=claimed[0].id).update(lease_owner="new-worker")
+    assert take_over_flowruns(owner, claims) == []
+
+    FlowRun.objects.filter(id=claimed[0].id).update(lease_owner=runs[0].lease_owner)
+    execute_claimed_flowrun(runs[0])
+    runs[0].refresh_from_db()
+    assert runs[0].outcome == FlowRun.Outcome.COMPLETE
+
+
+@pytest.mark.django_db
+def test_execute_claimed_flowrun(flow):
+    create_flowrun(flow)
+    (run,) = claim_flowruns(1)
+    execute_claimed_flowrun(run)
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.DONE
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+
+
+@pytest.mark.django_db
+def test_execute_claimed_flowrun_releases_claim(flow, flow_action):
+    run = create_flowrun(flow, state={"foo": "bar"})
+    continue_after = timezone.now() + timedelta(minutes=5)
+    FlowRun.objects.filter(id=run.id).update(
+        status=FlowRun.Status.WAITING,
+        action=flow_action,
+        continue_after=continue_after,
+    )
+    # Claimed ahead of time, the run is not due yet when it is executed
+    (run,) = claim_flowruns(1, now=continue_after)
+    execute_claimed_flowrun(run)
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.WAITING
+    assert run.lease_owner == ""
+    assert run.state == {"foo": "bar"}
+
+
+@pytest.mark.django_db
+def test_execute_claimed_flowrun_errors_invalid_run(flow):
+    run = create_flowrun(flow)
+    FlowRun.objects.filter(id=run.id).update(
+        status=FlowRun.Status.WAITING, continue_after=timezone.now()
+    )
+    (run,) = claim_flowruns(1)
+    # Waiting run without action is invalid
+    execute_claimed_flowrun(run)
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.DONE
+    assert run.outcome == FlowRun.Outcome.ERRORED
+    assert "no action set" in run.log
+
+
+@pytest.mark.django_db(transaction=True)
+def test_continue_flowruns_finishes_invalid_runs(flow, flow_action):
+    runs = [create_flowrun(flow) for _ in range(3)]
+    FlowRun.objects.filter(id=runs[0].id).update(
+        status=FlowRun.Status.WAITING, continue_after=timezone.now()
+    )
+    # Each run is claimed once instead of the invalid one again and again
+    assert continue_flowruns(batch_size=1, workers=2, pool="thread") == 3
+    outcomes = [FlowRun.objects.get(id=run.id).outcome for run in runs]
+    assert outcomes == [
+        FlowRun.Outcome.ERRORED,
+        FlowRun.Outcome.COMPLETE,
+        FlowRun.Outcome.COMPLETE,
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_continue_flowruns_thread_pool(flow):
+    runs = [create_flowrun(flow) for _ in range(5)]
+    assert continue_flowruns(batch_size=2, workers=3, pool="thread") == 5
+    for run in runs:
+        run.refresh_from_db()
+        assert run.status == FlowRun.Status.DONE
+        assert run.outcome == FlowRun.Outcome.COMPLETE
+
+
+@pytest.mark.django_db
+def test_continue_flowruns_queryset(flow, other_flow):
+    run = create_flowrun(flow)
+    other_run = create_flowrun(other_flow)
+    queryset = FlowRun.objects.filter(flow=other_flow)
+    assert continue_flowruns(workers=1, queryset=queryset) == 1
+    assert FlowRun.objects.get(id=run.id).status == FlowRun.Status.PENDING
+    assert FlowRun.objects.get(id=other_run.id).status == FlowRun.Status.DONE
+
+
+@pytest.mark.django_db
+def test_continue_flowruns_unknown_pool(flow):
+    create_flowrun(flow)
+    create_flowrun(flow)
+    with pytest.raises(ValueError):
+        continue_flowruns(workers=2, pool="fibers")
+    assert not FlowRun.objects.filter(status=FlowRun.Status.RUNNING).exists()
+
+
+@pytest.mark.django_db
+def test_claim_flowruns_sets_lease(flow):
+    create_flowrun(flow)
+    (run,) = claim_flowruns(1)
+    assert run.lease_owner
+    assert run.lease_expires_at > timezone.now()
+    execute_claimed_flowrun(run)
+    run.refresh_from_db()
+    assert run.lease_owner == ""
+    assert run.lease_expires_at is None
+
+
+@pytest.mark.django_db
+def test_recover_flowruns(flow, flow_action):
+    past = timezone.now() - timedelta(seconds=1)
+    stuck = create_flowrun(flow)
+    FlowRun.objects.filter(id=stuck.id).update(
+        status=FlowRun.Status.RUNNING,
+        action=flow_action,
+        lease_owner="dead-worker",
+        lease_expires_at=past,
+    )
+    not_started = create_flowrun(flow)
+    FlowRun.objects.filter(id=not_started.id).update(
+        status=FlowRun.Status.RUNNING,
+        lease_owner="dead-worker",
+        lease_expires_at=past,
+    )
+    alive = create_flowrun(flow)
+    FlowRun.objects.filter(id=alive.id).update(
+        status=FlowRun.Status.RUNNING,
+        lease_owner="live-worker",
+        lease_expires_at=timezone.now() + timedelta(minutes=5),
+    )
+
+    assert recover_flowruns() == 2
+
+    stuck.refresh_from_db()
+    assert stuck.status == FlowRun.Status.WAITING
+    assert stuck.repeat_action
+    assert stuck.continue_after is not None
+    assert stuck.lease_owner == ""
+    not_started.refresh_from_db()
+    assert not_started.status == FlowRun.Status.PENDING
+    alive.refresh_from_db()
+    assert alive.status == FlowRun.Status.RUNNING
+
+    continue_flowruns()
+    stuck.refresh_from_db()
+    assert stuck.outcome == FlowRun.Outcome.COMPLETE
+    assert stuck.state == {"foo": "bar"}
+
+
+@pytest.mark.django_db
+def test_recover_flowruns_claimed_but_not_started(flow, wait_trigger):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(WaitForTriggerAction, {"trigger": wait_trigger}),
+            ActionNode(SetStateAction, {"state": {"foo": "bar"}}),
+        ],
+    )
+    run = start_flowrun(flow)
+    trigger_flows(wait_trigger.trigger)
+    # The claim expires before the run is executed, e.g. a lost task
+    [claimed] = claim_flowruns(1, lease_duration=timedelta(seconds=-1))
+
+    assert recover_flowruns() == 1
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.WAITING
+    assert run.continue_after == claimed.continue_after
+    assert not run.repeat_action
+
+    assert continue_flowruns() == 1
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.DONE
+    assert run.state == {"foo": "bar"}
+
+
+@pytest.mark.django_db
+def test_recover_flowruns_without_lease(flow, settings):
+    migration = importlib.import_module(
+        "flowcontrol.migrations.0013_flowrun_lease_backfill"
+    )
+    settings.FLOWCONTROL_LEASE_SECONDS = 60
+    # Stuck in running before leases were added
+    stuck = create_flowrun(flow)
+    FlowRun.objects.filter(id=stuck.id).update(status=FlowRun.Status.RUNNING)
+    assert recover_flowruns() == 0
+
+    migration.set_missing_leases(apps, None)
+    stuck.refresh_from_db()
+    assert stuck.lease_expires_at is not None
+    assert recover_flowruns() == 0
+    assert recover_flowruns(now=timezone.now() + timedelta(minutes=2)) == 1
+    stuck.refresh_from_db()
+    assert stuck.status == FlowRun.Status.PENDING
+
+
+@pytest.mark.django_db
+def test_execution_stops_when_lease_is_lost(flow, settings, temp_registry):
+    @register_action
+    class StealLeaseAction(BaseAction):
+        def run(self, *, run, obj, config):
+            FlowRun.objects.filter(id=run.id).update(lease_owner="other-worker")
+
+    make_action_tree(
+        flow,
+        [
+            ActionNode(StealLeaseAction),
+            ActionNode(SetStateAction, {"state": {"foo": "bar"}}),
+        ],
+    )
+    settings.FLOWCONTROL_LEASE_SECONDS = 0
+    run = create_flowrun(flow)
+    execute_flowrun(run)
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.RUNNING
+    assert run.lease_owner == "other-worker"
+    assert run.state == {}
+
+
+@pytest.mark.django_db
+def test_reset_flowrun_running(flowrun):
+    flowrun.status = FlowRun.Status.RUNNING
+    flowrun.lease_expires_at = timezone.now() + timedelta(minutes=5)
+    with pytest.raises(NotImplementedError):
+        reset_flowrun(flowrun)
+    flowrun.lease_expires_at = timezone.now() - timedelta(minutes=5)
+    reset_flowrun(flowrun)
+    assert flowrun.status == FlowRun.Status.PENDING
+    assert flowrun.lease_expires_at is None
+
+
+@pytest.fixture
+def loop_flow(other_flow):
+    make_action_tree(
+        other_flow,
+        [
+            ActionNode(
+                ForLoopAction,
+                {"var_name": "i", "start": 0, "end": 4, "step": 1},
+                [
+                    ActionNode(
+                        UpdateStateAction, {"state": {"last": "i"}, "evaluate": True}
+                    )
+                ],
+            ),
+            ActionNode(SetStateAction, {"state": {"done": True}}),
+        ],
+    )
+    return other_flow
+
+
+@pytest.mark.django_db
+def test_execute_flowrun_step_budget(loop_flow):
+    run = create_flowrun(loop_flow)
+    execute_flowrun(run, step_budget=4)
+    run.refresh_from_db()
+    # for loop, child, return to loop, child
+    assert run.status == FlowRun.Status.WAITING
+    assert run.continue_after <= timezone.now()
+    assert run.returning
+    assert run.repeat_action
+    assert run.action.action == "ForLoopAction"
+    assert run.loop_counters == {str(run.action_id): 2}
+    assert run.state == {"i": 1, "last": 1}
+
+    slices = 1
+    while run.status == FlowRun.Status.WAITING:
+        execute_flowrun(run, step_budget=4)
+        run.refresh_from_db()
+        slices += 1
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state == {"done": True}
+    assert run.loop_counters == {}
+    assert not run.returning
+    # 9 loop steps and the final action
+    assert slices == 3
+
+
+@pytest.mark.django_db
+def test_execute_flowrun_time_budget(loop_flow, settings):
+    settings.FLOWCONTROL_TIME_BUDGET = 0
+    run = create_flowrun(loop_flow)
+    execute_flowrun(run)
+    run.refresh_from_db()
+    # At least one action is executed per slice
+    assert run.status == FlowRun.Status.WAITING
+    assert run.state == {"i": 0}
+    assert not run.returning
+
+
+@pytest.mark.django_db
+def test_hot_loop_protection_across_slices(loop_flow):
+    run = create_flowrun(loop_flow)
+    while run.status != FlowRun.Status.DONE:
+        execute_flowrun(run, max_hot_loop=3, step_budget=2)
+        run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.ERRORED
+    assert "Loop times 3 exceeded" in run.log
+
+
+@pytest.mark.django_db
+def test_continue_flowruns_requeues_sliced_runs(loop_flow, settings):
+    settings.FLOWCONTROL_STEP_BUDGET = 5
+    run = create_flowrun(loop_flow)
+    assert continue_flowruns() == 1
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.WAITING
+    assert continue_flowruns() == 1
+    assert continue_flowruns() == 0
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+
+
+@pytest.mark.django_db
+def test_action_context_shares_state(flow, user, temp_registry):
+    contexts = []
+
+    @register_action
+    class RecordContextAction(BaseAction):
+        def run(self, *, run, obj, config):
+            context = self.get_context()
+            contexts.append(context)
+            assert context["obj"] == user
+            assert context["object"] == user
+            with pytest.raises(TypeError):
+                context["foo"] = "baz"
+
+    make_action_tree(
+        flow,
+        [
+            ActionNode(RecordContextAction),
+            ActionNode(SetStateAction, {"state": {"foo": "bar"}}),
+            ActionNode(UpdateStateAction, {"state": {"copy": "foo"}, "evaluate": True}),
+            ActionNode(RecordContextAction),
+        ],
+    )
+    run = create_flowrun(flow, user, state={"ids": list(range(1000))})
+    execute_flowrun(run)
+
+    # One context per execution that follows the replaced state
+    assert contexts[0] is contexts[1]
+    assert dict(contexts[1]) == {
+        "foo": "bar",
+        "copy": "bar",
+        "obj": user,
+        "object": user,
+    }
+    assert run.state == {"foo": "bar", "copy": "bar"}
+
+
+def test_check_condition_does_not_copy_state(user):
+    state = {"object": "shadowed", "count": 2}
+    assert check_condition("count == 2 and object.username == 'testuser'", user, state)
+    assert check_condition("missing is None", None, None)
+    assert state == {"object": "shadowed", "count": 2}
+
+
+@pytest.mark.django_db
+def test_load_flowrun_objects(flow, other_flow, django_assert_num_queries):
+    users = [User.objects.create(username=f"user{index}") for index in range(3)]
+    group = Group.objects.create(name="group")
+    runs = [create_flowrun(flow, user) for user in users]
+    runs.append(create_flowrun(other_flow, group))
+    runs.append(create_flowrun(other_flow))
+    missing = runs[1]
+    users[1].delete()
+    runs = [FlowRun.objects.get(id=run.id) for run in runs]
+
+    # One query per content type and one update for the missing object
+    with django_assert_num_queries(3):
+        loaded = load_flowrun_objects(runs)
+        assert [run.content_object for run in loaded] == [
+            users[0],
+            users[2],
+            group,
+            None,
+        ]
+
+    missing = FlowRun.objects.get(id=missing.id)
+    assert missing.status == FlowRun.Status.DONE
+    assert missing.outcome == FlowRun.Outcome.OBSOLETE
+
+
+@pytest.mark.django_db
+def test_continue_flowruns_discards_missing_objects(flow, flow_action):
+    users = [User.objects.create(username=f"user{index}") for index in range(3)]
+    runs = [create_flowrun(flow, user) for user in users]
+    users[0].delete()
+    assert continue_flowruns() == 3
+    outcomes = [FlowRun.objects.get(id=run.id).outcome for run in runs]
+    assert outcomes == [
+        FlowRun.Outcome.OBSOLETE,
+        FlowRun.Outcome.COMPLETE,
+        FlowRun.Outcome.COMPLETE,
+    ]
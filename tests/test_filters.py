@@ -1,6 +1,9 @@
+from django.db.models import QuerySet
+from django.template import Context, Template
+
 import pytest
 
-from flowcontrol.templatetags.flowcontrol import get_flowruns
+from flowcontrol.templatetags.flowcontrol import get_all_flowruns, get_flowruns
 from flowcontrol.utils import evaluate_if
 
 
@@ -53,3 +56,13 @@ def test_add_more_filters(settings, fake_filter_module):
 def test_get_flowruns_filter(user, flowrun):
     runs = list(get_flowruns(user))
     assert runs == [flowrun]
+
+
+def test_get_flowruns_filter_returns_queryset(user, flowrun, django_assert_num_queries):
+    runs = get_flowruns(user)
+    assert isinstance(runs, QuerySet)
+    assert runs.filter(status=flowrun.status).exists()
+    template = Template("{% load flowcontrol %}{{ obj|get_flowruns|length }}")
+    with django_assert_num_queries(1):
+        assert template.render(Context({"obj": user})) == "1"
+    assert get_all_flowruns(user) == [flowrun]
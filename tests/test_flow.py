@@ -19,8 +19,13 @@ from flowcontrol.actions import (
     WhileLoopAction,
 )
 from flowcontrol.base import BaseAction, FlowDirective
-from flowcontrol.engine import create_flowrun, execute_flowrun, start_flowrun
-from flowcontrol.models import FlowRun
+from flowcontrol.engine import (
+    create_flowrun,
+    error_flowrun,
+    execute_flowrun,
+    start_flowrun,
+)
+from flowcontrol.models import FlowRun, FlowRunEvent
 from flowcontrol.models.core import Flow
 from flowcontrol.registry import action_registry, register_action
 from flowcontrol.utils import ActionNode, make_action_tree
@@ -722,3 +727,36 @@ def test_flowrun_logging(flowrun):
     flowrun.append_log("Test 2")
     flowrun.refresh_from_db()
     assert flowrun.log == "Test 1\nTest 2"
+
+
+@pytest.mark.django_db
+def test_flowrun_events_buffered_until_save(flowrun):
+    flowrun.append_log("Test 1", save=False)
+    flowrun.append_log("Test 2", save=False, level=logging.ERROR, data={"a": 1})
+    assert not flowrun.events.exists()
+    assert flowrun.log == "Test 1\nTest 2"
+
+    flowrun.save()
+    events = list(flowrun.events.all())
+    assert [event.message for event in events] == ["Test 1", "Test 2"]
+    assert events[1].level == FlowRunEvent.Level.ERROR
+    assert events[1].data == {"a": 1}
+
+
+@pytest.mark.django_db
+def test_flowrun_events_retention(flowrun, settings):
+    settings.FLOWCONTROL_RUN_EVENT_LIMIT = 3
+    for i in range(5):
+        flowrun.append_log(f"Test {i}")
+    assert flowrun.log == "Test 2\nTest 3\nTest 4"
+
+
+@pytest.mark.django_db
+def test_error_flowrun_logs_event(flow, flow_action):
+    run = create_flowrun(flow)
+    run.action = flow_action
+    error_flowrun(run, "Broken")
+    (event,) = run.events.all()
+    assert event.level == FlowRunEvent.Level.ERROR
+    assert event.action == flow_action
+    assert event.message == "Broken"
@@ -0,0 +1,47 @@
+from django.db import connection, transaction
+
+import pytest
+
+from flowcontrol.engine import get_flowruns_for_object, get_flowruns_waiting_on_trigger
+from flowcontrol.models import FlowRun
+
+
+def explain(queryset):
+    if connection.vendor == "postgresql":
+        with transaction.atomic():
+            # Tiny test tables are otherwise always scanned sequentially
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
+    return queryset.explain()
+
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(
+        connection.vendor not in ("sqlite", "postgresql"),
+        reason="Query plans are only checked on SQLite and PostgreSQL",
+    ),
+]
+
+
+def test_runnable_uses_index():
+    plan = explain(FlowRun.objects.get_runnable())
+    assert "flowrun_pending_idx" in plan
+    assert "flowrun_waiting_idx" in plan
+
+
+def test_waiting_on_trigger_uses_index(wait_trigger, user):
+    plan = explain(get_flowruns_waiting_on_trigger(wait_trigger, obj=user))
+    assert "flowrun_waiting_trigger_idx" in plan
+
+
+def test_flowruns_for_object_uses_index(user):
+    plan = explain(get_flowruns_for_object(user))
+    assert "flowrun_object_idx" in plan
+    plan = explain(
+        get_flowruns_for_object(user).filter(
+            status__in=(FlowRun.Status.PENDING, FlowRun.Status.WAITING)
+        )
+    )
+    assert "flowrun_object_idx" in plan
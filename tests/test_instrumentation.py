@@ -0,0 +1,133 @@
+import logging
+from io import StringIO
+
+from django.core.management import call_command
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from flowcontrol.actions import SetStateAction, UpdateStateAction, WhileLoopAction
+from flowcontrol.engine import aexecute_flowrun, create_flowrun, execute_flowrun
+from flowcontrol.instrumentation import (
+    ActionTiming,
+    CacheCollector,
+    InMemoryCollector,
+    get_collector,
+    get_collectors,
+    histogram_percentile,
+    percentile,
+)
+from flowcontrol.utils import ActionNode, make_action_tree
+
+COLLECTORS = [
+    "flowcontrol.instrumentation.InMemoryCollector",
+    "flowcontrol.instrumentation.LoggingCollector",
+    "flowcontrol.instrumentation.CacheCollector",
+]
+
+
+@pytest.fixture
+def collectors(settings):
+    settings.FLOWCONTROL_COLLECTORS = COLLECTORS
+    yield get_collectors()
+    get_collector(CacheCollector).clear()
+    settings.FLOWCONTROL_COLLECTORS = []
+
+
+@pytest.fixture
+def loop_flow(flow):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(SetStateAction, {"state": {"i": 0}}),
+            ActionNode(
+                WhileLoopAction,
+                {"condition": "i < 3"},
+                [
+                    ActionNode(
+                        UpdateStateAction, {"state": {"i": "i|add:1"}, "evaluate": True}
+                    ),
+                ],
+            ),
+        ],
+    )
+    return flow
+
+
+def test_no_collectors_by_default():
+    assert get_collectors() == ()
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile([], 0.5) == 0.0
+    assert histogram_percentile([0, 5, 5] + [0] * 13, 0.5) == 0.002
+    assert histogram_percentile([0, 5, 5] + [0] * 13, 0.95) == 0.005
+
+
+def test_in_memory_collector():
+    collector = InMemoryCollector()
+    for duration in (0.1, 0.2, 0.3):
+        collector.record(ActionTiming(1, 2, "SetStateAction", duration, 1, "CONTINUE"))
+    collector.record(ActionTiming(1, 3, "SetStateAction", 0.4, None, None, True))
+    (stats,) = collector.stats(by_class=True)
+    assert stats.key == ("SetStateAction",)
+    assert stats.count == 4
+    assert stats.errors == 1
+    assert stats.p50 == 0.2
+    assert stats.p95 == 0.4
+    assert stats.queries == 1
+    assert stats.directives == {"CONTINUE": 3}
+    assert len(collector.stats()) == 2
+
+
+@pytest.mark.django_db
+def test_actions_are_timed(loop_flow, collectors, caplog):
+    run = create_flowrun(loop_flow)
+    with caplog.at_level(logging.DEBUG, logger="flowcontrol.instrumentation"):
+        execute_flowrun(run)
+
+    memory = get_collector(InMemoryCollector)
+    stats = {row.key[0]: row for row in memory.stats(by_class=True)}
+    assert stats["SetStateAction"].count == 1
+    assert stats["UpdateStateAction"].count == 3
+    # Entered once, re-entered when returning from children twice, then left
+    assert stats["WhileLoopAction"].count == 4
+    assert stats["WhileLoopAction"].directives == {"ENTER": 3, "CONTINUE": 1}
+    assert stats["UpdateStateAction"].queries == 0
+    assert "Action UpdateStateAction" in caplog.text
+
+    cache_collector = get_collector(CacheCollector)
+    cache_collector.flush()
+    cache_stats = {row.key[0]: row for row in cache_collector.stats(by_class=True)}
+    assert cache_stats["WhileLoopAction"].count == 4
+    assert cache_stats["UpdateStateAction"].p95 > 0
+
+
+@pytest.mark.django_db
+def test_async_actions_are_timed(loop_flow, collectors):
+    run = create_flowrun(loop_flow)
+    async_to_sync(aexecute_flowrun)(run)
+    memory = get_collector(InMemoryCollector)
+    stats = {row.key[0]: row for row in memory.stats(by_class=True)}
+    assert stats["UpdateStateAction"].count == 3
+    assert stats["UpdateStateAction"].queries is None
+
+
+@pytest.mark.django_db
+def test_stats_command(loop_flow, collectors):
+    execute_flowrun(create_flowrun(loop_flow))
+    out = StringIO()
+    call_command("flowcontrol", "stats", stdout=out)
+    assert "WhileLoopAction" in out.getvalue()
+
+    out = StringIO()
+    call_command("flowcontrol", "stats", "--by-action", stdout=out)
+    assert f"{loop_flow.id} / " in out.getvalue()
+
+    call_command("flowcontrol", "stats", "--clear", stdout=StringIO())
+    out = StringIO()
+    call_command("flowcontrol", "stats", stdout=out)
+    assert "No action statistics collected." in out.getvalue()
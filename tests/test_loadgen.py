@@ -0,0 +1,89 @@
+from django.utils import timezone
+
+import pytest
+
+from flowcontrol.loadgen import SHAPES, LoadGenerator, build_action_nodes
+from flowcontrol.models import Flow, FlowRun, FlowRunArchive, Trigger
+
+from .test_commands import run_command
+
+
+def test_build_action_nodes():
+    assert len(build_action_nodes("linear", 4)) == 4
+    nested = build_action_nodes("nested", 3)
+    assert len(nested) == 1
+    assert len(nested[0].children[0].children[0].children) == 1
+    loop = build_action_nodes("loop", 7)
+    assert loop[0].kwargs["end"] == 7
+    with pytest.raises(ValueError):
+        build_action_nodes("spiral", 3)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("driver", ["run", "worker"])
+def test_load_generator(driver):
+    generator = LoadGenerator(
+        flows=3,
+        size=3,
+        rate=50,
+        duration=0.3,
+        waiting=6,
+        spread=0.1,
+        driver=driver,
+        seed=1,
+    )
+    flows = generator.setup()
+    assert [flow.name for flow in flows] == [
+        f"Loadgen {index} ({shape})" for index, shape in enumerate(SHAPES)
+    ]
+    assert Trigger.objects.count() == 3
+
+    report = generator.drive()
+    assert report.waiting == 6
+    assert report.triggered > 0
+    assert report.executed == FlowRun.objects.filter(status=FlowRun.Status.DONE).count()
+    assert report.executed + report.remaining == report.triggered + report.waiting
+    assert 0 <= report.latency_p50 <= report.latency_p95 <= report.latency_p99
+    assert not FlowRun.objects.exclude(
+        outcome__in=["", FlowRun.Outcome.COMPLETE]
+    ).exists()
+
+    # A flow of the user with a name like the generated ones is kept
+    user_flow = Flow.objects.create(name="Loadgen 0 (linear)")
+    assert generator.cleanup() == 3
+    assert list(Flow.objects.all()) == [user_flow]
+    assert not Trigger.objects.exists()
+
+
+@pytest.mark.django_db
+def test_load_generator_archived_runs(settings):
+    settings.FLOWCONTROL_ARCHIVE = "immediate"
+    generator = LoadGenerator(
+        flows=1, size=2, rate=0, duration=0.2, waiting=4, spread=0.01, seed=1
+    )
+    report = generator.drive()
+    assert report.executed == 4
+    assert report.remaining == 0
+    assert FlowRunArchive.objects.count() == 4
+    assert len(generator.get_latencies(timezone.now())) == 4
+
+
+@pytest.mark.django_db
+def test_loadgen_command():
+    output = run_command(
+        "loadgen",
+        "--flows",
+        "2",
+        "--shape",
+        "linear",
+        "--duration",
+        "0.2",
+        "--waiting",
+        "4",
+        "--spread",
+        "0.1",
+        "--cleanup",
+    )
+    assert "Triggered" in output
+    assert "Latency p50" in output
+    assert not Flow.objects.exists()
@@ -0,0 +1,171 @@
+import threading
+from datetime import timedelta
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.urls import reverse
+from django.utils import timezone
+
+import pytest
+
+from flowcontrol import metrics
+from flowcontrol.engine import (
+    cancel_flowruns_for_object,
+    create_flowrun,
+    execute_flowrun,
+    trigger_flows,
+)
+from flowcontrol.metrics import format_sample, get_oldest_due_age
+from flowcontrol.models import FlowRun
+
+
+@pytest.fixture
+def enabled_metrics(settings):
+    settings.FLOWCONTROL_METRICS = True
+    metrics.registry.clear()
+    yield metrics.registry
+    metrics.registry.clear()
+
+
+def test_format_sample():
+    assert format_sample("name", {}, 1.0) == "name 1"
+    assert format_sample("name", {"a": 'x"y'}, 0.5) == 'name{a="x\\"y"} 0.5'
+
+
+@pytest.mark.django_db
+def test_counters_disabled_by_default(flow):
+    metrics.registry.clear()
+    create_flowrun(flow)
+    assert metrics.runs_created.get(flow.id) == 0
+
+
+@pytest.mark.django_db
+def test_engine_counters(trigger, flow_action, user, enabled_metrics):
+    (run,) = trigger_flows("trigger_name", user)
+    execute_flowrun(run)
+    create_flowrun(trigger.flow, user)
+    cancel_flowruns_for_object(user)
+
+    assert metrics.trigger_calls.get("trigger_name") == 1
+    assert metrics.runs_created.get(trigger.flow.id) == 2
+    assert metrics.run_executions.get() == 1
+    assert metrics.actions_executed.get("SetStateAction") == 1
+    assert metrics.runs_finished.get(FlowRun.Outcome.COMPLETE) == 1
+    assert metrics.runs_finished.get(FlowRun.Outcome.CANCELED) == 1
+
+
+@pytest.mark.django_db
+def test_oldest_due_age(flow):
+    now = timezone.now()
+    assert get_oldest_due_age(now) is None
+    run = create_flowrun(flow)
+    run.status = FlowRun.Status.WAITING
+    run.continue_after = now - timedelta(seconds=30)
+    run.save()
+    FlowRun.objects.create(
+        flow=flow,
+        status=FlowRun.Status.WAITING,
+        continue_after=now + timedelta(seconds=30),
+    )
+    assert get_oldest_due_age(now) == 30
+
+
+@pytest.mark.django_db
+def test_metrics_view(admin_client, flow, enabled_metrics):
+    create_flowrun(flow)
+    response = admin_client.get(reverse("flowcontrol:metrics"))
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    content = response.content.decode()
+    assert "# TYPE flowcontrol_runs_created_total counter" in content
+    assert f'flowcontrol_runs_created_total{{flow="{flow.id}"}} 1' in content
+    assert "flowcontrol_runnable_runs 1" in content
+    assert "flowcontrol_oldest_due_run_age_seconds" in content
+    assert 'flowcontrol_trigger_cache_lookups_total{result="hit"}' in content
+
+
+@pytest.mark.django_db
+def test_metrics_view_disabled(client):
+    response = client.get(reverse("flowcontrol:metrics"))
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_metrics_view_token(client, settings, enabled_metrics):
+    settings.FLOWCONTROL_METRICS_TOKEN = "secret"
+    url = reverse("flowcontrol:metrics")
+    assert client.get(url).status_code == 403
+    response = client.get(url, headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_metrics_view_staff_only_without_token(client, user, enabled_metrics):
+    url = reverse("flowcontrol:metrics")
+    assert client.get(url).status_code == 403
+    client.force_login(user)
+    assert client.get(url).status_code == 403
+
+
+@pytest.mark.django_db
+def test_counters_add_up_across_processes(flow, enabled_metrics):
+    # A counter of the same name stands in for a worker process
+    worker_counter = metrics.CounterMetric(
+        "flowcontrol_runs_created_total", "", labelnames=("flow",)
+    )
+    worker_counter.inc(flow.id, amount=3)
+    assert metrics.runs_created.get(flow.id) == 0
+
+    worker_counter.flush()
+    metrics.runs_created.inc(flow.id)
+    assert metrics.runs_created.get(flow.id) == 4
+    assert f'flowcontrol_runs_created_total{{flow="{flow.id}"}} 4' in (
+        enabled_metrics.render()
+    )
+
+    enabled_metrics.clear()
+    assert worker_counter.get(flow.id) == 0
+
+
+@pytest.mark.django_db
+def test_concurrent_flushes_keep_all_series(monkeypatch, enabled_metrics):
+    counters = [
+        metrics.CounterMetric("flowcontrol_runs_created_total", "", ("flow",))
+        for _ in range(2)
+    ]
+    for index, counter in enumerate(counters):
+        for flow_id in range(10):
+            counter.inc(f"{index}-{flow_id}")
+
+    # Two workers flush in lock step: both finish every cache read or add
+    # before either continues
+    barrier = threading.Barrier(2, timeout=1)
+
+    def wait():
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            barrier.reset()
+
+    def interleaved(method):
+        def wrapper(self, *args, **kwargs):
+            wait()
+            result = method(self, *args, **kwargs)
+            wait()
+            return result
+
+        return wrapper
+
+    for name in ("add", "get"):
+        monkeypatch.setattr(LocMemCache, name, interleaved(getattr(LocMemCache, name)))
+    threads = [threading.Thread(target=counter.flush) for counter in counters]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    monkeypatch.undo()
+
+    samples = {
+        labels["flow"]: value for labels, value in metrics.runs_created.samples()
+    }
+    assert len(samples) == 20
+    assert set(samples.values()) == {1}
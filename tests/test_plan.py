@@ -0,0 +1,215 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+
+from flowcontrol import plan as plan_module
+from flowcontrol.actions import (
+    ForLoopAction,
+    IfAction,
+    SetStateAction,
+    UpdateStateAction,
+    WhileLoopAction,
+)
+from flowcontrol.engine import start_flowrun
+from flowcontrol.models import Flow, FlowRun
+from flowcontrol.plan import ActionConfigMap, get_flow_plan, load_action_configs
+from flowcontrol.utils import ActionNode, make_action_tree
+
+
+@pytest.fixture
+def nested_flow(flow, other_flow):
+    # Actions of another flow share the root level of the tree
+    make_action_tree(other_flow, [ActionNode(SetStateAction, {"state": {}})])
+    make_action_tree(
+        flow,
+        [
+            ActionNode(SetStateAction, {"state": {"i": 0}}),
+            ActionNode(
+                IfAction,
+                {"condition": "True"},
+                [
+                    ActionNode(SetStateAction, {"state": {"i": 1}}),
+                    ActionNode(SetStateAction, {"state": {"i": 2}}),
+                ],
+            ),
+            ActionNode(SetStateAction, {"state": {"i": 3}}),
+        ],
+    )
+    flow.refresh_from_db()
+    return flow
+
+
+@pytest.mark.django_db
+def test_plan_structure(nested_flow):
+    plan = get_flow_plan(nested_flow)
+    actions = list(nested_flow.actions.order_by("path"))
+    first, if_action, child_1, child_2, last = actions
+
+    assert len(plan) == 5
+    assert plan.first_action == first
+    assert plan.get_next_sibling(first) == if_action
+    assert plan.get_first_child(if_action) == child_1
+    assert plan.get_next_sibling(child_1) == child_2
+    assert plan.get_next_sibling(child_2) is None
+    assert plan.get_parent(child_2) == if_action
+    assert plan.get_next_sibling(if_action) == last
+    assert plan.get_next_sibling(last) is None
+    assert plan.get_parent(last) is None
+    assert plan.get_first_child(last) is None
+
+
+@pytest.mark.django_db
+def test_plan_is_cached(nested_flow, django_assert_num_queries):
+    plan = get_flow_plan(nested_flow)
+    with django_assert_num_queries(0):
+        assert get_flow_plan(nested_flow) is plan
+
+
+@pytest.mark.django_db
+def test_plan_invalidated_on_change(nested_flow):
+    plan = get_flow_plan(nested_flow)
+    last = plan.get_next_sibling(plan.get_next_sibling(plan.first_action))
+
+    make_action_tree(nested_flow, [ActionNode(SetStateAction, {"state": {}})])
+    nested_flow.refresh_from_db()
+    new_plan = get_flow_plan(nested_flow)
+    assert new_plan is not plan
+    assert len(new_plan) == 6
+
+    last.move(new_plan.first_action, pos="left")
+    nested_flow.refresh_from_db()
+    moved_plan = get_flow_plan(nested_flow)
+    assert moved_plan is not new_plan
+    assert moved_plan.first_action == last
+
+    last.delete()
+    nested_flow.refresh_from_db()
+    assert len(get_flow_plan(nested_flow)) == 5
+
+
+@pytest.mark.django_db
+def test_plan_stale_flow_instance(nested_flow, django_assert_num_queries):
+    # Flow instance kept by the trigger cache of this process
+    stale_flow = Flow.objects.get(id=nested_flow.id)
+    plan = get_flow_plan(stale_flow)
+
+    # Another process deletes the last action, this process still has the
+    # old plan cached
+    plan.get_next_sibling(plan.get_next_sibling(plan.first_action)).delete()
+    plan_module._plan_cache[nested_flow.id] = plan
+
+    assert get_flow_plan(stale_flow) is plan
+    # Stamp lookup and rebuild
+    with django_assert_num_queries(2):
+        assert get_flow_plan(stale_flow, check_stamp=True) is not plan
+    with django_assert_num_queries(1):
+        assert len(get_flow_plan(stale_flow, check_stamp=True)) == 4
+
+    plan_module._plan_cache[nested_flow.id] = plan
+    run = start_flowrun(stale_flow)
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state == {"i": 2}
+
+
+@pytest.mark.django_db
+def test_plan_other_flow_unaffected(nested_flow, other_flow):
+    other_flow = Flow.objects.get(id=other_flow.id)
+    plan = get_flow_plan(other_flow)
+    make_action_tree(nested_flow, [ActionNode(SetStateAction, {"state": {}})])
+    other_flow.refresh_from_db()
+    assert get_flow_plan(other_flow) is plan
+    assert len(plan) == 1
+
+
+@pytest.mark.django_db
+def test_loop_does_not_query_tree(flow, django_assert_max_num_queries):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(SetStateAction, {"state": {"i": 0}}),
+            ActionNode(
+                ForLoopAction,
+                {"end": 10},
+                [
+                    ActionNode(
+                        UpdateStateAction, {"state": {"i": "i|add:1"}, "evaluate": True}
+                    ),
+                ],
+            ),
+        ],
+    )
+    flow.refresh_from_db()
+    get_flow_plan(flow)
+    with django_assert_max_num_queries(30):
+        run = start_flowrun(flow)
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state["i"] == 10
+
+
+@pytest.mark.django_db
+def test_action_configs_loaded_once_per_model(flow):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(SetStateAction, {"state": {"i": 0}}),
+            ActionNode(
+                WhileLoopAction,
+                {"condition": "i < 20"},
+                [
+                    ActionNode(
+                        UpdateStateAction, {"state": {"i": "i|add:1"}, "evaluate": True}
+                    ),
+                ],
+            ),
+        ],
+    )
+    flow.refresh_from_db()
+    with CaptureQueriesContext(connection) as context:
+        run = start_flowrun(flow)
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert run.state["i"] == 20
+    condition_queries = [
+        query
+        for query in context.captured_queries
+        if 'FROM "flowcontrol_condition"' in query["sql"]
+    ]
+    state_queries = [
+        query
+        for query in context.captured_queries
+        if 'FROM "flowcontrol_state"' in query["sql"]
+    ]
+    assert len(condition_queries) == 1
+    assert len(state_queries) == 1
+
+
+@pytest.mark.django_db
+def test_action_config_map(flow_with_all_actions):
+    flow = Flow.objects.get(id=flow_with_all_actions.id)
+    plan = get_flow_plan(flow)
+    configs = ActionConfigMap(plan)
+    assert len(configs) == len(plan)
+    for action in plan.actions:
+        config = configs[action.id]
+        if action.get_action_class().model is None:
+            assert config is None
+        else:
+            assert config == action.get_config()
+    assert load_action_configs(plan.actions).keys() == {
+        action_id for action_id, config in configs.items() if config is not None
+    }
+
+
+@pytest.mark.django_db
+def test_flowrun_queryset_is_lean(nested_flow, django_assert_num_queries):
+    FlowRun.objects.create(flow=nested_flow)
+    with django_assert_num_queries(1):
+        list(FlowRun.objects.all())
+    with django_assert_num_queries(1):
+        (run,) = FlowRun.objects.with_flow()
+        assert run.flow == nested_flow
+    action_ids = [action.id for action in nested_flow.actions.order_by("path")]
+    with django_assert_num_queries(2):
+        (run,) = FlowRun.objects.with_plan()
+        assert [action.id for action in run.flow.actions.all()] == action_ids
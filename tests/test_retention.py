@@ -0,0 +1,124 @@
+import gzip
+import json
+from datetime import timedelta
+
+from django.utils import timezone
+
+import pytest
+
+from flowcontrol.engine import create_flowrun
+from flowcontrol.models import FlowRun, FlowRunEvent
+from flowcontrol.retention import get_purgeable_flowruns, purge_flowruns
+
+from .test_commands import run_command
+
+
+def make_done_run(flow, days_ago, outcome=FlowRun.Outcome.COMPLETE):
+    run = create_flowrun(flow)
+    run.status = FlowRun.Status.DONE
+    run.outcome = outcome
+    run.done_at = timezone.now() - timedelta(days=days_ago)
+    run.append_log("Finished", save=False)
+    run.save()
+    return run
+
+
+@pytest.mark.django_db
+def test_purgeable_flowruns_without_retention(other_flow):
+    make_done_run(other_flow, 1000)
+    assert not get_purgeable_flowruns().exists()
+
+
+@pytest.mark.django_db
+def test_purgeable_flowruns_retention(flow, other_flow, settings):
+    settings.FLOWCONTROL_RETENTION_DAYS = 30
+    settings.FLOWCONTROL_RETENTION_DAYS_BY_OUTCOME = {"errored": 90}
+    old = make_done_run(other_flow, 40)
+    make_done_run(other_flow, 10)
+    make_done_run(other_flow, 40, outcome=FlowRun.Outcome.ERRORED)
+    old_errored = make_done_run(other_flow, 100, outcome=FlowRun.Outcome.ERRORED)
+    create_flowrun(other_flow)
+    assert set(get_purgeable_flowruns()) == {old, old_errored}
+
+    # Flow retention overrides the settings for all outcomes
+    flow.retention_days = 5
+    flow.save()
+    flow_run = make_done_run(flow, 6, outcome=FlowRun.Outcome.ERRORED)
+    make_done_run(flow, 4)
+    assert set(get_purgeable_flowruns()) == {old, old_errored, flow_run}
+    assert set(get_purgeable_flowruns(default_days=5)) == {
+        old,
+        old_errored,
+        flow_run,
+        FlowRun.objects.get(
+            flow=other_flow, outcome="complete", done_at__gt=old.done_at
+        ),
+    }
+
+
+@pytest.mark.django_db
+def test_purge_keeps_runs_counted_per_object(flow, user, settings):
+    settings.FLOWCONTROL_RETENTION_DAYS = 30
+    flow.max_per_object = 1
+    flow.save()
+    run = create_flowrun(flow, user)
+    FlowRun.objects.filter(id=run.id).update(
+        status=FlowRun.Status.DONE,
+        outcome=FlowRun.Outcome.COMPLETE,
+        done_at=timezone.now() - timedelta(days=40),
+    )
+
+    assert not get_purgeable_flowruns().exists()
+    assert purge_flowruns(FlowRun.objects.all()) == 0
+    assert FlowRun.objects.filter(id=run.id).exists()
+    assert create_flowrun(flow, user) is None
+
+
+@pytest.mark.django_db
+def test_purge_flowruns_in_chunks(other_flow, settings):
+    settings.FLOWCONTROL_RETENTION_DAYS = 1
+    runs = [make_done_run(other_flow, 2) for _ in range(5)]
+    kept = make_done_run(other_flow, 0)
+    assert purge_flowruns(dry_run=True) == 5
+    assert FlowRun.objects.count() == 6
+
+    assert purge_flowruns(chunk_size=2) == 5
+    assert list(FlowRun.objects.all()) == [kept]
+    assert not FlowRunEvent.objects.filter(run_id__in=[run.id for run in runs]).exists()
+    assert FlowRunEvent.objects.filter(run=kept).exists()
+
+
+@pytest.mark.django_db
+def test_purge_flowruns_export(other_flow, settings, tmp_path):
+    settings.FLOWCONTROL_RETENTION_DAYS = 1
+    runs = [make_done_run(other_flow, 2) for _ in range(3)]
+    path = tmp_path / "purged.jsonl.gz"
+    assert purge_flowruns(chunk_size=2, export_path=str(path)) == 3
+    with gzip.open(path, "rt") as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["id"] for row in rows] == [run.id for run in runs]
+    assert rows[0]["flow_id"] == other_flow.id
+    assert rows[0]["outcome"] == "complete"
+    assert [event["message"] for event in rows[0]["events"]] == ["Finished"]
+
+
+@pytest.mark.django_db
+def test_purge_command(flow, other_flow):
+    make_done_run(flow, 10)
+    make_done_run(other_flow, 10)
+    make_done_run(other_flow, 10, outcome=FlowRun.Outcome.ERRORED)
+    output = run_command("purge", "--days", "5", "--dry-run")
+    assert "3 flow runs would be purged." in output
+    output = run_command(
+        "purge",
+        "--days",
+        "5",
+        "--outcome-days",
+        "errored=30",
+        "--flow",
+        str(other_flow.id),
+    )
+    assert "Purged 1 flow runs." in output
+    assert FlowRun.objects.count() == 2
+    with pytest.raises(Exception, match="Invalid --outcome-days value"):
+        run_command("purge", "--outcome-days", "lost=5")
@@ -0,0 +1,48 @@
+import pytest
+
+from flowcontrol.engine import create_flowrun
+from flowcontrol.models import FlowRun
+
+tasks = pytest.importorskip("flowcontrol.tasks", exc_type=ImportError)
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+
+    def apply_async(args, **kwargs):
+        calls.append((args, kwargs))
+
+    monkeypatch.setattr(tasks.execute_flowruns_task, "apply_async", apply_async)
+    return calls
+
+
+@pytest.mark.django_db
+def test_continue_flowruns_task_enqueues_chunks(flow, settings, enqueued):
+    settings.FLOWCONTROL_TASK_CHUNK_SIZE = 2
+    settings.FLOWCONTROL_TASK_QUEUE = "flowcontrol"
+    runs = [create_flowrun(flow) for _ in range(5)]
+
+    assert tasks.continue_flowruns_task() == 5
+
+    assert [len(args[1]) for args, _kwargs in enqueued] == [2, 2, 1]
+    assert {kwargs["queue"] for _args, kwargs in enqueued} == {"flowcontrol"}
+    claimed_ids = [run_id for args, _kwargs in enqueued for run_id, _ in args[1]]
+    assert sorted(claimed_ids) == [run.id for run in runs]
+    assert not FlowRun.objects.exclude(status=FlowRun.Status.RUNNING).exists()
+
+    # Claimed runs are not enqueued again by the next tick
+    assert tasks.continue_flowruns_task() == 0
+    assert len(enqueued) == 3
+
+
+@pytest.mark.django_db
+def test_execute_flowruns_task(flow, flow_action, enqueued):
+    run = create_flowrun(flow)
+    tasks.continue_flowruns_task()
+    [(args, _kwargs)] = enqueued
+
+    assert tasks.execute_flowruns_task(*args) == 1
+    run.refresh_from_db()
+    assert run.status == FlowRun.Status.DONE
+    assert run.state == {"foo": "bar"}
@@ -1,10 +1,20 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
 from django.utils import timezone
 
 import pytest
 
 from flowcontrol.actions import WaitForTriggerAction
-from flowcontrol.engine import create_flowrun, start_flowrun, trigger_flows
+from flowcontrol.engine import (
+    create_flowrun,
+    start_flowrun,
+    trigger_flows,
+    trigger_flows_bulk,
+)
 from flowcontrol.models.core import FlowRun, Trigger
+from flowcontrol.triggers import get_active_triggers
 from flowcontrol.utils import ActionNode, make_action_tree
 
 
@@ -161,3 +171,135 @@ def test_trigger_reset_to_action_still_running(trigger, flow, flow_action):
 
     with pytest.raises(NotImplementedError):
         trigger_flows(trigger.trigger)
+
+
+@pytest.fixture
+def users(db):
+    return [User.objects.create(username=f"user{i}") for i in range(5)]
+
+
+@pytest.mark.django_db
+def test_trigger_flows_bulk(trigger, users, django_assert_max_num_queries):
+    with django_assert_max_num_queries(4):
+        results = trigger_flows_bulk(trigger.trigger, users, state={"a": 1})
+    assert [obj for obj, _runs in results] == users
+    for obj, runs in results:
+        assert len(runs) == 1
+        run = runs[0]
+        assert run.pk is not None
+        assert run.content_object == obj
+        assert run.trigger == trigger
+        assert run.state == {"a": 1}
+        assert run.status == FlowRun.Status.PENDING
+
+    # max_concurrent_per_object defaults to 1
+    results = trigger_flows_bulk(trigger.trigger, User.objects.all())
+    assert all(runs == [] for _obj, runs in results)
+    assert FlowRun.objects.count() == len(users)
+
+
+@pytest.mark.django_db
+def test_trigger_flows_bulk_limits(trigger, users):
+    flow = trigger.flow
+    flow.max_concurrent = 3
+    flow.max_concurrent_per_object = 0
+    flow.save()
+    create_flowrun(flow, users[0])
+
+    results = trigger_flows_bulk(trigger.trigger, users, chunk_size=2)
+    assert [len(runs) for _obj, runs in results] == [1, 1, 0, 0, 0]
+
+    flow.max_concurrent = 0
+    flow.max_per_object = 2
+    flow.save()
+    results = trigger_flows_bulk(trigger.trigger, users + users)
+    assert [len(runs) for _obj, runs in results] == [0, 1, 1, 1, 1, 0, 0, 1, 1, 1]
+
+
+@pytest.mark.django_db
+def test_trigger_flows_bulk_condition(conditional_trigger, users):
+    users[1].username = "example"
+    results = trigger_flows_bulk(conditional_trigger.trigger, users)
+    assert [len(runs) for _obj, runs in results] == [0, 1, 0, 0, 0]
+
+
+@pytest.mark.django_db
+def test_trigger_flows_bulk_waiting(flow, wait_trigger, users):
+    make_action_tree(
+        flow,
+        [
+            ActionNode(
+                WaitForTriggerAction, {"trigger": wait_trigger, "require_object": True}
+            ),
+        ],
+    )
+    waiting = [start_flowrun(flow, obj=user) for user in users[:2]]
+    assert all(run.status == FlowRun.Status.WAITING for run in waiting)
+
+    results = trigger_flows_bulk(wait_trigger.trigger, users[1:])
+    assert [[run.id for run in runs] for _obj, runs in results] == [
+        [waiting[1].id],
+        [],
+        [],
+        [],
+    ]
+    waiting[0].refresh_from_db()
+    assert waiting[0].waiting_trigger == wait_trigger
+    waiting[1].refresh_from_db()
+    assert waiting[1].waiting_trigger is None
+    assert waiting[1].continue_after is not None
+
+
+@pytest.mark.django_db
+def test_trigger_cache_no_match_without_query(django_assert_num_queries):
+    assert trigger_flows("unknown_trigger") == []
+    with django_assert_num_queries(0):
+        assert trigger_flows("unknown_trigger") == []
+
+
+@pytest.mark.django_db
+def test_trigger_cache_invalidated_on_save(trigger):
+    assert get_active_triggers(trigger.trigger) == (trigger,)
+    trigger.active_at = None
+    trigger.save()
+    assert get_active_triggers(trigger.trigger) == ()
+    trigger.active_at = timezone.now()
+    trigger.save()
+    assert get_active_triggers(trigger.trigger) == (trigger,)
+    trigger.flow.active_at = None
+    trigger.flow.save()
+    assert get_active_triggers(trigger.trigger) == ()
+
+
+@pytest.mark.django_db
+def test_trigger_cache_expires_at_activation(flow):
+    now = timezone.now()
+    trigger = Trigger.objects.create(
+        flow=flow, trigger="trigger_name", active_at=now + timedelta(hours=1)
+    )
+    assert get_active_triggers(trigger.trigger) == ()
+    with mock.patch(
+        "flowcontrol.triggers.timezone.now", return_value=now + timedelta(hours=2)
+    ):
+        assert get_active_triggers(trigger.trigger) == (trigger,)
+
+
+@pytest.mark.django_db
+def test_trigger_cache_disabled(trigger, settings, django_assert_num_queries):
+    settings.FLOWCONTROL_TRIGGER_CACHE_TIMEOUT = 0
+    get_active_triggers(trigger.trigger)
+    with django_assert_num_queries(1):
+        get_active_triggers(trigger.trigger)
+
+
+@pytest.mark.django_db
+def test_trigger_flows_priority(trigger, user, users):
+    trigger.flow.priority = 3
+    trigger.flow.save()
+    (run,) = trigger_flows(trigger.trigger, user)
+    assert run.priority == 3
+    (run,) = trigger_flows(trigger.trigger, users[0], priority=7)
+    assert run.priority == 7
+    results = trigger_flows_bulk(trigger.trigger, users[1:], priority=-2)
+    assert {runs[0].priority for _obj, runs in results} == {-2}
+    assert FlowRun.objects.filter(priority=-2).count() == len(users) - 1
@@ -0,0 +1,87 @@
+import pytest
+
+from flowcontrol.utils import (
+    ExpressionCache,
+    evaluate_if,
+    expression_cache,
+    get_engine,
+)
+
+
+def test_expression_cache_hits_and_misses():
+    cache = ExpressionCache(maxsize=10)
+    calls = []
+
+    def compile_func():
+        calls.append(1)
+        return object()
+
+    first = cache.get_or_compile("a", compile_func)
+    assert cache.get_or_compile("a", compile_func) is first
+    assert len(calls) == 1
+    info = cache.info()
+    assert info.hits == 1
+    assert info.misses == 1
+    assert info.currsize == 1
+
+
+def test_expression_cache_evicts_least_recently_used():
+    cache = ExpressionCache(maxsize=2)
+    cache.get_or_compile("a", object)
+    cache.get_or_compile("b", object)
+    cache.get_or_compile("a", object)
+    cache.get_or_compile("c", object)
+    info = cache.info()
+    assert info.evictions == 1
+    assert info.currsize == 2
+    # "b" was evicted, "a" was used more recently
+    cache.get_or_compile("a", object)
+    assert cache.info().hits == 2
+    cache.get_or_compile("b", object)
+    assert cache.info().misses == 4
+
+
+def test_expression_cache_disabled():
+    cache = ExpressionCache(maxsize=0)
+    cache.get_or_compile("a", object)
+    assert cache.info().currsize == 0
+
+
+def test_expression_cache_does_not_cache_errors():
+    cache = ExpressionCache(maxsize=10)
+
+    def compile_func():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        cache.get_or_compile("a", compile_func)
+    assert cache.info().currsize == 0
+
+
+def test_evaluate_if_uses_cache():
+    expression_cache.clear()
+    expression_cache.reset_stats()
+    assert evaluate_if("a > 1", {"a": 2}) is True
+    assert evaluate_if("a > 1", {"a": 0}) is False
+    info = expression_cache.info()
+    assert info.misses == 1
+    assert info.hits == 1
+
+
+def test_expression_cache_cleared_on_filter_setting_change(settings):
+    evaluate_if("a > 1", {"a": 2})
+    assert expression_cache.info().currsize > 0
+    settings.FLOWCONTROL_TEMPLATE_FILTERS = []
+    assert expression_cache.info().currsize == 0
+
+
+def test_engine_is_shared():
+    assert get_engine() is get_engine()
+
+
+def test_engine_rebuilt_on_filter_setting_change(settings):
+    engine = get_engine()
+    settings.FLOWCONTROL_DISABLE_DEFAULT_FILTERS = True
+    new_engine = get_engine()
+    assert new_engine is not engine
+    assert not any("startswith" in lib.filters for lib in new_engine.template_builtins)
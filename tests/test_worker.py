@@ -0,0 +1,174 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+import pytest
+
+from flowcontrol.engine import claim_flowruns, create_flowrun, suspend_flowrun
+from flowcontrol.models import FlowRun
+from flowcontrol.wakeup import Wakeup, wakeup
+from flowcontrol.worker import FlowRunWorker
+
+
+@pytest.fixture
+def listening():
+    wakeup.listening = True
+    wakeup.prepare()
+    yield wakeup
+    wakeup.listening = False
+
+
+@pytest.mark.django_db
+def test_wakeup_notify_earlier(django_capture_on_commit_callbacks):
+    local_wakeup = Wakeup()
+    local_wakeup.listening = True
+    now = timezone.now()
+    local_wakeup.wait(now + timedelta(minutes=1), 0)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        local_wakeup.notify(now + timedelta(minutes=2))
+    assert not local_wakeup.wait(now + timedelta(minutes=1), 0)
+    with django_capture_on_commit_callbacks(execute=True):
+        local_wakeup.notify(now + timedelta(seconds=30))
+    assert local_wakeup.wait(now + timedelta(minutes=1), 0)
+
+    local_wakeup.prepare()
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        local_wakeup.notify()
+    assert len(callbacks) == 1
+    assert local_wakeup.wait(None, 0)
+
+
+def test_wakeup_not_listening():
+    local_wakeup = Wakeup()
+    local_wakeup.notify()
+    assert not local_wakeup.wait(None, 0)
+
+
+@pytest.mark.django_db
+def test_worker_next_wake(flow):
+    worker = FlowRunWorker()
+    assert worker.get_next_wake() is None
+    assert worker.get_sleep_time(None) == worker.max_sleep
+
+    later = timezone.now() + timedelta(seconds=30)
+    run = create_flowrun(flow)
+    run.status = FlowRun.Status.WAITING
+    run.continue_after = later
+    run.save()
+    assert worker.get_next_wake() == later
+    assert 0 < worker.get_sleep_time(later) <= 30
+
+    create_flowrun(flow)
+    assert worker.get_next_wake() <= timezone.now()
+
+
+@pytest.mark.django_db
+def test_worker_next_wake_skips_leased_runs(flow):
+    worker = FlowRunWorker()
+    lease_expires_at = timezone.now() + timedelta(seconds=30)
+    run = create_flowrun(flow)
+    FlowRun.objects.filter(id=run.id).update(
+        lease_owner="other-worker", lease_expires_at=lease_expires_at
+    )
+    assert worker.get_next_wake() == lease_expires_at
+
+
+@pytest.mark.django_db
+def test_wakeup_from_other_process(settings, django_capture_on_commit_callbacks):
+    settings.FLOWCONTROL_WORKER_WAKEUP_CACHE = "default"
+    worker_wakeup = Wakeup()
+    worker_wakeup.poll_interval = 0.01
+    worker_wakeup.listening = True
+    worker_wakeup.prepare()
+    assert not worker_wakeup.wait(None, 0.02)
+
+    # A web process has no listening worker
+    with django_capture_on_commit_callbacks(execute=True):
+        Wakeup().notify()
+    assert worker_wakeup.wait(None, 1)
+
+    worker_wakeup.prepare()
+    assert not worker_wakeup.wait(None, 0.02)
+
+
+def test_wakeup_other_process_without_cache():
+    worker_wakeup = Wakeup()
+    worker_wakeup.listening = True
+    worker_wakeup.prepare()
+    Wakeup().notify()
+    assert not worker_wakeup.wait(None, 0)
+
+
+@pytest.mark.django_db
+def test_worker_run_once(flow, flow_action):
+    runs = [create_flowrun(flow) for _ in range(3)]
+    worker = FlowRunWorker(batch_size=2)
+    assert worker.run_once() == 3
+    for run in runs:
+        run.refresh_from_db()
+        assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert worker.run_once() == 0
+
+
+@pytest.mark.django_db
+def test_worker_run_once_finishes_invalid_runs(flow, flow_action, monkeypatch):
+    invalid = create_flowrun(flow)
+    # Waiting run without action can never be executed
+    FlowRun.objects.filter(id=invalid.id).update(
+        status=FlowRun.Status.WAITING, continue_after=timezone.now()
+    )
+    run = create_flowrun(flow)
+    claims = []
+    monkeypatch.setattr(
+        "flowcontrol.worker.claim_flowruns",
+        lambda *args, **kwargs: claims.append(1) or claim_flowruns(*args, **kwargs),
+    )
+    worker = FlowRunWorker(batch_size=1)
+    assert worker.run_once() == 2
+    # Two batches and the empty claim that ends the pass
+    assert len(claims) == 3
+    invalid.refresh_from_db()
+    assert invalid.outcome == FlowRun.Outcome.ERRORED
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+
+
+@pytest.mark.django_db
+def test_worker_stop_releases_claims(flow, flow_action):
+    runs = [create_flowrun(flow) for _ in range(2)]
+    worker = FlowRunWorker(batch_size=2)
+    worker.stopping = True
+    assert worker.run_once() == 0
+    for run in runs:
+        run.refresh_from_db()
+        assert run.status == FlowRun.Status.PENDING
+
+
+@pytest.mark.django_db
+def test_worker_run_until_stopped(flow, flow_action, monkeypatch):
+    run = create_flowrun(flow)
+    worker = FlowRunWorker()
+    monkeypatch.setattr(worker, "sleep", worker.stop)
+    worker.run()
+    run.refresh_from_db()
+    assert run.outcome == FlowRun.Outcome.COMPLETE
+    assert worker.executed == 1
+    assert not wakeup.listening
+
+
+@pytest.mark.django_db
+def test_engine_notifies_worker(
+    flow, flowrun, listening, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        create_flowrun(flow)
+    assert listening.wait(None, 0)
+
+    listening.prepare()
+    later = timezone.now() + timedelta(minutes=10)
+    listening.wait(timezone.now() + timedelta(minutes=1), 0)
+    flowrun.continue_after = later
+    with django_capture_on_commit_callbacks(execute=True):
+        suspend_flowrun(flowrun)
+    assert not listening.wait(timezone.now() + timedelta(minutes=1), 0)